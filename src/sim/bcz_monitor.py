@@ -23,10 +23,14 @@ import bcolz as bz
 import time
 import os
 import logging
+import threading
+from Queue import Queue
 import pyrheautils
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_BLOCK_ROWS = 8192
+
 
 # this is a dictionary linking anything 
 TrackableValues = {}
@@ -51,8 +55,48 @@ def generateBCZDirName(baseName, patchId):
     return baseName + '_' + str(patchId)
 
 
+class BlockWriterThread(threading.Thread):
+    """
+    Appends blocks of column arrays to a ctable in the background.  Blocks are fed
+    through a Queue; a None block causes the thread to exit.
+    """
+    def __init__(self, ctable):
+        super(BlockWriterThread, self).__init__(name='bcz_block_writer')
+        self.daemon = True
+        self.ctable = ctable
+        self.queue = Queue()
+        self.exc = None
+
+    def run(self):
+        while True:
+            cols = self.queue.get()
+            try:
+                if cols is None:
+                    break
+                if self.exc is None:
+                    self.ctable.append(cols)
+            except Exception, e:
+                logger.error('bcz block writer failed: %s', e)
+                self.exc = e
+            finally:
+                self.queue.task_done()
+
+    def wait(self):
+        """Block until all queued blocks have been written"""
+        self.queue.join()
+        if self.exc is not None:
+            raise RuntimeError('bcz block writer failed: %s' % self.exc)
+
+
 class Monitor(object):
-    def __init__(self, filenameBase, patch, stopFn=None, nextStop=None):
+    def __init__(self, filenameBase, patch, stopFn=None, nextStop=None,
+                 blockRows=None, threaded=False):
+        """
+        Rows are buffered in per-column arrays of length blockRows and appended to the
+        ctable a block at a time.  If threaded is True the appends happen in a
+        background thread.  Data is only flushed to disk when a caller asks for it,
+        e.g. at a tau adjustment stop or at shutdown.
+        """
         self.patch = patch
         self.nextStop = nextStop
         self.stopFn = stopFn
@@ -69,6 +113,11 @@ class Monitor(object):
         self.uniqueID = str(os.getpid()) + "_" + str(patch.patchId) + "_" + str(time.time())
         self.registeredFns = []
         self.registeredKeys = set()
+        self.blockRows = blockRows if blockRows else DEFAULT_BLOCK_ROWS
+        self.threaded = threaded
+        self.writerThread = None
+        self.colBufL = None
+        self.nBuffered = 0
 
     def getFilename(self):
         return self.filename
@@ -98,31 +147,64 @@ class Monitor(object):
         bz.set_nthreads(3)
         self.pthData = bz.ctable(ra, rootdir=self.filename, mode="w",
                                  auto_flush=False, chunklen=256*1024)
+        self._allocBuffers()
+        if self.threaded:
+            self.writerThread = BlockWriterThread(self.pthData)
+            self.writerThread.start()
+
+    def _allocBuffers(self):
+        self.colBufL = [np.zeros(self.blockRows, dtype=tp)
+                        for nm, tp in self.dtype]  # @UnusedVariable
+        self.nBuffered = 0
+
+    def _appendBlock(self):
+        """
+        Hand the buffered rows to the ctable, either directly or via the writer thread
+        """
+        if self.nBuffered == 0:
+            return
+        if self.writerThread is None:
+            self.pthData.append([col[:self.nBuffered] for col in self.colBufL])
+            self.nBuffered = 0
+        else:
+            # The writer thread owns the old buffers once they are queued
+            self.writerThread.queue.put([col[:self.nBuffered] for col in self.colBufL])
+            self._allocBuffers()
 
     def collectData(self, timeNow):
         """
         traverses each ward of each facility and updates pthData
         """
-
+        nPthStatus = len(PthStatus.names)
+        colBufL = self.colBufL
         for fac in self.patch.allFacilities:
             for ward in fac.getWards():
+                idx = self.nBuffered
                 pPC = ward.iA.getPatientPthCounts(timeNow)
-                counts = []
+                colBufL[0][idx] = fac.abbrev
+                colBufL[1][idx] = CareTier.names[ward.tier]
+                colBufL[2][idx] = ward.wardNum
+                colBufL[3][idx] = timeNow
                 total = 0
-                for i in xrange(len(PthStatus.names)):
-                    counts.append(pPC[i])
+                for i in xrange(nPthStatus):
+                    colBufL[4 + i][idx] = pPC[i]
                     total += pPC[i]
-                counts.append(total)
-                row = [fac.abbrev, CareTier.names[ward.tier], ward.wardNum, timeNow] + counts
+                colBufL[4 + nPthStatus][idx] = total
+                offset = 5 + nPthStatus
                 for fn in self.registeredFns:
-                    row.extend(fn(ward, timeNow))
-                self.pthData.append(row)
+                    for val in fn(ward, timeNow):
+                        colBufL[offset][idx] = val
+                        offset += 1
+                self.nBuffered += 1
+                if self.nBuffered == self.blockRows:
+                    self._appendBlock()
+                    colBufL = self.colBufL
 
-        self.flush()
         self.pthDataDF = None
 
     def getPthData(self):
         if self.pthDataDF is None:
+            self.flush()
             self.pthDataDF = self.pthData.todataframe()
         return self.pthDataDF
 
@@ -147,9 +229,19 @@ class Monitor(object):
         return fn
 
     def writeData(self):
+        """
+        Flush everything and stop the writer thread, if any.  Call this at shutdown.
+        """
         self.flush()
+        if self.writerThread is not None:
+            self.writerThread.queue.put(None)
+            self.writerThread.join()
+            self.writerThread = None
 
     def flush(self):
+        self._appendBlock()
+        if self.writerThread is not None:
+            self.writerThread.wait()
         self.pthData.flush()
         
     def XXXwriteData(self, fileName):
@@ -0,0 +1,432 @@
+#! /usr/bin/env python
+
+###################################################################################
+# Copyright   2018, Pittsburgh Supercomputing Center (PSC).  All Rights Reserved. #
+# =============================================================================== #
+#                                                                                 #
+# Permission to use, copy, and modify this software and its documentation without #
+# fee for personal use within your organization is hereby granted, provided that  #
+# the above copyright notice is preserved in all copies and that the copyright    #
+# and this permission notice appear in supporting documentation.  All other       #
+# restrictions and obligations are defined in the GNU Affero General Public       #
+# License v3 (AGPL-3.0) located at http://www.gnu.org/licenses/agpl-3.0.html  A   #
+# copy of the license is also provided in the top level of the source directory,  #
+# in the file LICENSE.txt.                                                        #
+#                                                                                 #
+###################################################################################
+
+"""
+Performance benchmarks for pyrhea.
+
+The run benchmarks execute the tiny and week-long run configurations on a single rank
+with a fixed seed, using 'pyrhea.py --timings' to collect wall time per simulated day,
+agent-day throughput, peak RSS and the time taken by each phase of the run.  Each
+configuration is run --repeat times and the run with the fastest daily loop is kept.
+Configurations which start a scenario, like week_run_ChicagoLand.yaml, also report the
+wall time of the first day after the start, when the pathogen's cached trees for the
+facilities with newly active treatment policies are rebuilt.
+Note that a community cache which has to be regenerated makes initialization much
+slower, so the first run of a ChicagoLand configuration should not be used as a
+baseline.
+
+The microbenchmarks time some of the operations which dominate the daily loop:
+BayesTree.traverse, CachedCDFGenerator.intervalProb, freeze-drying and thawing of
+community agents, and Facility.getPatientRecord.
+
+Results are written as json.  Given --compare, the results are checked against a
+stored baseline and any figure which is worse by more than --tolerance is reported as
+a regression, in which case the exit status is 1.  A typical session:
+
+    python benchmark.py -o baseline.json
+    ... make changes ...
+    python benchmark.py -o new.json --compare baseline.json
+
+or, to compare two existing results files without running anything:
+
+    python benchmark.py --compareOnly new.json --compare baseline.json
+"""
+
+import sys
+import os
+import os.path
+import optparse
+import logging
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import timeit
+import json
+import unittest
+
+LOGGER = logging.getLogger(__name__)
+
+SIM_DIR = os.path.abspath(os.path.dirname(__file__))
+DEFAULT_CONFIGS = ['tiny_run.yaml', 'tiny_run_2013.yaml', 'tiny_run_ChicagoLand.yaml',
+                   'week_run_OC.yaml', 'week_run_ChicagoLand.yaml']
+DEFAULT_SEED = 1234
+
+# For each figure compared against the baseline, True if bigger is better
+RUN_METRICS = [('secondsPerDay', False),
+               ('agentDaysPerSecond', True),
+               ('peakRSSMB', False),
+               ('phases.startup', False),
+               ('phases.initialization', False),
+               ('phases.communityCacheLoad', False),
+               ('phases.dailyLoop', False),
+               ('phases.notesWriting', False),
+               ('scenarioStartDaySeconds', False)]
+# Phases and days shorter than this are too noisy to compare
+MIN_COMPARABLE_SECONDS = 0.5
+
+
+def runConfig(configName, seed, python, workDir, pyrheaOpts=None):
+    """
+    Run pyrhea once on a single rank; returns the contents of its --timings file, or
+    None if the run failed.
+    """
+    tag = os.path.splitext(os.path.basename(configName))[0]
+    timingsName = os.path.join(workDir, '%s_timings.json' % tag)
+    logName = os.path.join(workDir, '%s_log.txt' % tag)
+    cmd = ([python, 'pyrhea.py', '--seed', str(seed), '--timings', timingsName,
+            '-o', os.path.join(workDir, '%s_notes.pkl' % tag)]
+           + (pyrheaOpts or []) + [configName])
+    LOGGER.info('running %s', ' '.join(cmd))
+    with open(logName, 'w') as logF:
+        retcode = subprocess.call(cmd, cwd=SIM_DIR, stdout=logF, stderr=subprocess.STDOUT)
+    if retcode != 0 or not os.path.exists(timingsName):
+        LOGGER.error('%s failed with exit code %s; see %s', configName, retcode, logName)
+        return None
+    with open(timingsName, 'rU') as f:
+        timingsD = json.load(f)
+    if timingsD['failed']:
+        LOGGER.error('%s failed during the daily loop; see %s', configName, logName)
+        return None
+    return timingsD
+
+
+def runBenchmarks(configL, seed, repeat, python, workDir, pyrheaOpts=None):
+    """Returns {configName: timingsDict} for the configurations which ran successfully"""
+    resultD = {}
+    for configName in configL:
+        bestD = None
+        for rep in xrange(repeat):  # @UnusedVariable
+            timingsD = runConfig(configName, seed, python, workDir, pyrheaOpts)
+            if timingsD is None:
+                break
+            if bestD is None or timingsD['phases']['dailyLoop'] < bestD['phases']['dailyLoop']:
+                bestD = timingsD
+        if bestD is not None:
+            resultD[configName] = bestD
+            LOGGER.info('%s: %.3f sec per day, %.0f agent-days per sec, peak RSS %.0f MB',
+                        configName, bestD['secondsPerDay'] or 0.0,
+                        bestD['agentDaysPerSecond'] or 0.0, bestD['peakRSSMB'] or 0.0)
+    return resultD
+
+
+def timeCall(fun, number, repeat):
+    """Returns the best seconds per call of fun() over repeat trials of number calls"""
+    return min(timeit.repeat(fun, number=number, repeat=repeat)) / number
+
+
+def benchBayesTree(repeat):
+    from stats import BayesTree
+    nLeaves = 16
+    tree = BayesTree.fromLinearCDF([(1.0 / nLeaves, 'leaf_%d' % i) for i in xrange(nLeaves)])
+    rng = random.Random(DEFAULT_SEED)
+    return timeCall(lambda: tree.traverse(rng), 10000, repeat)
+
+
+def benchIntervalProb(repeat):
+    """Mostly cache hits, as in the facility LOS calculations"""
+    from scipy.stats import lognorm
+    from stats import CachedCDFGenerator
+    gen = CachedCDFGenerator(lognorm(0.8, scale=12.0))
+    startL = [(i % 200) for i in xrange(1000)]
+
+    def fun():
+        for start in startL:
+            gen.intervalProb(start, start + 1)
+    return timeCall(fun, 10, repeat) / len(startL)
+
+
+class _BenchWard(object):
+    """Just enough of a CommunityWard for a Freezer"""
+    def __init__(self):
+        self._name = 'bench_ward'
+        self.patch = None
+        self.lockingAgentSet = set()
+        self._lockQueue = []
+
+    def getGblAddr(self):
+        return ('bench', 0)
+
+    def suspend(self, agent):
+        pass
+
+    def awaken(self, agent):
+        pass
+
+
+class _BenchAgent(object):
+    """Carries state of roughly the size and shape of a PatientAgent's"""
+    def __init__(self, idx, ward):
+        self.state = {'name': 'PatientAgent_HOME_bench_%d' % idx,
+                      'loggerName': 'genericCommunity.PatientAgent',
+                      'locAddr': ward.getGblAddr(), 'newLocAddr': ward.getGblAddr(),
+                      'homeWardAddr': ward.getGblAddr(), 'facilityOptions': {},
+                      'tier': 0, 'fsmstate': 0, 'bedWard': None, 'patientKey': None,
+                      'dest': None, 'payload': None, 'status': (1, 0, 0, 'NONE', True, 0),
+                      'diagnosis': (1, 0, 'NONE', 0, False), 'treatment': {},
+                      'lastUpdateTime': 0, 'id': idx,
+                      'agentHistory': [(idx % 7, 'C%d' % (idx % 50), 'COMMUNITY')]}
+
+    def __getstate__(self):
+        return self.state.copy()
+
+    def __setstate__(self, d):
+        self.state = d
+
+    def kill(self):
+        pass
+
+    def reHome(self, patch):
+        pass
+
+
+def benchFreezeThaw(repeat, nAgents=10000):
+    """
+    Freeze-dries nAgents into a community Freezer, then thaws a random tenth of them as
+    CommunityManager.perTickActions does.  Returns seconds per agent frozen and thawed.
+    """
+    from genericCommunity import Freezer
+    ward = _BenchWard()
+
+    def fun():
+        freezer = Freezer(ward)
+        freezer.frozenAgentClass = _BenchAgent
+        for i in xrange(nAgents):
+            agent = _BenchAgent(i, ward)
+            ward.lockingAgentSet.add(agent)
+            ward._lockQueue.append(agent)
+            freezer.freezeAndStore(agent)
+        rng = random.Random(DEFAULT_SEED)
+        for frozenAgent in rng.sample(freezer.frozenAgentList, nAgents // 10):
+            freezer.removeAndThaw(frozenAgent, 1)
+        ward.lockingAgentSet.clear()
+        del ward._lockQueue[:]
+    return timeCall(fun, 1, repeat) / nAgents
+
+
+def benchGetPatientRecord(repeat, nRecords=10000):
+    """A read-modify-write of a patient record, as the facility message handlers do"""
+    from facilitybase import Facility, PatientRecord
+    fac = Facility.__new__(Facility)  # only the record store is needed
+    fac.patientDataDict = {}
+    for pId in xrange(nRecords):
+        fac.mergePatientRecord(pId, PatientRecord(pId, 0, isFrail=(pId % 3 == 0)), 0)
+    pIdL = [(i * 7919) % nRecords for i in xrange(1000)]
+
+    def fun():
+        for pId in pIdL:
+            with fac.getPatientRecord(pId) as pRec:
+                pRec.prevVisits += 1
+    return timeCall(fun, 10, repeat) / len(pIdL)
+
+
+MICRO_BENCHMARKS = [('BayesTree.traverse', benchBayesTree),
+                    ('CachedCDFGenerator.intervalProb', benchIntervalProb),
+                    ('Freezer.freezeAndThaw', benchFreezeThaw),
+                    ('Facility.getPatientRecord', benchGetPatientRecord)]
+
+
+def runMicroBenchmarks(repeat):
+    """Returns {benchmarkName: secondsPerCall}"""
+    resultD = {}
+    for name, fun in MICRO_BENCHMARKS:
+        resultD[name] = fun(repeat)
+        LOGGER.info('%s: %.3g usec per call', name, 1.0e6 * resultD[name])
+    return resultD
+
+
+def _lookup(d, dottedKey):
+    for key in dottedKey.split('.'):
+        if not isinstance(d, dict) or key not in d:
+            return None
+        d = d[key]
+    return d
+
+
+def compareResults(newD, baseD, tolerance):
+    """
+    Returns a list of (name, baseVal, newVal, ratio, isRegression) tuples for each figure
+    present in both sets of results.  ratio is new/base, inverted for the figures where
+    bigger is better, so a ratio above 1.0 + tolerance is always a regression.
+    """
+    rowL = []
+    for configName in sorted(newD.get('runs', {})):
+        if configName not in baseD.get('runs', {}):
+            continue
+        newRun = newD['runs'][configName]
+        baseRun = baseD['runs'][configName]
+        if newRun.get('agentDays') != baseRun.get('agentDays'):
+            LOGGER.warning('%s simulated %s agent-days but the baseline simulated %s;'
+                           ' the runs are not comparable', configName,
+                           newRun.get('agentDays'), baseRun.get('agentDays'))
+        for metric, biggerIsBetter in RUN_METRICS:
+            newVal = _lookup(newRun, metric)
+            baseVal = _lookup(baseRun, metric)
+            if newVal is None or baseVal is None or newVal <= 0.0 or baseVal <= 0.0:
+                continue
+            if ((metric.startswith('phases.') or metric == 'scenarioStartDaySeconds')
+                    and max(newVal, baseVal) < MIN_COMPARABLE_SECONDS):
+                continue
+            ratio = (baseVal / newVal) if biggerIsBetter else (newVal / baseVal)
+            rowL.append(('%s:%s' % (configName, metric), baseVal, newVal, ratio,
+                         ratio > 1.0 + tolerance))
+    for name in sorted(newD.get('micro', {})):
+        newVal = newD['micro'][name]
+        baseVal = baseD.get('micro', {}).get(name)
+        if baseVal is None or newVal <= 0.0 or baseVal <= 0.0:
+            continue
+        ratio = newVal / baseVal
+        rowL.append(('micro:%s' % name, baseVal, newVal, ratio, ratio > 1.0 + tolerance))
+    return rowL
+
+
+def printComparison(rowL, ofile=sys.stdout):
+    ofile.write('%-60s %12s %12s %8s\n' % ('figure', 'baseline', 'new', 'ratio'))
+    for name, baseVal, newVal, ratio, isRegression in rowL:
+        ofile.write('%-60s %12.5g %12.5g %8.3f%s\n'
+                    % (name, baseVal, newVal, ratio, ('  REGRESSION' if isRegression else '')))
+
+
+def main():
+    """
+    main
+    """
+    parser = optparse.OptionParser(usage="""
+    %prog [-o results.json] [--compare baseline.json] [--noRuns] [--noMicro] [config.yaml ...]
+
+    With no configuration files the tiny and week-long runs are benchmarked.
+    """)
+    parser.add_option('-o', '--out', action='store', default='benchmark.json',
+                      help='results file (default %default)')
+    parser.add_option('--seed', action='store', type='int', default=DEFAULT_SEED,
+                      help='random seed for every run (default %default)')
+    parser.add_option('-r', '--repeat', action='store', type='int', default=3,
+                      help='number of trials of each benchmark; the best is kept (default %default)')
+    parser.add_option('--noRuns', action='store_true', default=False,
+                      help='skip the run benchmarks')
+    parser.add_option('--noMicro', action='store_true', default=False,
+                      help='skip the microbenchmarks')
+    parser.add_option('--pyrheaOpts', action='store', default=None,
+                      help='extra options for pyrhea.py, as a single quoted string')
+    parser.add_option('--workDir', action='store', default=None,
+                      help='keep the notes, logs and timings of the runs in this directory')
+    parser.add_option('--compare', action='store', default=None,
+                      help='flag regressions against this baseline results file')
+    parser.add_option('--compareOnly', action='store', default=None,
+                      help='compare this existing results file rather than running benchmarks')
+    parser.add_option('--tolerance', action='store', type='float', default=0.1,
+                      help='fractional slowdown allowed before flagging a regression'
+                      ' (default %default)')
+    parser.add_option('-v', '--verbose', action='store_true', default=False,
+                      help='verbose output')
+    opts, args = parser.parse_args()
+    if opts.repeat < 1:
+        parser.error('--repeat must be at least 1')
+    if opts.tolerance < 0.0:
+        parser.error('--tolerance cannot be negative')
+    if opts.compareOnly is not None and opts.compare is None:
+        parser.error('--compareOnly requires --compare')
+    parser.destroy()
+
+    logging.basicConfig(level=(logging.DEBUG if opts.verbose else logging.INFO))
+
+    if opts.compareOnly is not None:
+        with open(opts.compareOnly, 'rU') as f:
+            newD = json.load(f)
+    else:
+        newD = {'host': platform.node(),
+                'python': platform.python_version(),
+                'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'seed': opts.seed,
+                'runs': {},
+                'micro': {}}
+        if not opts.noRuns:
+            configL = args or DEFAULT_CONFIGS
+            pyrheaOpts = opts.pyrheaOpts.split() if opts.pyrheaOpts else None
+            if opts.workDir is None:
+                workDir = tempfile.mkdtemp(prefix='pyrhea_bench_')
+            else:
+                workDir = os.path.abspath(opts.workDir)
+                if not os.path.isdir(workDir):
+                    os.makedirs(workDir)
+            try:
+                newD['runs'] = runBenchmarks(configL, opts.seed, opts.repeat, sys.executable,
+                                             workDir, pyrheaOpts)
+            finally:
+                if opts.workDir is None:
+                    shutil.rmtree(workDir, ignore_errors=True)
+        if not opts.noMicro:
+            newD['micro'] = runMicroBenchmarks(opts.repeat)
+        with open(opts.out, 'w') as f:
+            json.dump(newD, f, indent=2, sort_keys=True)
+        LOGGER.info('results written to %s', opts.out)
+
+    if opts.compare is not None:
+        with open(opts.compare, 'rU') as f:
+            baseD = json.load(f)
+        rowL = compareResults(newD, baseD, opts.tolerance)
+        printComparison(rowL)
+        nRegressions = sum([1 for row in rowL if row[-1]])
+        if nRegressions:
+            print '%d regressions beyond a tolerance of %.0f%%' % (nRegressions,
+                                                                  100.0 * opts.tolerance)
+            sys.exit(1)
+        else:
+            print 'no regressions beyond a tolerance of %.0f%%' % (100.0 * opts.tolerance)
+
+
+class TestBenchmark(unittest.TestCase):
+    def setUp(self):
+        self.baseD = {'runs': {'tiny_run.yaml': {'agentDays': 1000,
+                                                 'secondsPerDay': 1.0,
+                                                 'agentDaysPerSecond': 100.0,
+                                                 'peakRSSMB': 500.0,
+                                                 'scenarioStartDaySeconds': 2.0,
+                                                 'phases': {'dailyLoop': 10.0,
+                                                            'notesWriting': 0.1}}},
+                      'micro': {'BayesTree.traverse': 1.0e-6}}
+
+    def test_identical(self):
+        rowL = compareResults(self.baseD, self.baseD, 0.1)
+        self.assertTrue(rowL)
+        self.assertFalse(any([row[-1] for row in rowL]))
+
+    def test_regressions(self):
+        newD = json.loads(json.dumps(self.baseD))
+        newRun = newD['runs']['tiny_run.yaml']
+        newRun['secondsPerDay'] = 1.5
+        newRun['agentDaysPerSecond'] = 50.0
+        newRun['phases']['notesWriting'] = 0.4  # too short to compare
+        newRun['scenarioStartDaySeconds'] = 3.0
+        newD['micro']['BayesTree.traverse'] = 1.05e-6
+        flagged = set([row[0] for row in compareResults(newD, self.baseD, 0.1) if row[-1]])
+        self.assertEqual(flagged, set(['tiny_run.yaml:secondsPerDay',
+                                       'tiny_run.yaml:agentDaysPerSecond',
+                                       'tiny_run.yaml:scenarioStartDaySeconds']))
+
+    def test_improvement(self):
+        newD = json.loads(json.dumps(self.baseD))
+        newD['runs']['tiny_run.yaml']['agentDaysPerSecond'] = 200.0
+        rowD = dict([(row[0], row) for row in compareResults(newD, self.baseD, 0.1)])
+        self.assertAlmostEqual(rowD['tiny_run.yaml:agentDaysPerSecond'][3], 0.5)
+        self.assertFalse(rowD['tiny_run.yaml:agentDaysPerSecond'][-1])
+
+
+if __name__ == "__main__":
+    main()
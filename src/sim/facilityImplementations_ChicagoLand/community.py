@@ -15,9 +15,9 @@
 #                                                                                 #
 ###################################################################################
 import logging
-import random
 logger = logging.getLogger(__name__)
 
+import numpy as np
 from scipy.stats import expon
 from collections import defaultdict
 from phacsl.utils.collections.phacollections import enum, SingletonMetaClass
@@ -32,6 +32,21 @@ import pyrheautils
 # Setting _constants_schema here does not work because of order of operations
 # _constants_schema = 'community_ChicagoLand_constants_schema.yaml'
 
+# Freezer categories are small integers, overallHealth * N_PTH_STATUS + pthStatus.  The
+# readable names like 'HEALTHY_base' are used only in losModelMap, notes and logs.
+FROZEN_PTH_STATUS_NAMES = {PthStatus.CLEAR: 'base',
+                           PthStatus.COLONIZED: 'colonized',
+                           PthStatus.UNDETCOLONIZED: 'undetcolonized'}
+N_PTH_STATUS = max(PthStatus.names.keys()) + 1
+N_CATEGORIES = (max(PatientOverallHealth.names.keys()) + 1) * N_PTH_STATUS
+CATEGORY_NAMES = [None] * N_CATEGORIES  # None for combinations which are never frozen
+CATEGORY_PTH_STATUS = [None] * N_CATEGORIES
+for _health, _healthName in PatientOverallHealth.names.items():
+    for _pthStatus, _pthName in FROZEN_PTH_STATUS_NAMES.items():
+        CATEGORY_NAMES[_health * N_PTH_STATUS + _pthStatus] = '%s_%s' % (_healthName, _pthName)
+        CATEGORY_PTH_STATUS[_health * N_PTH_STATUS + _pthStatus] = _pthStatus
+CATEGORY_CODES = {nm: code for code, nm in enumerate(CATEGORY_NAMES) if nm is not None}
+
 class CommunityManagerCore(object):
     """This is a place to put infrastructure we must share between community managers"""
     __metaclass__ = SingletonMetaClass
@@ -46,8 +61,60 @@ class CommunityManagerCore(object):
         self.lastKalmanUpdateTime = None
         self.cumPop = 0
         self.cumMeanPop = 0.0
+        self.comm = None  # set in global mode
+        self.noteHolder = None
+        self.lastDay = None
+
+    def enableGlobalMode(self, patch, comm, noteHolder, lastDay):
+        """
+        In global mode the population sums from community managers are only accumulated.
+        Once per day the sums from all ranks are combined with an allreduce and every rank
+        applies the same update.  The reduction is done from a per-day callback of one
+        patch on each rank, so every rank makes the same sequence of collective calls
+        whether or not it holds any communities.  noteHolder may be None on ranks which
+        should not record the filter state.
+        """
+        self.comm = comm
+        self.noteHolder = noteHolder
+        self.lastDay = lastDay
+        patch.loop.addPerDayCallback(self.globalKalmanUpdate)
+
+    def globalKalmanUpdate(self, loop, timeNow):  # @UnusedVariable
+        if timeNow > self.lastDay:
+            return  # the run is stopping, and some ranks may already have stopped
+        localSums = np.array([self.cumPop, self.cumMeanPop], dtype=np.float64)
+        if self.comm.size > 1:
+            localSums = self.comm.allreduce(localSums)
+        cumPop, cumMeanPop = float(localSums[0]), float(localSums[1])
+        if cumPop != 0:
+            self._applyKalmanUpdate(cumPop, cumMeanPop, 'global sum', timeNow)
+        self.cumPop = 0
+        self.cumMeanPop = 0.0
+        if self.noteHolder is not None:
+            self.noteHolder.addNote({'kalman': [{'day': timeNow, 'x': self.x, 'p': self.p,
+                                                 'rateScale': self.rateScale,
+                                                 'cumPop': cumPop,
+                                                 'cumMeanPop': cumMeanPop}]})
 
     def kalmanUpdate(self, totPop, meanPop, totArrivals, callerAbbrev, timeNow):
+        """
+        Accumulate a community's population, and in local mode perform a Kalman update
+        from the sums for the previous day.  In global mode the update happens in
+        globalKalmanUpdate instead.
+        """
+        if self.comm is None and timeNow != self.lastKalmanUpdateTime:
+            assert (self.lastKalmanUpdateTime is None
+                    or self.cumMeanPop != 0.0), 'No community has any population?'
+            if self.cumPop == 0:
+                pass  # No update; rates remain unchanged
+            else:
+                self._applyKalmanUpdate(self.cumPop, self.cumMeanPop, callerAbbrev, timeNow)
+            self.cumPop = 0
+            self.cumMeanPop = 0.0
+        self.cumPop += totPop
+        self.cumMeanPop += meanPop
+
+    def _applyKalmanUpdate(self, cumPop, cumMeanPop, callerAbbrev, timeNow):
         """
         Perform a Kalman update of the rate scaling factor.  The nomenclature is
         from Welch & Bishop, "An Introduction to the Kalman Filter" and
@@ -65,40 +132,30 @@ class CommunityManagerCore(object):
           since the standard deviation scales as 1/sqrt(N)
         W and V are 1.0
         """
-        if timeNow != self.lastKalmanUpdateTime:
-            assert (self.lastKalmanUpdateTime is None
-                    or self.cumMeanPop != 0.0), 'No community has any population?'
-            if self.cumPop == 0:
-                pass  # No update; rates remain unchanged
-            else:
-                x = self.x
-                P = self.p
-                z = (self.cumPop - self.cumMeanPop)/self.cumMeanPop
-                Q = self.Q
-                A = 1.0
-                H = self.H
-                R = 1.0/self.cumPop
-                xHatMinus = x
-                PMinus = A*P*A + Q
-                K = (PMinus * H) / (H * PMinus * H + R)
-                xHat = xHatMinus + (K * (z - H*(xHatMinus - 1.0)))
-                P = (1.0 - K * H) * PMinus
-                logger.info(('Kalman update triggered by %s: cumPop= %s, cumMeanPop= %s,'
-                              ' x= %s P=%s z=%s R=%s -> K=%s -> x=%s P=%s'),
-                              callerAbbrev, self.cumPop, self.cumMeanPop, x, self.p, z, R, K, xHat, P)
-                self.x = xHat
-                self.p = P
-                if self.x > 0.0:
-                    self.rateScale = 1.0 - self.rateScaleDelta
-                elif self.x < 0.0:
-                    self.rateScale = 1.0 + self.rateScaleDelta
-                else:
-                    self.rateScale = 1.0
-                self.lastKalmanUpdateTime = timeNow
-            self.cumPop = 0
-            self.cumMeanPop = 0.0
-        self.cumPop += totPop
-        self.cumMeanPop += meanPop
+        x = self.x
+        P = self.p
+        z = (cumPop - cumMeanPop)/cumMeanPop
+        Q = self.Q
+        A = 1.0
+        H = self.H
+        R = 1.0/cumPop
+        xHatMinus = x
+        PMinus = A*P*A + Q
+        K = (PMinus * H) / (H * PMinus * H + R)
+        xHat = xHatMinus + (K * (z - H*(xHatMinus - 1.0)))
+        P = (1.0 - K * H) * PMinus
+        logger.info(('Kalman update triggered by %s: cumPop= %s, cumMeanPop= %s,'
+                      ' x= %s P=%s z=%s R=%s -> K=%s -> x=%s P=%s'),
+                      callerAbbrev, cumPop, cumMeanPop, x, self.p, z, R, K, xHat, P)
+        self.x = xHat
+        self.p = P
+        if self.x > 0.0:
+            self.rateScale = 1.0 - self.rateScaleDelta
+        elif self.x < 0.0:
+            self.rateScale = 1.0 + self.rateScaleDelta
+        else:
+            self.rateScale = 1.0
+        self.lastKalmanUpdateTime = timeNow
 
 
 
@@ -143,29 +200,25 @@ class CommunityWard(genericCommunity.CommunityWard):
         self.arrivalCounter += 1
 
     def classify(self, agent, timeNow):
-        """Return the PatientCategory appropriate for this agent"""
-        health = PatientOverallHealth.names[agent.getStatus().overall]
-        if agent.getStatus().pthStatus == PthStatus.COLONIZED:
-            return '%s_colonized' % health
-        elif agent.getStatus().pthStatus == PthStatus.CLEAR:
-            return '%s_base' % health
-        elif agent.getStatus().pthStatus == PthStatus.UNDETCOLONIZED:
-            return '%s_undetcolonized' % health
-        else:
+        """Return the integer PatientCategory appropriate for this agent"""
+        status = agent.getStatus()
+        code = status.overall * N_PTH_STATUS + status.pthStatus
+        if CATEGORY_NAMES[code] is None:
             raise genericCommunity.FreezerError('%s has unexpected PthStatus %s' %
                                                 (agent.name,
                                                  PthStatus.names[agent._status.pthStatus]))
-    
+        return code
+
+    def getCategoryName(self, patientCategory):
+        return CATEGORY_NAMES[patientCategory]
+
     def getPthCountHook(self):
         """
         A channel to report patient pthStatus counts including freeze-dried patients
         """
         dct = defaultdict(int)
         for classKey, freezer in self.freezers.items():
-            # This bit is the reverse of the classify() method.
-            pthStatus = {'colonized': PthStatus.COLONIZED, 'base': PthStatus.CLEAR,
-                         'undetcolonized': PthStatus.UNDETCOLONIZED}[classKey.split('_')[1]]
-            dct[pthStatus] += len(freezer.frozenAgentList)
+            dct[CATEGORY_PTH_STATUS[classKey]] += len(freezer.frozenAgentList)
         for agent in self.getLiveLockedAgents():
             dct[agent.getPthStatus()] += 1
         return dct
@@ -249,6 +302,20 @@ class Community(genericCommunity.Community):
                                         wardClass=CommunityWard)
         self.core = CommunityCore()
 
+    def setCDFs(self, losModelMap):
+        """The CDF generators are stored in a list indexed by integer PatientCategory"""
+        super(Community, self).setCDFs(losModelMap)
+        cdfList = [None] * N_CATEGORIES
+        for classKey, cdf in self.cachedCDFs.items():
+            if classKey not in CATEGORY_CODES:
+                raise RuntimeError('losModelMap category %s is not a known patient category'
+                                   % classKey)
+            cdfList[CATEGORY_CODES[classKey]] = cdf
+        self.cachedCDFs = cdfList
+
+    def hasCDF(self, patientCategory):
+        return self.cachedCDFs[patientCategory] is not None
+
     def calcTierRateConstants(self, flowKey):
         """
         These constants represent the fraction of the newly-sick that die, that
@@ -303,7 +370,7 @@ class Community(genericCommunity.Community):
 
     def updateModifiers(self, patientAgent, modifierDct):
         genericCommunity.Community.updateModifiers(self, patientAgent, modifierDct)
-        if random.random() < self.bypassFrac:
+        if self.rng.random() < self.bypassFrac:
             # replace FLOW_KEY to signal bypass
             modifierDct[TierUpdateModKey.FLOW_KEY] = genericCommunity.BYPASS_KEY
 
@@ -314,4 +381,12 @@ def generateFull(facilityDescr, patch, policyClasses=None, categoryNameMapper=No
                                          communityClass=Community)
 
 
+def enableGlobalPopulationFeedback(patch, comm, noteHolder, lastDay):
+    """
+    Called once on every rank by pyrhea in --globalKalman mode; see
+    CommunityManagerCore.enableGlobalMode
+    """
+    CommunityManagerCore().enableGlobalMode(patch, comm, noteHolder, lastDay)
+
+
 genericCommunity.importCommunity(__name__)
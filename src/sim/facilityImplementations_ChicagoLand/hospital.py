@@ -20,7 +20,6 @@ import math
 import numpy as np
 from scipy.stats import lognorm
 import logging
-from random import random
 
 import pyrheabase
 import pyrheautils
@@ -51,14 +50,17 @@ tierKeyMap = {CareTier.HOME: 'home',
 knownTierKeys = tierKeyMap.values() + ['death']
 
 
-def pickWardSizes(nBeds, bedsPerWard):
+def pickWardSizes(nBeds, bedsPerWard, rng=None):
     """
     Given a number of beds and a nominal number of beds per ward, generate an
     iterable giving a series of ward sizes which 'comes close to' the requested
     total bed count and ward size.
 
-    Both input parameters are assumed to be integers.
+    Both input parameters are assumed to be integers.  If rng is given it should be a
+    numpy RandomState; otherwise the global numpy random state is used.
     """
+    if rng is None:
+        rng = np.random
     nWards = int((nBeds//bedsPerWard) + 1)
     if nWards > 1:
         delta = (bedsPerWard * nWards) - nBeds
@@ -73,9 +75,9 @@ def pickWardSizes(nBeds, bedsPerWard):
         conv = nBeds - np.sum(samps)
         while True:
             if conv > 0:
-                samps += np.random.poisson(float(conv)/ float(nWards), nWards)
+                samps += rng.poisson(float(conv)/ float(nWards), nWards)
             elif conv < 0:
-                samps -= np.random.poisson(float(-conv)/ float(nWards), nWards)
+                samps -= rng.poisson(float(-conv)/ float(nWards), nWards)
             else:
                 break
             conv = nBeds - np.sum(samps)
@@ -190,7 +192,7 @@ class HospitalManager(FacilityManager):
             tier = requestedTier
         else:
             if (requestedTier == CareTier.HOSP
-                and random() < _constants['fracTriageHOSPToICU']['value']):
+                and self.fac.rng.random() < _constants['fracTriageHOSPToICU']['value']):
                 tier = CareTier.ICU
             else:
                 tier = requestedTier
@@ -291,11 +293,11 @@ class Hospital(Facility):
         self.hospTreeCache = {}
         self.icuTreeCache = {}
 
-        for i, bedCt in enumerate(pickWardSizes(icuBeds, bedsPerICUWard)):
+        for i, bedCt in enumerate(pickWardSizes(icuBeds, bedsPerICUWard, self.npRng)):
             self.addWard(ICUWard(('%s_%s_%s_%s_%d' %
                                   (category, patch.name, descr['abbrev'], 'ICU', i)),
                                  patch, bedCt))
-        for i, bedCt in enumerate(pickWardSizes(nonICUBeds, bedsPerWard)):
+        for i, bedCt in enumerate(pickWardSizes(nonICUBeds, bedsPerWard, self.npRng)):
             self.addWard(Ward(('%s_%s_%s_%s_%d' %
                                (category, patch.name, descr['abbrev'], 'HOSP', i)),
                               patch, CareTier.HOSP, bedCt))
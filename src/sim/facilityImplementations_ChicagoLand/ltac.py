@@ -110,7 +110,7 @@ class LTAC(Facility):
                                                     scale=math.exp(scaledLOSParms[0])))
         self.treeCache = {}
 
-        for i, bedCt in enumerate(pickWardSizes(nBeds, bedsPerWard)):
+        for i, bedCt in enumerate(pickWardSizes(nBeds, bedsPerWard, self.npRng)):
             self.addWard(Ward(('%s_%s_%s_%s_%d' %
                                (category, patch.name, descr['abbrev'], 'LTAC', i)),
                               patch, CareTier.LTAC, bedCt))
@@ -18,8 +18,8 @@
 _rhea_svn_id_ = "$Id$"
 
 import os.path
-from random import random
 import math
+import heapq
 import numpy as np
 from scipy.stats import lognorm, expon, weibull_min
 import logging
@@ -27,7 +27,7 @@ import logging
 import pyrheabase
 import pyrheautils
 import schemautils
-from quilt.peopleplaces import FutureMsg
+from phacsl.utils.notes.statval import HistoVal
 from stats import CachedCDFGenerator, lognormplusexp, BayesTree, fullCRVFromPDFModel
 from stats import JournalingCachedCDFGenerator, pdfModelToStr
 from facilitybase import DiagClassA, CareTier, TreatmentProtocol, NURSINGQueue
@@ -56,19 +56,11 @@ class NursingWard(Ward):
                                                          self.fac.reqQueues).getGblAddr())
 
 
-class CancelHoldMsg(FutureMsg):
-    idCounter = 0
-
-    @classmethod
-    def nextId(cls):
-        rslt = cls.idCounter
-        cls.idCounter += 1
-        return rslt
-
-    def __init__(self, baseName, patch, payload, destAddr, arrivalTime, debug=False):
-        super(CancelHoldMsg, self).__init__(baseName + '_cancel_hold_%d' % self.nextId(),
-                                            patch, payload, destAddr, arrivalTime,
-                                            debug=debug)
+class NursingHomeManager(FacilityManager):
+    def perTickActions(self, timeNow):
+        """Release the bed holds which have run out"""
+        if timeNow is not None:
+            self.fac.expireBedHolds(timeNow)
 
 
 def _decomposeLOSModel(losModel):
@@ -86,6 +78,7 @@ class NursingHome(Facility):
         Facility.__init__(self, '%(category)s_%(abbrev)s' % descr,
                           descr, patch,
                           reqQueueClasses=[NURSINGQueue],
+                          managerClass=NursingHomeManager,
                           policyClasses=policyClasses,
                           categoryNameMapper=categoryNameMapper)
         descr = self.mapDescrFields(descr)
@@ -137,6 +130,8 @@ class NursingHome(Facility):
                              'frail': 0, 'non_frail': 0,
                              'frail_held': 0, 'non_frail_held': 0}
         self.bedHoldTime = _c['heldBedDurationDays']['value']
+        self.bedHoldExpiryDict = {}  # (pOH, pId, departureDate) tuples by expiry day
+        self.bedHoldExpiryDays = []  # heap of the keys of bedHoldExpiryDict
 
         totDsch = float(descr['totalDischarges']['value'])
         totTO = sum([elt['count']['value'] for elt in descr['totalTransfersOut']])
@@ -289,11 +284,7 @@ class NursingHome(Facility):
                     logger.debug('%s departure processing %s %s %s %s',
                                  self.name, pId, healthKey, pRec.noteD['bedHeld'],
                                  self.bedAllocDict)
-                cancelHoldMsg = CancelHoldMsg(self.name, self.manager.patch,
-                                              (pOH, pId, timeNow),
-                                              self.reqQueues[0].getGblAddr(),
-                                              timeNow + self.bedHoldTime)
-                self.manager.patch.launch(cancelHoldMsg, timeNow)
+                self.scheduleBedHoldExpiry(pOH, pId, timeNow)
             return super(NursingHome, self).handleIncomingMsg(msgType, payload, timeNow)
         elif issubclass(msgType, pyrheabase.ArrivalMsg):
             pOH, pId, payload = payload # strip out overall health and patient id
@@ -329,30 +320,61 @@ class NursingHome(Facility):
                              self.bedAllocDict)
                 pRec.noteD['bedHeld'] = False
             return super(NursingHome, self).handleIncomingMsg(msgType, payload, timeNow)
-        elif issubclass(msgType, CancelHoldMsg):
-            pOH, pId, launchTime = payload
-            if pOH == PatientOverallHealth.FRAIL:
-                (healthKey, heldKey, bedsKey,
-                 otherHealthKey, otherBedsKey) = ('frail', 'frail_held', 'frail_beds',
-                                                  'non_frail', 'non_frail_beds')
-            else:
-                (healthKey, heldKey, bedsKey,
-                 otherHealthKey, otherBedsKey) = ('non_frail', 'non_frail_held', 'non_frail_beds',
-                                                  'frail', 'frail_beds')
-            with self.getPatientRecord(pId, timeNow) as pRec:
-                if pRec.departureDate == launchTime and pRec.noteD['bedHeld']:
-                    logger.debug('%s applying CancelHoldMsg %s %s %s %s %s %s',
-                                 self.name, pId, healthKey, pRec.departureDate,
-                                 launchTime, pRec.noteD['bedHeld'], self.bedAllocDict)
-                    pRec.noteD['bedHeld'] = False
-                    bAD = self.bedAllocDict
-                    bAD[heldKey] -= 1
-                    assert bAD[heldKey] >= 0, '%s cannot find bed hold to cancel'
+
+    def scheduleBedHoldExpiry(self, pOH, pId, timeNow):
+        """The bed held for a departing patient lapses bedHoldTime days from now"""
+        expiryDay = timeNow + self.bedHoldTime
+        if expiryDay not in self.bedHoldExpiryDict:
+            self.bedHoldExpiryDict[expiryDay] = []
+            heapq.heappush(self.bedHoldExpiryDays, expiryDay)
+        self.bedHoldExpiryDict[expiryDay].append((pOH, pId, timeNow))
+        nh = self.getNoteHolder()
+        if nh:
+            nh.addNote({'bedHoldsPlaced': 1})
+
+    def expireBedHolds(self, timeNow):
+        """
+        Cancel the holds due to expire by timeNow.  A hold is only cancelled if the patient
+        has neither returned nor departed again since it was placed; otherwise it is stale
+        and is simply dropped.
+        """
+        nExpired = 0
+        nStale = 0
+        while self.bedHoldExpiryDays and self.bedHoldExpiryDays[0] <= timeNow:
+            expiryDay = heapq.heappop(self.bedHoldExpiryDays)
+            for pOH, pId, launchTime in self.bedHoldExpiryDict.pop(expiryDay):
+                if self.cancelBedHold(pOH, pId, launchTime, timeNow):
+                    nExpired += 1
                 else:
-                    logger.debug('%s stray CancelHoldMsg %s %s %s %s %s %s',
-                                 self.name, pId, healthKey, pRec.departureDate,
-                                 launchTime, pRec.noteD['bedHeld'], self.bedAllocDict)
-            return timeNow
+                    nStale += 1
+        nh = self.getNoteHolder()
+        if nh:
+            if 'bedsHeld' not in nh:
+                nh.addNote({'bedsHeld': HistoVal([])})
+            nh.addNote({'bedsHeld': (self.bedAllocDict['frail_held']
+                                     + self.bedAllocDict['non_frail_held']),
+                        'bedHoldsExpired': nExpired, 'bedHoldsStale': nStale})
+
+    def cancelBedHold(self, pOH, pId, launchTime, timeNow):
+        if pOH == PatientOverallHealth.FRAIL:
+            healthKey, heldKey = 'frail', 'frail_held'
+        else:
+            healthKey, heldKey = 'non_frail', 'non_frail_held'
+        with self.getPatientRecord(pId, timeNow) as pRec:
+            if pRec.departureDate == launchTime and pRec.noteD['bedHeld']:
+                logger.debug('%s cancelling bed hold %s %s %s %s %s %s',
+                             self.name, pId, healthKey, pRec.departureDate,
+                             launchTime, pRec.noteD['bedHeld'], self.bedAllocDict)
+                pRec.noteD['bedHeld'] = False
+                bAD = self.bedAllocDict
+                bAD[heldKey] -= 1
+                assert bAD[heldKey] >= 0, '%s cannot find bed hold to cancel' % self.name
+                return True
+            else:
+                logger.debug('%s stale bed hold %s %s %s %s %s %s',
+                             self.name, pId, healthKey, pRec.departureDate,
+                             launchTime, pRec.noteD['bedHeld'], self.bedAllocDict)
+                return False
 
     def getStatusChangeTree(self, patientAgent, modifierDct, startTime, timeNow):
         patientStatus = patientAgent.getStatus()
@@ -399,10 +421,10 @@ class NursingHome(Facility):
             return BayesTree(PatientStatusSetter())
 
     def getInitialOverallHealth(self, ward, timeNow):  # @UnusedVariable
-        if random() <= self.initialResidentFrac:
+        if self.rng.random() <= self.initialResidentFrac:
             return PatientOverallHealth.FRAIL
         else:
-            rn = random()
+            rn = self.rng.random()
             if rn <= self.initialUnhealthyFrac:
                 return PatientOverallHealth.UNHEALTHY
             elif rn <= (self.initialUnhealthyFrac + self.initialNonResidentFrailFrac):
@@ -412,27 +434,41 @@ class NursingHome(Facility):
 
 
 class AgeSampler(object):
+    """
+    Draws the days already spent in the facility by a patient who is present at startup.
+    An age a in 0..maxSamp-1 has probability proportional to crv.sf(a), the chance that
+    a stay lasts longer than a, which is the distribution the old rejection sampler drew
+    from.  The distribution is computed once per CRV and sampled by inverse CDF.
+    """
     sampsPerBatch = 1024
     maxSamp = 365
 
-    def __init__(self, someCRV):
+    def __init__(self, someCRV, rng=None):
         self.crv = someCRV
-        self.sampV = self.generate()
-    
-    def generate(self):
-        ageSampV = np.random.randint(AgeSampler.maxSamp, size=AgeSampler.sampsPerBatch)
-        probV = self.crv.cdf(ageSampV)
-        flagV = np.random.uniform(size=ageSampV.shape[0]) > probV
-        return np.compress(flagV, ageSampV)
+        self.rng = np.random if rng is None else rng
+        wtV = self.crv.sf(np.arange(AgeSampler.maxSamp))
+        cumV = np.cumsum(wtV)
+        assert cumV[-1] > 0.0, 'No samples- is the crv just too unlikely?'
+        self.cdfV = cumV / cumV[-1]
+        self.sampV = self.generate(AgeSampler.sampsPerBatch)
+        self.cursor = 0
+
+    def generate(self, n):
+        idxV = np.searchsorted(self.cdfV, self.rng.uniform(size=n), side='right')
+        return np.minimum(idxV, AgeSampler.maxSamp - 1)  # guard against rounding in cdfV
 
     def samp(self):
-        assert self.sampV.shape[0] > 0, 'No samples- is the crv just too unlikely?'
-        rslt = self.sampV[0]
-        self.sampV = self.sampV[1:]
-        if self.sampV.shape[0] < 1:
-            self.sampV = self.generate()
+        if self.cursor >= self.sampV.shape[0]:
+            self.sampV = self.generate(AgeSampler.sampsPerBatch)
+            self.cursor = 0
+        rslt = self.sampV[self.cursor]
+        self.cursor += 1
         return rslt
 
+    def sampMany(self, n):
+        """Returns an array of n samples"""
+        return self.generate(n)
+
 
 def _populate(fac, descr, patch):
     assert 'meanPop' in descr, \
@@ -445,26 +481,37 @@ def _populate(fac, descr, patch):
     # The following is approximate, but adequate...
     agentList = []
     logger.debug('%s before _populate %s: %s', fac.name, int(round(meanPop)), fac.bedAllocDict)
-    frailSampler = AgeSampler(fac.frailCachedCDF.frozenCRV)
-    rehabSampler = AgeSampler(fac.rehabCachedCDF.frozenCRV)
+    frailL = []
+    rehabL = []
     for i in xrange(int(round(meanPop))):
         ward = fac.manager.allocateAvailableBed(CareTier.NURSING)
         assert ward is not None, 'Ran out of beds populating %(abbrev)s!' % descr
         a = PatientAgent('PatientAgent_NURSING_%s_%d' % (ward._name, i), patch, ward)
         a.setStatus(homeAddr=findQueueForTier(CareTier.NURSING, fac.reqQueues).getGblAddr())  # They live here
         if a.getStatus().overall == PatientOverallHealth.FRAIL:
-            a.setStatus(startDateA= -frailSampler.samp())
-#             a.setStatus(startDateA=0)
+            frailL.append(a)
         else:
             a.setTreatment(rehab=True)  # They must be here for rehab
-            a.setStatus(startDateA= -rehabSampler.samp())
-#             a.setStatus(startDateA=0)
+            rehabL.append(a)
+        agentList.append(a)
+
+    # Draw the ages of each group in bulk
+    ageD = {}
+    for aL, cachedCDF in [(frailL, fac.frailCachedCDF), (rehabL, fac.rehabCachedCDF)]:
+        if aL:
+            sampler = AgeSampler(cachedCDF.frozenCRV, fac.npRng)
+            for a, age in zip(aL, sampler.sampMany(len(aL))):
+                ageD[id(a)] = age
+
+    for a in agentList:
+        a.setStatus(startDateA= -ageD[id(a)])
+#         a.setStatus(startDateA=0)
+        ward = a.ward
         ward.lock(a)
         ward.handlePatientArrival(a, None)
         fac.handleIncomingMsg(pyrheabase.ArrivalMsg,
                               fac.getMsgPayload(pyrheabase.ArrivalMsg, a),
                               None)
-        agentList.append(a)
     logger.debug('%s after _populate %s: %s', fac.name, int(round(meanPop)), fac.bedAllocDict)
     return agentList
 
@@ -16,7 +16,6 @@
 ###################################################################################
 
 import os.path
-from random import random
 import math
 from scipy.stats import lognorm, expon
 import logging
@@ -219,10 +218,10 @@ class VentSNF(Facility):
 
     def getInitialOverallHealth(self, ward, timeNow):  # @UnusedVariable
         tier = ward.tier
-        if random() <= self.initialResidentFrac:
+        if self.rng.random() <= self.initialResidentFrac:
             return PatientOverallHealth.FRAIL
         else:
-            rn = random()
+            rn = self.rng.random()
             if rn <= self.initialUnhealthyFracByTier[tier]:
                 return PatientOverallHealth.UNHEALTHY
             elif rn <= (self.initialUnhealthyFracByTier[tier]
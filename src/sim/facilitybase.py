@@ -15,7 +15,6 @@
 #                                                                                 #
 ###################################################################################
 
-from random import randint, choice
 import logging
 import math
 from collections import defaultdict
@@ -25,6 +24,7 @@ import numpy as np
 from phacsl.utils.notes.statval import HistoVal
 from phacsl.utils.collections.phacollections import SingletonMetaClass
 import pyrheabase
+import pyrheautils
 from typebase import CareTier, PatientOverallHealth, DiagClassA
 from typebase import TreatmentProtocol, TREATMENT_DEFAULT  # @UnusedImport
 from typebase import PatientStatus, PatientDiagnosis  # @UnusedImport
@@ -390,6 +390,9 @@ class Facility(pyrheabase.Facility):
         else:
             self.implCategory = self.category
         self.abbrev = descr['abbrev']
+        # Independent random streams keyed by abbrev, so draws are partition-independent
+        self.rng = pyrheautils.getRandomStream('facility', self.abbrev)
+        self.npRng = pyrheautils.getNumpyRandomStream('facility', self.abbrev)
         if 'longitude' in descr and 'latitude' in descr:
             self.coords = (descr['longitude'], descr['latitude'])
         else:
@@ -483,6 +486,14 @@ class Facility(pyrheabase.Facility):
         """
         pass
 
+    def getTreatmentPolicyVersionKey(self):
+        """
+        Returns a tuple which changes whenever any of this facility's treatment policies
+        is activated or deactivated.  Caches of values which depend on the treatment
+        policies can include this in their keys in place of being flushed.
+        """
+        return tuple([tP.version for tP in self.treatmentPolicies])
+
     def getOrderedCandidateFacList(self, patientAgent, oldTier, newTier, modifierDct, timeNow):
         oCFL = self.transferDestinationPolicy.getOrderedCandidateFacList(self,
                                                                          patientAgent,
@@ -774,6 +785,7 @@ def buildTimeTupleList(agent, timeNow):
 
 class PatientAgent(pyrheabase.PatientAgent):
     idCounters = defaultdict(int) # to provide a reliable identifier for each patient.
+    idPrefixes = {}
 
     def __init__(self, name, patch, ward, timeNow=0, debug=False):
         pyrheabase.PatientAgent.__init__(self, name, patch, ward, timeNow=timeNow, debug=debug)
@@ -782,9 +794,7 @@ class PatientAgent(pyrheabase.PatientAgent):
         self._diagnosis = self.ward.fac.diagnosisFromCareTier(self.ward.tier, pOH, timeNow)
         self._status = self.ward.fac.statusFromCareTier(self.ward.tier, pOH, self.getDiagnosis(),
                                                         timeNow)
-        abbrev = self.ward.fac.abbrev
-        self.id = (abbrev, PatientAgent.idCounters[abbrev])
-        PatientAgent.idCounters[abbrev] += 1
+        self.id = PatientAgent.nextId(self.ward.fac.abbrev)
         ward.fac.getPatientRecord(self.id, timeNow=timeNow)  # force creation of a blank record
         newTier, self._treatment = self.ward.fac.prescribe(self.ward,  # @UnusedVariable
                                                            self.id,
@@ -798,6 +808,15 @@ class PatientAgent(pyrheabase.PatientAgent):
         self.agentHistory = []
         self.addHistoryEntry(self.ward, timeNow)
 
+    @classmethod
+    def nextId(cls, abbrev):
+        """Returns a new integer patient id; see pyrheautils.describePatientId"""
+        if abbrev not in cls.idPrefixes:
+            cls.idPrefixes[abbrev] = pyrheautils.patientIdPrefix(abbrev)
+        counter = cls.idCounters[abbrev]
+        cls.idCounters[abbrev] += 1
+        return pyrheautils.makePatientId(cls.idPrefixes[abbrev], counter)
+
     @classmethod
     def allocateIds(cls, fac, count):
         cls.idCounters[fac.abbrev] += count
@@ -886,7 +905,7 @@ class PatientAgent(pyrheabase.PatientAgent):
                     print tree.tagTree
                 raise
             for tree in treeL:
-                setter = tree.traverse()
+                setter = tree.traverse(self.ward.fac.rng)
                 self._status = setter.set(self._status, timeNow)
             #print "Patient status at {0} is {1}".format(facility.abbrev, self._status.pthStatus == PthStatus.CLEAR)
             if (previousStatus.pthStatus != PthStatus.COLONIZED
@@ -911,7 +930,7 @@ class PatientAgent(pyrheabase.PatientAgent):
         if True:
             self.updateDiseaseState(self.getTreatmentProtocol(), self.ward.fac, modifierDct, timeNow)
             if self.getStatus().diagClassA == DiagClassA.DEATH:
-                LOGGER.debug('%s died at %s at time %s', '%s_%s'%self.id, self.ward.fac.name, timeNow)
+                LOGGER.debug('%s died at %s at time %s', pyrheautils.describePatientId(self.id), self.ward.fac.name, timeNow)
                 infectionLogger.info("%s died at %d in fac %s, tier %s, ward %s with status %s"%(
                     self.name, timeNow, self.ward.fac.abbrev, CareTier.names[self.ward.tier],
                     self.ward.wardNum, PthStatus.names[self.getStatus().pthStatus]))
@@ -940,7 +959,7 @@ class PatientAgent(pyrheabase.PatientAgent):
 
     def getPostArrivalPauseTime(self, timeNow):  # @UnusedVariable
         if self.ward.checkInterval > 1:
-            return randint(0, self.ward.checkInterval-1)
+            return self.ward.fac.rng.randint(0, self.ward.checkInterval-1)
         else:
             return 0
 
@@ -953,7 +972,9 @@ class PatientAgent(pyrheabase.PatientAgent):
         self.ward.fac.noteHolder.addNote({"death": 1})
         if self.debug:
             self.logger.debug('Alas poor %s! %s', self.name, timeNow)
-        facAddr = choice([tpl[1] for tpl in self.patch.serviceLookup('BirthQueue')])
+        # Sort by abbrev so the choice does not depend on how queues are spread over ranks
+        birthL = sorted(self.patch.serviceLookup('BirthQueue'), key=lambda tpl: tpl[0][1])
+        facAddr = self.ward.fac.rng.choice([tpl[1] for tpl in birthL])
         self.patch.launch(BirthMsg(self.name + '_birthMsg',
                                    self.patch,
                                    self.ward.fac.getMsgPayload(BirthMsg, self),
@@ -17,7 +17,6 @@
 
 import os.path
 import sys
-import random
 import logging
 import types
 from collections import defaultdict
@@ -157,7 +156,7 @@ def ldecode(typeTpl, valL):
     else:
         return valL[0], valL[1:]
 
-cacheVer = 8
+cacheVer = 10
 LastMemCheck = time.time()
 
 class Freezer(object):
@@ -480,6 +479,10 @@ class CommunityWard(Ward):
         """Return the PatientCategory appropriate for this agent for freeze drying"""
         return "base"
 
+    def getCategoryName(self, patientCategory):
+        """Readable name of a PatientCategory, for notes and logs"""
+        return patientCategory
+
     def flushNewArrivals(self):
         """
         Forget any new arrivals- this prevents them from being freezedried (possibly redundantly).
@@ -521,21 +524,25 @@ class CommunityManager(FacilityManager):
         countD = defaultdict(lambda: 0)
         for ward in self.fac.getWards():
             if dT != 0:
+                thawPolicies = [tP for tP in self.fac.treatmentPolicies
+                                if ward in tP.thawPendingWards]
                 for patCat, freezer in ward.freezers.items():
-                    assert patCat in self.fac.cachedCDFs, ('%s has no CDF for patient category %s' %
-                                                           (self.fac.name, patCat))
+                    assert self.fac.hasCDF(patCat), ('%s has no CDF for patient category %s' %
+                                                     (self.fac.name, ward.getCategoryName(patCat)))
                     pThaw = self.getProbThaw(patCat, dT)
                     nFroz = len(freezer.frozenAgentList)
                     try:
-                        nThawed = binom.rvs(nFroz, pThaw)
+                        nThawed = binom.rvs(nFroz, pThaw, random_state=self.fac.npRng)
                     except ValueError:
                         logger.error('ValueError for %s: nFroz=%s, pThaw=%s',
                                      self.fac.name, nFroz, pThaw)
                         raise
                     self.fac.getNoteHolder().addNote({('thawed_%s' % timeNow) : nThawed })
-                    changedList = random.sample(freezer.frozenAgentList, nThawed)
+                    changedList = self.fac.rng.sample(freezer.frozenAgentList, nThawed)
                     for a in changedList:
                         thawedAgent = freezer.removeAndThaw(a, timeNow)
+                        for tP in thawPolicies:
+                            tP.handlePatientThaw(ward, thawedAgent, timeNow)
                         if thawedAgent.debug:
                             thawedAgent.logger.debug('%s unfreezedried %s at %s'
                                                      % (ward._name, thawedAgent.name, timeNow))
@@ -645,7 +652,8 @@ class Community(Facility):
 
             freezerList = []
             for pType,freezer in ward.freezers.items():
-                logger.debug('Ward %s has %d %s', ward._name, len(freezer.frozenAgentList), pType)
+                logger.debug('Ward %s has %d %s', ward._name, len(freezer.frozenAgentList),
+                             ward.getCategoryName(pType))
                 freezerList.append((pType,freezer.frozenAgentLoggerName))
                 freezer.saveFreezerData()
 
@@ -693,6 +701,9 @@ class Community(Facility):
             #rate *= (675./779.)
             self.cachedCDFs[classKey] = CachedCDFGenerator(expon(scale=1.0/rate))
 
+    def hasCDF(self, patientCategory):
+        return patientCategory in self.cachedCDFs
+
     def calcTierRateConstants(self, flowKey):
         """
         These constants represent the fraction of the newly-sick that die, that
@@ -852,7 +863,7 @@ class Community(Facility):
 
     def getInitialOverallHealth(self, ward, timeNow):  # @UnusedVariable
         fracUnhealthy = _constants['initialUnhealthyFrac']['value']
-        if random.random() <= fracUnhealthy:
+        if self.rng.random() <= fracUnhealthy:
             return PatientOverallHealth.UNHEALTHY
         else:
             return PatientOverallHealth.HEALTHY
@@ -879,6 +890,14 @@ def _populate(fac, descr, patch):
     return []
 
 TOTAL_COMMUNITY = 0
+_cacheLoadStats = {'hits': 0, 'misses': 0, 'seconds': 0.0}
+
+def getCacheLoadStats():
+    """
+    Returns a dict giving the number of communities read from the cache (hits) and
+    regenerated (misses), and the total seconds spent reading the cache.
+    """
+    return _cacheLoadStats.copy()
 
 def generateFull(facilityDescr, patch, policyClasses=None, categoryNameMapper=None,
                  communityClass=None):
@@ -904,6 +923,7 @@ def generateFull(facilityDescr, patch, policyClasses=None, categoryNameMapper=No
     orig = ward.orig
     changed = ward.changed
     # get myself a freezer to access the metadata
+    tStart = time.time()
     tFreezer = CopyOnWriteLMDBFreezer(ward, orig, changed, ward.infoList, False)
 
     try:
@@ -931,6 +951,8 @@ def generateFull(facilityDescr, patch, policyClasses=None, categoryNameMapper=No
         PatientAgent.allocateIds(fac, agentCount)
         logger.info('read population for %s from cache (%s freeze-dried people, %s)'
                     %(fDesc['abbrev'], agentCount, TOTAL_COMMUNITY))
+        _cacheLoadStats['hits'] += 1
+        _cacheLoadStats['seconds'] += time.time() - tStart
 
         return [fac], fac.getWards(), []
 
@@ -953,6 +975,8 @@ def generateFull(facilityDescr, patch, policyClasses=None, categoryNameMapper=No
     # it's not absolutely necessary but it's a big todo
     #  *** TODO wipe our section of the interdict using a new method keyRange()
 
+    _cacheLoadStats['misses'] += 1
+    _cacheLoadStats['seconds'] += time.time() - tStart
     fac.patientCacheIsBeingRegenerated = True
 
     pop = _populate(fac, facilityDescr, patch)
@@ -4,30 +4,50 @@ Created on Jun 25, 2018
 @author: welling
 '''
 
-from random import random
+import pyrheautils
 
 from quilt.peopleplaces import FutureMsg
 
 class LabWorkMsg(FutureMsg):
-    idCounter = 0
-
-    @classmethod
-    def nextId(cls):
-        rslt = cls.idCounter
-        cls.idCounter += 1
-        return rslt
-
+    """
+    One of these carries all of a facility's lab results due on a given day.  The payload
+    is just the due day; the results themselves wait in LabWork.pendingResults.
+    """
     def __init__(self, baseName, patch, payload, destAddr, arrivalTime, debug=False):
-        super(LabWorkMsg, self).__init__(baseName + '_lab_work_%d' % self.nextId(),
+        super(LabWorkMsg, self).__init__(baseName + '_lab_work_%d' % payload,
                                          patch, payload, destAddr, arrivalTime,
                                          debug=debug)
 
+class LabWorkRegistry(type):
+    """
+    Metaclass which gives each LabWork class an integer classId, so that a lab result
+    can be mapped back to the class which produced it without a search by name.
+    """
+    registry = []
+
+    def __init__(cls, name, bases, dct):
+        super(LabWorkRegistry, cls).__init__(name, bases, dct)
+        cls.classId = len(LabWorkRegistry.registry)
+        LabWorkRegistry.registry.append(cls)
+
+    @classmethod
+    def getClass(mcs, classId):
+        return mcs.registry[classId]
+
 class LabWork(object):
     '''
     This class provides support for blood tests and such.
 
     The name doesn't include either blood or test to avoid horror and/or confusion.
+
+    Results are queued by facility and due day.  The first result queued for a given
+    facility and day launches a single LabWorkMsg, and when that message arrives all of
+    the queued results are applied, with one patient record update per patient.
     '''
+    __metaclass__ = LabWorkRegistry
+
+    # {(facilityName, dueDay): {patientId: [(classId, rslt), ...]}}
+    pendingResults = {}
 
     def __init__(self, sensitivity, specificity, delayDays, debug=False):
         '''
@@ -75,28 +95,34 @@ class LabWork(object):
         if timeNow is None:
             timeNow = 0  # Deal with possible messages during initialization
         trueRslt = self.trueTestFun(patientStatus)
+        rng = pyrheautils.getRandomStream('labwork', self.__class__.__name__, ward.fac.abbrev)
         if trueRslt:
-            rslt = (random() <= self.sensitivity)
+            rslt = (rng.random() <= self.sensitivity)
         else:
-            rslt = (random() <= self.falsePosRate)
-        labWorkMsg = LabWorkMsg(ward._name, ward.patch, (patientId, rslt, self.__class__.__name__),
-                                ward.getReqQueueAddr(), timeNow + self.delayDays, self.debug)
-        ward.patch.launch(labWorkMsg, timeNow)
+            rslt = (rng.random() <= self.falsePosRate)
+        dueDay = timeNow + self.delayDays
+        key = (ward.fac.name, dueDay)
+        if key not in LabWork.pendingResults:
+            LabWork.pendingResults[key] = {}
+            labWorkMsg = LabWorkMsg(ward.fac.name, ward.patch, dueDay,
+                                    ward.getReqQueueAddr(), dueDay, self.debug)
+            ward.patch.launch(labWorkMsg, timeNow)
+        batch = LabWork.pendingResults[key]
+        if patientId not in batch:
+            batch[patientId] = []
+        batch[patientId].append((self.classId, rslt))
 
     @classmethod
     def handleLabMsg(cls, fac, msgType, payload, timeNow):
         assert issubclass(msgType, LabWorkMsg), ('lab message of type %s passed to %s'
                                                  % (msgType.__name__, cls.__name__))
-        patientId, rslt, sendingClassName = payload
-        for subCls in cls.__subclasses__():
-            if subCls.__name__ == sendingClassName:
-                sendingClass = subCls
-                break
-        else:
-            raise RuntimeError('Cannot find sending class %s for labwork for patient %s'
-                               % (sendingClassName, patientId))
-        with fac.getPatientRecord(patientId) as pRec:
-            if rslt:
-                pRec = sendingClass.posAction(pRec)
-            else:
-                pRec = sendingClass.negAction(pRec)
+        dueDay = payload
+        batch = LabWork.pendingResults.pop((fac.name, dueDay))
+        for patientId, rsltL in batch.items():
+            with fac.getPatientRecord(patientId) as pRec:
+                for classId, rslt in rsltL:
+                    sendingClass = LabWorkRegistry.getClass(classId)
+                    if rslt:
+                        pRec = sendingClass.posAction(pRec)
+                    else:
+                        pRec = sendingClass.negAction(pRec)
@@ -0,0 +1,226 @@
+#! /usr/bin/env python
+
+###################################################################################
+# Copyright   2018, Pittsburgh Supercomputing Center (PSC).  All Rights Reserved. #
+# =============================================================================== #
+#                                                                                 #
+# Permission to use, copy, and modify this software and its documentation without #
+# fee for personal use within your organization is hereby granted, provided that  #
+# the above copyright notice is preserved in all copies and that the copyright    #
+# and this permission notice appear in supporting documentation.  All other       #
+# restrictions and obligations are defined in the GNU Affero General Public       #
+# License v3 (AGPL-3.0) located at http://www.gnu.org/licenses/agpl-3.0.html  A   #
+# copy of the license is also provided in the top level of the source directory,  #
+# in the file LICENSE.txt.                                                        #
+#                                                                                 #
+###################################################################################
+
+"""
+Run a scenario sweep on the local machine, without a batch scheduler.
+
+The sweep is described by a YAML file like this:
+
+    model: ChicagoLand
+    expName: exp_xdro_sweep
+    baseConf: multiyear_allfac_ChicagoLand_xdro.yaml
+    replicates: 4
+    pyrheaOpts: "-k 730"          # optional
+    pyrheaPrefix: ""              # optional, eg. "mpirun -n 4"
+    limits:                       # optional, per run
+        maxMemGB: 32
+        maxCpuHours: 48
+        maxWallHours: 24
+    parameters:
+      - name: xdroFrac
+        file: xdro_registry_scenario_constants.yaml
+        path: [someKey, value]
+        values: [0.1, 0.2, 0.4]
+
+Every combination of the parameter values is an experiment, and gets its own run
+directory built by qsub_run_utils.RunEnvironment, with each parameter's value written
+at the given path of the given constants file.  Each experiment is run 'replicates'
+times with different seeds.  Relative paths in the spec are relative to src/sim,
+which is where the runs start.
+
+A run which finishes cleanly leaves a marker file in its run directory, and runs with
+a marker are skipped, so an interrupted sweep can be resumed by running it again.
+"""
+
+import sys
+import os
+import os.path
+import itertools
+import optparse
+import logging
+import resource
+import signal
+import shlex
+import subprocess
+import time
+from multiprocessing.pool import ThreadPool
+import yaml
+
+from qsub_run_utils import (RunEnvironment, writeReplPairs, getDefaultRunsDir,
+                            getDefaultPyrheaDir)
+
+LOGGER = logging.getLogger(__name__)
+
+SIM_DIR = os.path.abspath(os.path.dirname(__file__))
+POLL_INTERVAL = 5.0  # seconds between checks of a running job's wall clock time
+
+
+def expandSweep(spec):
+    """
+    Yields (expNum, settingsDict, replPairs) for each point in the parameter grid.
+    settingsDict maps parameter names to values; replPairs is in the form expected by
+    RunEnvironment.
+    """
+    paramL = spec.get('parameters', [])
+    for expNum, combo in enumerate(itertools.product(*[p['values'] for p in paramL])):
+        settingsDict = {}
+        replPairs = {}
+        for param, val in zip(paramL, combo):
+            settingsDict[param['name']] = val
+            if param['file'] not in replPairs:
+                replPairs[param['file']] = []
+            replPairs[param['file']].append([param['path'], val])
+        yield expNum, settingsDict, replPairs
+
+
+def doneMarkerName(rEnv):
+    return os.path.join(rEnv.runDir, "done_%03d.txt" % rEnv.instNum)
+
+
+def logFileName(rEnv):
+    return os.path.join(rEnv.runDir, "log_%03d.txt" % rEnv.instNum)
+
+
+def buildJobs(spec, runsDir, pyrheaDir=None):
+    """Build the run directories; returns a list of RunEnvironments, one per run"""
+    baseConf = spec['baseConf']
+    if not os.path.isabs(baseConf):
+        baseConf = os.path.join(SIM_DIR, baseConf)
+    jobL = []
+    for expNum, settingsDict, replPairs in expandSweep(spec):
+        for instNum in xrange(spec.get('replicates', 1)):
+            rEnv = RunEnvironment(spec['model'], spec['expName'], expNum, instNum, baseConf,
+                                  replPairs=replPairs, pyrheaDir=pyrheaDir, runsDir=runsDir,
+                                  pyrheaOpts=spec.get('pyrheaOpts'),
+                                  pyrheaPrefix=spec.get('pyrheaPrefix'))
+            rEnv.buildEverything()
+            if instNum == 0:
+                writeReplPairs(rEnv.runDir, replPairs)
+                with open(os.path.join(rEnv.runDir, 'sweep_settings.yaml'), 'w') as f:
+                    yaml.safe_dump(settingsDict, f, default_flow_style=False)
+            jobL.append(rEnv)
+    return jobL
+
+
+def makeLimiter(limits):
+    """
+    Returns a function to be run in the child before exec, which puts the run in its own
+    process group (so the whole group can be killed) and applies the resource limits.
+    """
+    def limiter():
+        os.setsid()
+        if limits.get('maxMemGB'):
+            nBytes = int(limits['maxMemGB'] * 1024 * 1024 * 1024)
+            resource.setrlimit(resource.RLIMIT_AS, (nBytes, nBytes))
+        if limits.get('maxCpuHours'):
+            nSec = int(limits['maxCpuHours'] * 3600)
+            resource.setrlimit(resource.RLIMIT_CPU, (nSec, nSec))
+    return limiter
+
+
+def runJob(rEnv, limits, python):
+    """Run one job to completion; returns one of 'ok', 'failed' or 'timeout'"""
+    cmd = (shlex.split(rEnv.pyrheaPrefix) + [python] + rEnv.getPyrheaArgs())
+    LOGGER.info('starting %s', ' '.join(cmd))
+    if limits.get('maxWallHours'):
+        deadline = time.time() + 3600 * limits['maxWallHours']
+    else:
+        deadline = None
+    with open(logFileName(rEnv), 'w') as logF:
+        proc = subprocess.Popen(cmd, cwd=SIM_DIR, stdout=logF, stderr=subprocess.STDOUT,
+                                preexec_fn=makeLimiter(limits))
+        while proc.poll() is None:
+            if deadline is not None and time.time() > deadline:
+                LOGGER.warning('%s replicate %d exceeded its wall clock limit',
+                               rEnv.runDir, rEnv.instNum)
+                os.killpg(proc.pid, signal.SIGKILL)
+                proc.wait()
+                return 'timeout'
+            time.sleep(POLL_INTERVAL)
+    if proc.returncode == 0 and os.path.exists(rEnv.getNotesFile()):
+        with open(doneMarkerName(rEnv), 'w') as f:
+            f.write("done\n")
+        return 'ok'
+    LOGGER.warning('%s replicate %d failed with exit code %s; see %s', rEnv.runDir,
+                   rEnv.instNum, proc.returncode, logFileName(rEnv))
+    return 'failed'
+
+
+def main():
+    """
+    main
+    """
+    parser = optparse.OptionParser(usage="""
+    %prog [-n nprocs] [--runsDir dir] [--dryrun] sweep_spec.yaml
+    """)
+    parser.add_option('-n', '--nprocs', type='int', default=1,
+                      help='number of runs to execute at once (default %default)')
+    parser.add_option('--runsDir', action='store', default=None,
+                      help='directory to hold the run directories')
+    parser.add_option('--pyrheaDir', action='store', default=None,
+                      help='top of the pyrhea tree')
+    parser.add_option('--dryrun', action='store_true', default=False,
+                      help='build the run directories and list the runs, but do not run them')
+    parser.add_option('-v', '--verbose', action='store_true', default=False,
+                      help='verbose output')
+    opts, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('A sweep specification file is required')
+    if opts.nprocs < 1:
+        parser.error('--nprocs must be at least 1')
+    parser.destroy()
+
+    logging.basicConfig(level=(logging.DEBUG if opts.verbose else logging.INFO))
+
+    with open(args[0], 'rU') as f:
+        spec = yaml.safe_load(f)
+    for key in ['model', 'expName', 'baseConf']:
+        if key not in spec:
+            sys.exit('The sweep specification has no %s' % key)
+    limits = spec.get('limits', {})
+    python = spec.get('python', sys.executable)
+
+    # The runs start in SIM_DIR, so every path handed to pyrhea must be absolute
+    runsDir = os.path.abspath(opts.runsDir or getDefaultRunsDir())
+    pyrheaDir = os.path.abspath(opts.pyrheaDir or getDefaultPyrheaDir())
+    jobL = buildJobs(spec, runsDir, pyrheaDir)
+    todoL = [rEnv for rEnv in jobL if not os.path.exists(doneMarkerName(rEnv))]
+    LOGGER.info('%d runs in the sweep; %d already complete', len(jobL), len(jobL) - len(todoL))
+
+    if opts.dryrun:
+        for rEnv in todoL:
+            print ' '.join(shlex.split(rEnv.pyrheaPrefix) + [python] + rEnv.getPyrheaArgs())
+        return
+
+    pool = ThreadPool(opts.nprocs)
+    resultD = {}
+    try:
+        for rEnv, status in pool.imap_unordered(lambda rEnv: (rEnv, runJob(rEnv, limits, python)),
+                                                todoL):
+            LOGGER.info('%s replicate %d: %s', rEnv.runDir, rEnv.instNum, status)
+            resultD[status] = resultD.get(status, 0) + 1
+    finally:
+        pool.close()
+        pool.join()
+    LOGGER.info('sweep finished: %s', ', '.join(['%d %s' % (n, status)
+                                                   for status, n in sorted(resultD.items())]))
+    if set(resultD.keys()) - set(['ok']):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
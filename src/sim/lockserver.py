@@ -21,9 +21,15 @@ import signal
 import random
 import sys
 import os
+import errno
+import struct
+import json
 import logging
 import optparse
 import time
+import threading
+import unittest
+from collections import deque
 
 #############################################################
 #
@@ -111,6 +117,47 @@ def getIp():
     return IP
 
 
+################################################################
+#
+# The wire protocol
+#
+# Every message in either direction is a frame: a FRAME_HEADER
+# giving a one-byte code and the length of the body, followed by
+# the body.  A request's body is the lock name, which may be empty
+# for OP_STATS to ask for every lock.  The bodies of the replies
+# are described with the reply codes.
+#
+################################################################
+
+FRAME_HEADER = struct.Struct('!BI')
+COUNT_BODY = struct.Struct('!I')
+MAX_FRAME_BODY = 64 * 1024  # longer requests are treated as garbage
+MAX_WRITE_BACKLOG = 1024 * 1024  # a client which lets this much output pile up is dropped
+
+# Request codes
+OP_XLOCK = 1
+OP_XLOCKWAIT = 2
+OP_SLOCK = 3
+OP_SLOCKWAIT = 4
+OP_RELEASE = 5
+OP_COUNT = 6
+OP_STATS = 7
+
+# Reply codes
+R_ACQUIRED = 101  # body is the lock name
+R_FAILED = 102  # body is the lock name
+R_RELEASED = 103  # body is the lock name
+R_ACCESSCOUNT = 104  # body is the count packed as COUNT_BODY, then the lock name
+R_STATS = 105  # body is a JSON dict mapping lock names to LockStats.asDict() dicts
+R_ERROR = 106  # body is an error message
+
+
+def packFrame(code, body=''):
+    if isinstance(body, unicode):
+        body = body.encode('utf-8')
+    return FRAME_HEADER.pack(code, len(body)) + body
+
+
 ################################################################
 #
 # This section is the server code
@@ -121,12 +168,95 @@ def getIp():
 #
 ################################################################
 
+if hasattr(select, 'epoll'):
+    EV_IN = select.EPOLLIN
+    EV_OUT = select.EPOLLOUT
+    EV_ERR = select.EPOLLERR | select.EPOLLHUP
+
+    def _makePoller():
+        return select.epoll()
+
+    _POLL_TIMEOUT_SCALE = 1.0  # epoll takes seconds
+else:
+    # No epoll on BSD or OS X; poll has the same interface apart from the timeout units
+    EV_IN = select.POLLIN
+    EV_OUT = select.POLLOUT
+    EV_ERR = select.POLLERR | select.POLLHUP | select.POLLNVAL
+
+    def _makePoller():
+        return select.poll()
+
+    _POLL_TIMEOUT_SCALE = 1000.0  # poll takes milliseconds
+
+
+class LockStats(object):
+    """
+    Running statistics for one lock name.  These outlive the ServerLock itself, which is
+    discarded whenever the lock is free.
+    """
+    def __init__(self):
+        self.nAcquired = 0
+        self.nContended = 0  # requests which could not be granted at once
+        self.nFailed = 0  # non-waiting requests which were refused
+        self.totHoldTime = 0.0
+        self.maxHoldTime = 0.0
+        self.totWaitTime = 0.0
+        self.maxWaitTime = 0.0
+        self.maxQueueDepth = 0
+
+    def noteHold(self, holdTime):
+        self.totHoldTime += holdTime
+        self.maxHoldTime = max(self.maxHoldTime, holdTime)
+
+    def noteWait(self, waitTime):
+        self.totWaitTime += waitTime
+        self.maxWaitTime = max(self.maxWaitTime, waitTime)
+
+    def asDict(self, lock=None):
+        """lock is the live ServerLock for this name, or None if the lock is free"""
+        return {'acquired': self.nAcquired,
+                'contended': self.nContended,
+                'failed': self.nFailed,
+                'totHoldTime': self.totHoldTime,
+                'maxHoldTime': self.maxHoldTime,
+                'meanWaitTime': (self.totWaitTime / self.nContended
+                                 if self.nContended else 0.0),
+                'maxWaitTime': self.maxWaitTime,
+                'maxQueueDepth': self.maxQueueDepth,
+                'holders': (lock.accessCount if lock is not None else 0),
+                'queueDepth': (lock.nWaiting if lock is not None else 0)}
+
+
+class Waiter(object):
+    """A client's place in the queue for a lock"""
+    __slots__ = ['client', 'shared', 'seq', 'tQueued', 'active']
+
+    def __init__(self, client, shared, seq, tQueued):
+        self.client = client
+        self.shared = shared
+        self.seq = seq
+        self.tQueued = tQueued
+        self.active = True  # cleared if the client goes away while waiting
+
+
 class ServerLock(object):
-    def __init__(self, lName):
-        LockDict[lName] = self
+    """
+    Shared and exclusive waiters are kept in separate queues, each in arrival order.
+    When the lock comes free it goes to whichever of the two queue heads arrived first;
+    if that is a shared waiter, every shared waiter gets the lock at once.  Waiters which
+    give up are only marked inactive, and are discarded when they reach the head of
+    their queue.
+    """
+    def __init__(self, server, lName):
+        server.lockDict[lName] = self
+        self.server = server
         self.lName = lName
-        self.clientsWaiting = []
+        self.stats = server.getLockStats(lName)
+        self.sharedWaiters = deque()
+        self.exclusiveWaiters = deque()
+        self.nWaiting = 0
         self.accessCount = 0
+        self.shared = False
 
     def tryRequest(self, shared):
         """
@@ -149,233 +279,361 @@ class ServerLock(object):
         """
         requests lock asynchronously,
         returns True if lock is available immediately otherwise False
-        if wait is set, adds client to the wait list and the client will be notified when the lock
-        is given to them.
+        if wait is set, adds client to the wait queue and the client will be notified when
+        the lock is given to them.
         """
         if self.tryRequest(shared):
+            self.stats.nAcquired += 1
             return True
 
+        self.stats.nContended += 1
         if wait:
-            self.clientsWaiting.append((client,shared))
+            waiter = Waiter(client, shared, self.server.nextSeq(), time.time())
+            if shared:
+                self.sharedWaiters.append(waiter)
+            else:
+                self.exclusiveWaiters.append(waiter)
+            self.nWaiting += 1
+            self.stats.maxQueueDepth = max(self.stats.maxQueueDepth, self.nWaiting)
+            client.waiter = waiter
+        else:
+            self.stats.nFailed += 1
         return False
 
-    def release(self):
+    @staticmethod
+    def _prune(queue):
+        while queue and not queue[0].active:
+            queue.popleft()
+
+    def _grant(self, waiter):
+        waiter.active = False
+        self.nWaiting -= 1
+        self.tryRequest(waiter.shared)  # this should be guaranteed to work
+        self.stats.nAcquired += 1
+        self.stats.noteWait(time.time() - waiter.tQueued)
+        waiter.client.notify()
+
+    def release(self, holdTime):
+        self.stats.noteHold(holdTime)
         self.accessCount -= 1
 
         if self.accessCount > 0:
             return
 
-        if not self.clientsWaiting:
-            del LockDict[self.lName]
-            return
-
-        client, shared = self.clientsWaiting.pop(0)
-        self.tryRequest(shared)  # this should be guaranteed to work
-        client.notify()
-
-        if not shared:  # if it's an exclusive lock, there's nothing more to do
+        self._prune(self.sharedWaiters)
+        self._prune(self.exclusiveWaiters)
+        sQ = self.sharedWaiters
+        xQ = self.exclusiveWaiters
+        if not sQ and not xQ:
+            del self.server.lockDict[self.lName]
             return
 
-        # if it's a shared lock, check the remaining clients and see which others want access
-        clients = self.clientsWaiting
-        self.clientsWaiting = []
-        for client,shared in clients:
-            if shared:
-                self.tryRequest(shared)  # again this should always work
-                client.notify()
-            else:
-                self.clientsWaiting.append((client, shared))
+        if xQ and (not sQ or xQ[0].seq < sQ[0].seq):
+            self._grant(xQ.popleft())
+        else:
+            # a shared lock goes to every client waiting for shared access
+            while sQ:
+                waiter = sQ.popleft()
+                if waiter.active:
+                    self._grant(waiter)
 
-    def clearWaiting(self, client, shared):
-        self.clientsWaiting.remove((client, shared))
+    def clearWaiting(self, waiter):
+        waiter.active = False
+        self.nWaiting -= 1
 
     def count(self):
         return self.accessCount
 
 
 class LockConnection(object):
-    def __init__(self, clientSocket, address):
+    def __init__(self, server, clientSocket, address):
+        self.server = server
         self.fileno = clientSocket.fileno()
-        ClientDict[self.fileno] = self
         self.clientSocket = clientSocket
         self.address = address
         LOGGER.debug("new client from %s on fd %s", address, self.fileno)
         self.readBuf = ""
-        self.locks = {}  # True if shared, False if exclusive
-        self.waiting = False  # True if waiting for a lock
+        self.writeBuf = ""
+        self.locks = {}  # lName -> (shared, time acquired)
+        self.waiter = None  # set while waiting for a lock
+        self.alive = True
 
         self.clientSocket.setblocking(0)
+        server.clientDict[self.fileno] = self
+        server.poller.register(self.fileno, EV_IN | EV_ERR)
 
-    def read(self):
+    def onReadable(self):
         try:
-            data = self.clientSocket.recv(select.PIPE_BUF)
-            if len(data) == 0:
-                self.killClient()
+            data = self.clientSocket.recv(65536)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
                 return
-            self.readBuf += data
-        except:
-            LOGGER.warning("got exception on read")
+            LOGGER.warning("got exception on read from %s: %s", self.address, e)
+            self.killClient()
+            return
+        if not data:
             self.killClient()
             return
+        self.readBuf += data
         self.processReadBuf()
 
     def processReadBuf(self):
-
-        # process read buffer for as long as we have complete commands and aren't waiting for a lock
-        while self.waiting is False:
-            line, nl, rest = self.readBuf.partition('\n')
-            if nl != '\n':
-                return
-            self.readBuf = rest
-            line = line.strip()
-            cmd, sp, lName = line.partition(' ')
-            if sp != ' ':
+        """
+        process the read buffer for as long as we have complete requests and aren't
+        waiting for a lock
+        """
+        hdrSz = FRAME_HEADER.size
+        while self.alive and self.waiter is None and len(self.readBuf) >= hdrSz:
+            code, bodyLen = FRAME_HEADER.unpack_from(self.readBuf)
+            if bodyLen > MAX_FRAME_BODY:
+                LOGGER.warning('oversized request from %s; dropping the client', self.address)
                 self.killClient()
                 return
-
-            lName = lName.strip()
-            if cmd == "release":
-                if lName not in self.locks:
-                    self.send("ERROR %s not already locked\n"%lName)
-                    continue
-                LockDict[lName].release()
-                del self.locks[lName]
-                self.send("RELEASED %s\n"%lName)
-                continue
-
-            if cmd == "count":
-                if lName in LockDict:
-                    self.send("ACCESSCOUNT %s %d\n"%(lName, LockDict[lName].count()))
-                else:
-                    self.send("ACCESSCOUNT %s 0\n"%lName)
-                continue
-                
-
-            # all other commands require an lName that isn't already in locks
-            if lName in self.locks:
-                self.send("ERROR %s already locked\n"%lName)
-                continue
-
-            if cmd == "xlock":
-                self.request(lName, shared=False, wait=False)
-            elif cmd == "slock":
-                self.request(lName, shared=True, wait=False)
-            elif cmd == "xlockwait":
-                self.request(lName, shared=False, wait=True)
-            elif cmd == "slockwait":
-                self.request(lName, shared=True, wait=True)
-            else:
-                self.killClient()
+            if len(self.readBuf) < hdrSz + bodyLen:
+                return
+            lName = self.readBuf[hdrSz: hdrSz + bodyLen]
+            self.readBuf = self.readBuf[hdrSz + bodyLen:]
+            self.dispatch(code, lName)
+
+    def dispatch(self, code, lName):
+        lockDict = self.server.lockDict
+        if code == OP_RELEASE:
+            if lName not in self.locks:
+                self.send(R_ERROR, "%s not already locked" % lName)
                 return
+            shared, tAcquired = self.locks.pop(lName)  # @UnusedVariable
+            lockDict[lName].release(time.time() - tAcquired)
+            self.send(R_RELEASED, lName)
+            return
+
+        if code == OP_COUNT:
+            count = lockDict[lName].count() if lName in lockDict else 0
+            self.send(R_ACCESSCOUNT, COUNT_BODY.pack(count) + lName)
+            return
+
+        if code == OP_STATS:
+            self.send(R_STATS, json.dumps(self.server.getStatsDict(lName or None)))
+            return
+
+        # all other commands require an lName that isn't already in locks
+        if lName in self.locks:
+            self.send(R_ERROR, "%s already locked" % lName)
+            return
+
+        if code == OP_XLOCK:
+            self.request(lName, shared=False, wait=False)
+        elif code == OP_SLOCK:
+            self.request(lName, shared=True, wait=False)
+        elif code == OP_XLOCKWAIT:
+            self.request(lName, shared=False, wait=True)
+        elif code == OP_SLOCKWAIT:
+            self.request(lName, shared=True, wait=True)
+        else:
+            LOGGER.warning('unknown request code %s from %s; dropping the client',
+                           code, self.address)
+            self.killClient()
 
     def request(self, lName, shared, wait):
-        if LockDict[lName].request(shared=shared, client=self, wait=wait):
-            self.locks[lName] = shared
-            self.send("ACQUIRED %s\n"%lName)
+        if self.server.lockDict[lName].request(shared=shared, client=self, wait=wait):
+            self.locks[lName] = (shared, time.time())
+            self.send(R_ACQUIRED, lName)
             return
 
         if wait:
             self.waitName = lName
-            self.waitShared = shared
-            self.waiting = True
             return
 
-        self.send("FAILED %s\n"%lName)
+        self.send(R_FAILED, lName)
 
     def notify(self):
-        self.locks[self.waitName] = self.waitShared
-        self.send("ACQUIRED %s\n"%self.waitName)
-        self.waiting = False
+        self.locks[self.waitName] = (self.waiter.shared, time.time())
+        self.waiter = None
+        self.send(R_ACQUIRED, self.waitName)
+        # Requests which arrived while we waited are handled once the current event is done
+        self.server.markRunnable(self)
 
-    def send(self, data):
+    def send(self, code, body=''):
         """
-        send data back to the client.  For now I'm going to say that pipelining requests is
-        not legal and if a send would block then the client is behaving badly and should die
-
-        this will fail on unicode strings
+        Queue a reply to the client and send as much as the socket will take.  Whatever
+        is left over goes out when the socket becomes writable.
         """
-        if len(data) != self.clientSocket.send(data):
+        if not self.alive:
+            return
+        hadBacklog = bool(self.writeBuf)
+        self.writeBuf += packFrame(code, body)
+        if not hadBacklog:
+            self.onWritable()
+        if self.alive and len(self.writeBuf) > MAX_WRITE_BACKLOG:
+            LOGGER.warning('client %s is not reading its replies; dropping it', self.address)
             self.killClient()
 
+    def onWritable(self):
+        try:
+            nSent = self.clientSocket.send(self.writeBuf)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                nSent = 0
+            else:
+                self.killClient()
+                return
+        self.writeBuf = self.writeBuf[nSent:]
+        if self.writeBuf:
+            self.server.poller.modify(self.fileno, EV_IN | EV_OUT | EV_ERR)
+        else:
+            self.server.poller.modify(self.fileno, EV_IN | EV_ERR)
+
     def killClient(self):
-        for lName,share in self.locks.items():
-            LockDict[lName].release()
+        if not self.alive:
+            return
+        self.alive = False
+        lockDict = self.server.lockDict
+        now = time.time()
+        for lName, (shared, tAcquired) in self.locks.items():  # @UnusedVariable
+            lockDict[lName].release(now - tAcquired)
+        self.locks = {}
 
-        if self.waiting:
-            LockDict[self.waitName].clearWaiting(self, self.waitShared)
+        if self.waiter is not None:
+            lockDict[self.waitName].clearWaiting(self.waiter)
+            self.waiter = None
 
+        try:
+            self.server.poller.unregister(self.fileno)
+        except (IOError, KeyError, ValueError):
+            pass
         try:
             self.clientSocket.close()
         except:
             pass
 
-        del ClientDict[self.fileno]
+        del self.server.clientDict[self.fileno]
         LOGGER.debug('killClient on fd %s', self.fileno)
 
     def socketError(self):
         self.killClient()
 
 
-
 class LockServer(object):
     def __init__(self, host='', port=29292):
         self.host = host
         self.port = port
         self.run = True
+        self.listenSocket = None
+        self.poller = None
+        self.lockDict = DefaultDict(lambda dd, key: ServerLock(self, key))  # lock name -> ServerLock
+        self.clientDict = {}  # fileno of client socket -> LockConnection
+        self.statsDict = {}  # lock name -> LockStats
+        self.runnable = deque()  # clients with buffered requests to process
+        self.seq = 0
+
+    def nextSeq(self):
+        self.seq += 1
+        return self.seq
+
+    def getLockStats(self, lName):
+        if lName not in self.statsDict:
+            self.statsDict[lName] = LockStats()
+        return self.statsDict[lName]
+
+    def getStatsDict(self, lName=None):
+        """Returns {lName: statsDict} for the given lock, or for every lock seen if None"""
+        if lName is None:
+            nameL = self.statsDict.keys()
+        else:
+            nameL = [lName]
+        return {nm: self.getLockStats(nm).asDict(self.lockDict[nm] if nm in self.lockDict
+                                                 else None)
+                for nm in nameL}
+
+    def markRunnable(self, client):
+        self.runnable.append(client)
 
-    def serve(self):
+    def listen(self):
+        """Open the listening socket.  Returns the port, which is useful if port was 0"""
         self.listenSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.listenSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.listenSocket.bind((self.host, self.port))
-        self.listenSocket.listen(5)
-
-        ClientDict[self.listenSocket.fileno()] = self
+        self.listenSocket.listen(128)
+        self.listenSocket.setblocking(0)
+        self.poller = _makePoller()
+        self.poller.register(self.listenSocket.fileno(), EV_IN | EV_ERR)
+        self.port = self.listenSocket.getsockname()[1]
+        return self.port
+
+    def serve(self, timeout=1.0):
+        """
+        Runs until shutdown() is called.  timeout is the longest the loop will sleep before
+        checking for shutdown.
+        """
+        if self.listenSocket is None:
+            self.listen()
+        listenFd = self.listenSocket.fileno()
 
         while self.run:
             try:
-                readList, writeList, exceptList = select.select(ClientDict.keys(), # @UnusedVariable
-                                                                [],
-                                                                ClientDict.keys())
-                for e in exceptList:
+                events = self.poller.poll(timeout * _POLL_TIMEOUT_SCALE)
+            except (IOError, select.error) as e:
+                if e.args[0] == errno.EINTR:
+                    continue  # poll throws an error when we catch a signal
+                raise
+            for fd, ev in events:
+                if fd == listenFd:
+                    if ev & EV_ERR:
+                        # something has gone to hell with the server.  Just shut down
+                        sys.exit()
+                    self.accept()
+                    continue
+                client = self.clientDict.get(fd)
+                if client is None:
+                    continue
+                if ev & EV_IN:
+                    client.onReadable()
+                if client.alive and ev & EV_OUT:
+                    client.onWritable()
+                if client.alive and ev & EV_ERR and not ev & EV_IN:
                     # we're dealing with some error on the socket - just deal with it and stay alive
-                    try:
-                        ClientDict[e].socketError()
-                    except Exception as ee:  # @UnusedVariable
-                        pass
-
-                for r in readList:
-                    if r in ClientDict:
-    #                try:  # it's extremely possible that r has been expunged from ClientDict by now
-                        ClientDict[r].read()
-    #                except:
-    #                    pass
-            except select.error as se:  # @UnusedVariable
-                pass  # select throws an error when we catch a signal
+                    client.socketError()
+            while self.runnable:
+                client = self.runnable.popleft()
+                if client.alive:
+                    client.processReadBuf()
+
+    def accept(self):
+        while True:
+            try:
+                newSock, addr = self.listenSocket.accept()
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return
+                raise
+            LockConnection(self, newSock, addr)
 
     def shutdown(self):
         """
         Trigger exit of the main loop
         """
         self.run = False
-        # the signal that got us here will have broken us out of select
+        # the signal that got us here will have broken us out of poll
 
     def cleanup(self):
         """
         Perform cleanup actions
         """
-        pass
+        for client in self.clientDict.values():
+            client.killClient()
+        if self.listenSocket is not None:
+            self.listenSocket.close()
+            self.listenSocket = None
+        for lName, dct in sorted(self.getStatsDict().items()):
+            LOGGER.info('lock %s: %s', lName, formatLockStats(dct))
 
-    def read(self):
-        newSock, addr = self.listenSocket.accept()
-        LockConnection(newSock, addr)
-
-    def socketError(self):
-        # something has gone to hell with the server.  Just shut down
-        sys.exit()
 
+def formatLockStats(dct):
+    return ('%(acquired)d acquired, %(contended)d contended, %(failed)d failed; '
+            'held %(totHoldTime).3fs total, %(maxHoldTime).3fs max; '
+            'waits %(meanWaitTime).3fs mean, %(maxWaitTime).3fs max; '
+            'queue depth %(queueDepth)d now, %(maxQueueDepth)d max; '
+            '%(holders)d holders' % dct)
 
-LockDict = DefaultDict(lambda dd,key: ServerLock(key)) # key is name of lock, val is ServerLock
-ClientDict = {} # key is fileno of clientsocket, val is LockConnection
 
 ################################################################
 #
@@ -489,6 +747,11 @@ def rmLockServerHostFile(fileName=None):
 
 class LockClient(object):
     "handles communications with lock server.  Not intended to be directly used by user"
+    cmdDict = {"xlock": OP_XLOCK,
+               "xlockwait": OP_XLOCKWAIT,
+               "slock": OP_SLOCK,
+               "slockwait": OP_SLOCKWAIT}
+
     def __init__(self, host=None, port=None):
         if port is None:
             port = DefaultLockPort
@@ -497,55 +760,53 @@ class LockClient(object):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.connect((host, port))
 
+    def _recvExactly(self, nBytes):
+        chunks = []
+        while nBytes:
+            data = self.sock.recv(nBytes)
+            if not data:
+                raise RuntimeError("lock server closed the connection")
+            chunks.append(data)
+            nBytes -= len(data)
+        return ''.join(chunks)
+
+    def _transact(self, code, body):
+        "send one request and return the (code, body) of the reply"
+        self.sock.sendall(packFrame(code, body))
+        rCode, bodyLen = FRAME_HEADER.unpack(self._recvExactly(FRAME_HEADER.size))
+        return rCode, self._recvExactly(bodyLen)
 
     def getLock(self, cmd, lName):
         "issue any of the lock commands, responses are same"
-        req = cmd + " " + lName + "\n"
-        self.sock.send(req)
-        s = ""
-        while "\n" not in s:
-            s += self.sock.recv(select.PIPE_BUF)
-
-        assert s.endswith('\n'), "invalid strings coming from lock server"
-        s = s.rstrip()
-        result, sp, msg = s.partition(' ')
-        if result == "ACQUIRED":
+        result, msg = self._transact(LockClient.cmdDict[cmd], lName)  # @UnusedVariable
+        if result == R_ACQUIRED:
             return True
-        if result == "FAILED":
+        if result == R_FAILED:
             return False
         # anything else is an error
-        raise RuntimeError("invalid respone from lockserver")
+        raise RuntimeError("invalid response from lockserver")
 
     def releaseLock(self, lName):
-        req = "release %s\n"%lName
-        self.sock.send(req)
-        s = ""
-        while "\n" not in s:
-            s += self.sock.recv(select.PIPE_BUF)
-
-        assert s.endswith('\n'), "invalid strings coming from lock server"
-        s = s.rstrip()
-        result, sp, msg = s.partition(' ')
-
-        assert result=="RELEASED", "invalid response to release from lock server"
+        result, msg = self._transact(OP_RELEASE, lName)  # @UnusedVariable
+        assert result == R_RELEASED, "invalid response to release from lock server"
         return True
 
     def getAccessCount(self, lName):
-        req = "count %s\n"%lName
-        self.sock.send(req)
-        s = ""
-        while "\n" not in s:
-            s += self.sock.recv(select.PIPE_BUF)
-
-        assert s.endswith('\n'), "invalid strings coming from lock server"
-        s = s.rstrip()
-
-        result, name, count = s.split(' ', 2)
-        assert result=="ACCESSCOUNT", "invalid response to requesting a lock count"
-        assert name == lName, "lock name in access count invalid"
-        assert count[0].isdigit(), "lock count is not a number" #not a complete check but I'm probably already excessive
-        return int(count)
-    
+        result, msg = self._transact(OP_COUNT, lName)
+        assert result == R_ACCESSCOUNT, "invalid response to requesting a lock count"
+        count, = COUNT_BODY.unpack_from(msg)
+        assert msg[COUNT_BODY.size:] == lName, "lock name in access count invalid"
+        return count
+
+    def getStats(self, lName=None):
+        """
+        Returns a dict mapping lock names to dicts of statistics for the given lock, or
+        for every lock the server has seen if lName is None.
+        """
+        result, msg = self._transact(OP_STATS, lName or '')
+        assert result == R_STATS, "invalid response to requesting lock statistics"
+        return json.loads(msg)
+
     def close(self):
         try:
             self.sock.close()
@@ -617,7 +878,21 @@ def lockAccessCount(lockName, discoverServer=True,
             pass
 
     raise RuntimeError("Can't get access count from lock server")
-    
+
+def lockStats(lockName=None, discoverServer=True,
+              host=None, port=None, lockClient=None):
+    """
+    Returns the lock server's statistics for lockName, or for all locks if lockName is None
+    """
+    for i in xrange(2):
+        try:
+            lockClient = getLockConnection(discoverServer, host, port, lockClient)
+            return lockClient.getStats(lockName)
+        except:
+            pass
+
+    raise RuntimeError("Can't get statistics from lock server")
+
 def getLockConnection(discoverServer=True, host=None, port=None, lockClient=None):
     """
     abstract out the code that chooses whether to connect to the lock server or use an existing 
@@ -634,7 +909,7 @@ def getLockConnection(discoverServer=True, host=None, port=None, lockClient=None
     for i in xrange(30):
         try:
             if discoverServer is False:
-                DefaultLockClient = LockClient(self.host, self.port)
+                DefaultLockClient = LockClient(host, port)
                 return DefaultLockClient
             else:
                 if discoverServer is True:
@@ -652,6 +927,129 @@ def getLockConnection(discoverServer=True, host=None, port=None, lockClient=None
         LOGGER.info("retrying lock server")
     raise RuntimeError("Can't reach lockserver")
 
+################################################
+#
+#  unit tests, run against a server on a loopback socket
+#
+################################################
+
+class TestLockServer(unittest.TestCase):
+    def setUp(self):
+        self.server = LockServer(host='127.0.0.1', port=0)
+        self.port = self.server.listen()
+        self.thread = threading.Thread(target=self.server.serve, kwargs={'timeout': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.close()
+        self.server.shutdown()
+        self.thread.join()
+        self.server.cleanup()
+
+    def newClient(self):
+        client = LockClient('127.0.0.1', self.port)
+        self.clients.append(client)
+        return client
+
+    def test_lockserver_many_clients(self):
+        nClients = 40
+        nLoops = 25
+        state = {'counter': 0, 'holders': 0, 'maxHolders': 0}
+        clientL = [self.newClient() for i in xrange(nClients)]  # @UnusedVariable
+        errL = []
+
+        def worker(client):
+            try:
+                for i in xrange(nLoops):  # @UnusedVariable
+                    with Lock('counter', lockClient=client):
+                        state['holders'] += 1
+                        state['maxHolders'] = max(state['maxHolders'], state['holders'])
+                        val = state['counter']
+                        time.sleep(0)
+                        state['counter'] = val + 1
+                        state['holders'] -= 1
+            except Exception as e:
+                errL.append(e)
+
+        threadL = [threading.Thread(target=worker, args=(client,)) for client in clientL]
+        for thread in threadL:
+            thread.start()
+        for thread in threadL:
+            thread.join()
+        self.assertEqual(errL, [])
+        self.assertEqual(state['counter'], nClients * nLoops)
+        self.assertEqual(state['maxHolders'], 1)
+        stats = clientL[0].getStats('counter')['counter']
+        self.assertEqual(stats['acquired'], nClients * nLoops)
+        self.assertEqual(stats['failed'], 0)
+        self.assertEqual(stats['holders'], 0)
+        self.assertEqual(stats['queueDepth'], 0)
+        self.assertTrue(stats['maxQueueDepth'] < nClients)
+
+    def test_lockserver_try_and_count(self):
+        cA = self.newClient()
+        cB = self.newClient()
+        cC = self.newClient()
+        self.assertTrue(cA.getLock('xlock', 'x'))
+        self.assertFalse(cB.getLock('xlock', 'x'))
+        self.assertFalse(cB.getLock('slock', 'x'))
+        self.assertEqual(cC.getAccessCount('x'), 1)
+        cA.releaseLock('x')
+        self.assertEqual(cC.getAccessCount('x'), 0)
+        self.assertTrue(cB.getLock('slock', 'x'))
+        self.assertTrue(cC.getLock('slock', 'x'))
+        self.assertEqual(cA.getAccessCount('x'), 2)
+        stats = cA.getStats()
+        self.assertEqual(stats['x']['failed'], 2)
+        self.assertEqual(stats['x']['holders'], 2)
+
+    def test_lockserver_queue_order(self):
+        cA = self.newClient()
+        waiterL = [self.newClient() for i in xrange(3)]  # @UnusedVariable
+        self.assertTrue(cA.getLock('xlock', 'q'))
+        grantL = []
+
+        def waitFor(client, cmd, tag):
+            client.getLock(cmd, 'q')
+            grantL.append(tag)
+
+        threadL = []
+        for client, cmd, tag in zip(waiterL, ['slockwait', 'slockwait', 'xlockwait'],
+                                    ['s1', 's2', 'x']):
+            thread = threading.Thread(target=waitFor, args=(client, cmd, tag))
+            thread.start()
+            threadL.append(thread)
+            while cA.getStats('q')['q']['queueDepth'] < len(threadL):
+                time.sleep(0.01)
+        cA.releaseLock('q')
+        threadL[0].join()
+        threadL[1].join()
+        # Both shared waiters get the lock together; the exclusive waiter is still queued
+        self.assertEqual(sorted(grantL), ['s1', 's2'])
+        self.assertEqual(cA.getAccessCount('q'), 2)
+        waiterL[0].releaseLock('q')
+        waiterL[1].releaseLock('q')
+        threadL[2].join()
+        self.assertEqual(grantL[-1], 'x')
+
+    def test_lockserver_waiter_disconnect(self):
+        cA = self.newClient()
+        cB = LockClient('127.0.0.1', self.port)
+        self.assertTrue(cA.getLock('xlock', 'w'))
+        cB.sock.sendall(packFrame(OP_XLOCKWAIT, 'w'))
+        while cA.getStats('w')['w']['queueDepth'] < 1:
+            time.sleep(0.01)
+        cB.close()
+        while cA.getStats('w')['w']['queueDepth'] > 0:
+            time.sleep(0.01)
+        cA.releaseLock('w')
+        cC = self.newClient()
+        self.assertTrue(cC.getLock('xlock', 'w'))
+
+
 ################################################
 #
 #  main hook
@@ -660,10 +1058,12 @@ def getLockConnection(discoverServer=True, host=None, port=None, lockClient=None
 
 def main():
     parser = optparse.OptionParser(usage="""
-    %prog [--debug]
+    %prog [--debug] [--stats]
     """)
     parser.add_option("-d", "--debug", action="store_true",
                       help="debugging output")
+    parser.add_option("--stats", action="store_true",
+                      help="print the statistics of the running lock server and exit")
     opts, args = parser.parse_args()
     if args:
         parser.error('Invalid arguments %s' % args)
@@ -672,6 +1072,13 @@ def main():
     else:
         logLvl = 'info'
     logging.basicConfig(level=getattr(logging, logLvl.upper(), None))
+    if opts.stats:
+        host, port, pid = discoverLockServer()  # @UnusedVariable
+        client = LockClient(host, port)
+        for lName, dct in sorted(client.getStats().items()):
+            print '%s: %s' % (lName, formatLockStats(dct))
+        client.close()
+        return
     try:
         host, port, pid = discoverLockServer()
         if (host is not None and port is not None and pid is not None
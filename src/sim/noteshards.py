@@ -0,0 +1,102 @@
+#! /usr/bin/env python
+
+###################################################################################
+# Copyright   2018, Pittsburgh Supercomputing Center (PSC).  All Rights Reserved. #
+# =============================================================================== #
+#                                                                                 #
+# Permission to use, copy, and modify this software and its documentation without #
+# fee for personal use within your organization is hereby granted, provided that  #
+# the above copyright notice is preserved in all copies and that the copyright    #
+# and this permission notice appear in supporting documentation.  All other       #
+# restrictions and obligations are defined in the GNU Affero General Public       #
+# License v3 (AGPL-3.0) located at http://www.gnu.org/licenses/agpl-3.0.html  A   #
+# copy of the license is also provided in the top level of the source directory,  #
+# in the file LICENSE.txt.                                                        #
+#                                                                                 #
+###################################################################################
+
+"""
+Reading and writing notes files, including notes split into one shard per rank.
+
+When pyrhea is run with --shardNotes each rank writes its own notes to a shard file
+at the end of the run, and rank 0 writes only a small manifest under the usual notes
+file name.  readNotes() accepts either a plain notes file or a manifest and returns
+the usual dict of notes; iterNotesShards() hands over one shard at a time for tools
+which don't need everything in memory at once.  tools/merge_notes_shards.py turns a
+manifest and its shards back into a plain notes file.
+"""
+
+import os.path
+import six.moves.cPickle as pickle
+import ujson
+
+MANIFEST_KEY = '_notesShardManifest'
+
+
+def shardFileName(notesFileName, rank):
+    """Insert a rank tag ahead of the file extension, if any"""
+    baseNm, extNm = os.path.splitext(notesFileName)
+    return '%s_rank%d%s' % (baseNm, rank, extNm)
+
+
+def writeNotes(fileName, notesDict):
+    """
+    notesDict maps note names to note dicts.  The file is written as json if the name
+    ends in '.json', otherwise as a pickle.
+    """
+    if fileName.lower().endswith('.json'):
+        with open(fileName, 'w') as f:
+            f.write('{\n')
+            sep = ''
+            for k, v in notesDict.items():
+                f.write('{0}"{1}":{2}'.format(sep, k, ujson.dumps(v)))
+                sep = ',\n'
+            f.write("\n}\n")
+    else:
+        with open(fileName, 'w') as f:
+            pickle.dump(notesDict, f)
+
+
+def writeManifest(fileName, shardInfoList):
+    """
+    shardInfoList contains a (shardFileName, nNotes) tuple for each rank, in rank
+    order.  Shard names are stored relative to the manifest's directory.
+    """
+    manifestDir = os.path.dirname(os.path.abspath(fileName))
+    shardL = []
+    nNotesL = []
+    for shardNm, nNotes in shardInfoList:
+        shardL.append(os.path.relpath(os.path.abspath(shardNm), manifestDir))
+        nNotesL.append(nNotes)
+    writeNotes(fileName, {MANIFEST_KEY: {'shards': shardL, 'nNotes': nNotesL}})
+
+
+def _readNotesFile(fileName):
+    try:
+        with open(fileName, 'r') as f:
+            return pickle.load(f)
+    except (KeyError, pickle.UnpicklingError):
+        with open(fileName, 'r') as f:
+            return ujson.load(f)
+
+
+def iterNotesShards(fileName):
+    """
+    Yields the notes dicts making up the notes file- the file's own contents if it is
+    a plain notes file, or the contents of each shard in turn if it is a manifest.
+    """
+    notesDict = _readNotesFile(fileName)
+    if MANIFEST_KEY in notesDict:
+        manifestDir = os.path.dirname(os.path.abspath(fileName))
+        for shardNm in notesDict[MANIFEST_KEY]['shards']:
+            yield _readNotesFile(os.path.join(manifestDir, shardNm))
+    else:
+        yield notesDict
+
+
+def readNotes(fileName):
+    """Returns the dict of all notes, whether fileName is a plain notes file or a manifest"""
+    notesDict = {}
+    for shardDict in iterNotesShards(fileName):
+        notesDict.update(shardDict)
+    return notesDict
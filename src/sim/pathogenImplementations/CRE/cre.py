@@ -18,7 +18,6 @@
 import logging
 import math
 import types
-from random import random
 from collections import defaultdict
 from scipy.stats import expon
 import pyrheautils
@@ -105,6 +104,7 @@ class CRE(Pathogen):
         self.propogationInfoKey = None
         self.propogationInfoTime = None
         self.treatmentProbModifierDict = None
+        self.treatmentProbModifierKey = None
 
         if ward.tier == CareTier.HOME:
             self.clearColonizedStatusProb = _constants['homeClearColonizedStatusProb']['value']
@@ -137,9 +137,9 @@ class CRE(Pathogen):
         Derived classes often cache things like BayesTrees, but the items in the cache
         can become invalid when a new scenario starts and the odds of transitions are
         changed.  This method is called when the environment wants to trigger a cache
-        flush.
+        flush.  The shared trees in the core are keyed by tau and by the facility's
+        treatment policy versions, so they remain valid and are not discarded here.
         """
-        self.core.flushCaches()
         self.treatmentProbModifierDict = None
         self.propogationInfoTime = None
 
@@ -200,9 +200,9 @@ class CRE(Pathogen):
         This method assigns the patient a Status appropriate to time 0- that is,
         it implements the initial seeding of the patient population with pathogen.
         """
-        pthStatus = (PthStatus.COLONIZED if (random() <= self.initialFracColonized)
+        pthStatus = (PthStatus.COLONIZED if (self.rng.random() <= self.initialFracColonized)
                      else defaultPthStatus)
-        canClear = (random() > self.core.fracPermanentlyColonized)
+        canClear = (self.rng.random() > self.core.fracPermanentlyColonized)
         patient._status = patient._status._replace(pthStatus=pthStatus)._replace(canClear=canClear)
 
     def getPatientStateKey(self, status, treatment):
@@ -234,7 +234,8 @@ class CRE(Pathogen):
 
     def getTreatmentProbModifierDict(self):
         """Maintain and return a cached table of efficacies of combinations of treatments"""
-        if not self.treatmentProbModifierDict:
+        versionKey = self.ward.fac.getTreatmentPolicyVersionKey()
+        if not self.treatmentProbModifierDict or versionKey != self.treatmentProbModifierKey:
             dct = {'+': (1.0, 1.0),
                    '-': (0.0, 1.0)}  # Store the two coefficients in from-to order
             for tP in self.ward.fac.treatmentPolicies:
@@ -250,6 +251,7 @@ class CRE(Pathogen):
                         newDct[kStr + '+'] = (fromFac * fromProb, toFac*toProb)
                     dct = newDct
             self.treatmentProbModifierDict = dct
+            self.treatmentProbModifierKey = versionKey
         return self.treatmentProbModifierDict
 
     def getStatusChangeTree(self, patientAgent, modifierDct, startTime, timeNow):
@@ -263,7 +265,8 @@ class CRE(Pathogen):
             # Note that this caching scheme assumes all wards with the same category and tier
             # have the same infectivity constant(s)
             #
-            key = (self.ward.fac.category, self.ward.tier, treatment, pIKey, dT, self.tau)
+            key = (self.ward.fac.category, self.ward.tier, treatment, pIKey, dT, self.tau,
+                   self.ward.fac.getTreatmentPolicyVersionKey())
 #             if 'THC_4058_L' in ward._name:
 #                 print '%s %s %s %s' % (ward._name, patientStatus.justArrived, pI, treatment)
             if key not in self.core.exposureTreeCache:
@@ -18,7 +18,6 @@
 import logging
 import math
 import types
-from random import random
 from collections import defaultdict
 from scipy.stats import expon
 import pyrheautils
@@ -174,7 +173,7 @@ class DUMMYPATHOGEN(Pathogen):
         This method assigns the patient a Status appropriate to time 0- that is,
         it implements the initial seeding of the patient population with pathogen.
         """
-        pthStatus = (PthStatus.COLONIZED if (random() <= self.initialFracColonized)
+        pthStatus = (PthStatus.COLONIZED if (self.rng.random() <= self.initialFracColonized)
                      else defaultPthStatus)
         canClear = False
         patient._status = patient._status._replace(pthStatus=pthStatus)._replace(canClear=canClear)
@@ -17,7 +17,6 @@
 
 import logging
 import math
-from random import random
 import types
 from collections import defaultdict
 import pyrheautils
@@ -145,6 +144,7 @@ class MRSA(Pathogen):
         self.propogationInfoKey = None
         self.propogationInfoTime = None
         self.treatmentProbModifierDict = None
+        self.treatmentProbModifierKey = None
 
         if ward.tier == CareTier.HOME:
             self.clearColonizedStatusProb = _constants['homeClearColonizedStatusProb']['value']
@@ -200,9 +200,9 @@ class MRSA(Pathogen):
         Derived classes often cache things like BayesTrees, but the items in the cache
         can become invalid when a new scenario starts and the odds of transitions are
         changed.  This method is called when the environment wants to trigger a cache
-        flush.
+        flush.  The shared trees in the core are keyed by tau and by the facility's
+        treatment policy versions, so they remain valid and are not discarded here.
         """
-        self.core.flushCaches()
         self.treatmentProbModifierDict = None
         self.propogationInfoTime = None
 
@@ -260,8 +260,8 @@ class MRSA(Pathogen):
         This method assigns the patient a Status appropriate to time 0- that is,
         it implements the initial seeding of the patient population with pathogen.
         """
-        patient._status = self.initializationBayesTree.traverse().set(patient.getStatus(), 0)
-        canClear = (random() > self.core.fracPermanentlyColonized)
+        patient._status = self.initializationBayesTree.traverse(self.rng).set(patient.getStatus(), 0)
+        canClear = (self.rng.random() > self.core.fracPermanentlyColonized)
         patient._status = patient.getStatus()._replace(canClear=canClear)
 
 
@@ -294,7 +294,8 @@ class MRSA(Pathogen):
 
     def getTreatmentProbModifierDict(self):
         """Maintain and return a cached table of efficacies of combinations of treatments"""
-        if not self.treatmentProbModifierDict:
+        versionKey = self.ward.fac.getTreatmentPolicyVersionKey()
+        if not self.treatmentProbModifierDict or versionKey != self.treatmentProbModifierKey:
             dct = {'+': (1.0, 1.0),
                    '-': (0.0, 1.0)}  # Store the two coefficients in from-to order
             for tP in self.ward.fac.treatmentPolicies:
@@ -310,6 +311,7 @@ class MRSA(Pathogen):
                         newDct[kStr + '+'] = (fromFac * fromProb, toFac*toProb)
                     dct = newDct
             self.treatmentProbModifierDict = dct
+            self.treatmentProbModifierKey = versionKey
         return self.treatmentProbModifierDict
 
     def getStatusChangeTree(self, patientAgent, modifierDct, startTime, timeNow):
@@ -323,7 +325,8 @@ class MRSA(Pathogen):
             # Note that this caching scheme assumes all wards with the same category and tier
             # have the same infectivity constant(s)
             #
-            key = (self.ward.fac.category, self.ward.tier, treatment, pIKey, dT, self.tau)
+            key = (self.ward.fac.category, self.ward.tier, treatment, pIKey, dT, self.tau,
+                   self.ward.fac.getTreatmentPolicyVersionKey())
             if key not in self.core.exposureProbCache:
 
                 # CLEAR and UNDETCOLONIZED have the same odds of picking up MRSA colonization
@@ -17,6 +17,7 @@
 
 from phacsl.utils.collections.phacollections import enum, namedtuple
 from freezerbase import FreezerError
+import pyrheautils
 
 PthStatus = enum('CLEAR', 'COLONIZED', 'CHRONIC', 'INFECTED', 'RECOVERED', 'UNDETCOLONIZED')
 defaultPthStatus = PthStatus.CLEAR
@@ -32,6 +33,8 @@ class Pathogen(object):
         between facility descriptions and implementations.
         """
         self.ward = ward
+        self.rng = pyrheautils.getRandomStream('pathogen', ward.fac.abbrev, ward.tier,
+                                               ward.wardNum)
         self.patientPth = self._emptyPatientPth()
         self.patientPthTime = None
 
@@ -16,7 +16,6 @@
 ###################################################################################
 
 import logging
-from random import random
 
 from phacsl.utils.collections.phacollections import SingletonMetaClass
 import pyrheautils
@@ -88,7 +87,7 @@ class ContactPrecautionsTreatmentPolicy(BaseTreatmentPolicy):
         tier = ward.tier
         try:
             frac = self.core.baseFracTbl[ward.fac.category][ward.tier][pthStatus]
-            if random() <= frac:
+            if self.getRandomStream(ward.fac).random() <= frac:
                 if not patient.getTreatment('contactPrecautions'):
                     ward.miscCounters['newPatientsOnCP'] += 1
                 patient.setTreatment(contactPrecautions=True)
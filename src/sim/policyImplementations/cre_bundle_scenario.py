@@ -44,8 +44,8 @@ class CREBundleScenario(BaseScenarioPolicy):
 
     def begin(self, callingAgent, timeNow):
         LOGGER.warn(self.logThisString)
-        assert hasattr(self.patch, 'allFacilities'), ('patch %s has no list of facilities!'
-                                                      % self.patch.name)
+        assert hasattr(self.patch, 'facilityByAbbrev'), ('patch %s has no facility index!'
+                                                         % self.patch.name)
         baseTime = timeNow
 
         for when, abbrev, action in self.evtList:
@@ -55,40 +55,33 @@ class CREBundleScenario(BaseScenarioPolicy):
                 timeNow = callingAgent.sleep((baseTime + when) - timeNow)
             #print "{0}: {1} {2}".format(abbrev, when, action)
 
-            for fac in self.patch.allFacilities:
-                if fac.abbrev == abbrev:
-                    fac.flushCaches()
-                    for ward in fac.getWards():
-                        ward.iA.flushCaches()
-                    if action == 'START':
-                        if type(fac.diagnosticPolicy).__name__ == CREBundleDiagnosticPolicy.__name__:
-                            fac.diagnosticPolicy.setValue('active', True)
-                        else:
-                            raise RuntimeError('%s does not have a CREBundleDiagnosticPolicy' % abbrev)
-                        for tP in fac.treatmentPolicies:
-                            #if isinstance(tP, CREBundleTreatmentPolicy):
-                            if type(tP).__name__ == CREBundleTreatmentPolicy.__name__:
-                                tP.setValue('active', True)
-                                for ward in fac.getWards():
-                                    for patient in ward.getPatientList():
-                                        tP.initializePatientTreatment(ward,patient)
-                                LOGGER.info('Activated CREBundleScenario at %s' % abbrev)
-                                break
-                        else:
-                            raise RuntimeError('%s does not have a CREBundleTreatmentPolicy' % abbrev)
-                    elif action == 'END':
-                        if type(fac.diagnosticPolicy).__name__ == CREBundleDiagnosticPolicy.__name__:
-                            fac.diagnosticPolicy.setValue('active', False)
-                        for tP in fac.treatmentPolicies:
-                            if type(tP).__name__ == CREBundleTreatmentPolicy.__name__:
-                                tP.setValue('active', False)
-                                LOGGER.info('Deactivated CREBundleScenario at %s' % abbrev)
-                                break
-                    else:
-                        raise RuntimeError('Nonsense action %s' % action)
-                    break
-            else:
+            fac = self.patch.facilityByAbbrev.get(abbrev)
+            if fac is None:
                 raise RuntimeError('Failed to find the facility %s' % abbrev)
+            # Cached trees which depend on the treatment policies are keyed on their versions,
+            # so changing the active flags below is enough to invalidate them.
+            if action == 'START':
+                if fac.diagnosticPolicy.isinstance(CREBundleDiagnosticPolicy):
+                    fac.diagnosticPolicy.activate(fac, timeNow)
+                else:
+                    raise RuntimeError('%s does not have a CREBundleDiagnosticPolicy' % abbrev)
+                for tP in fac.treatmentPolicies:
+                    if tP.isinstance(CREBundleTreatmentPolicy):
+                        tP.activate(fac, timeNow)
+                        LOGGER.info('Activated CREBundleScenario at %s' % abbrev)
+                        break
+                else:
+                    raise RuntimeError('%s does not have a CREBundleTreatmentPolicy' % abbrev)
+            elif action == 'END':
+                if fac.diagnosticPolicy.isinstance(CREBundleDiagnosticPolicy):
+                    fac.diagnosticPolicy.deactivate(fac, timeNow)
+                for tP in fac.treatmentPolicies:
+                    if tP.isinstance(CREBundleTreatmentPolicy):
+                        tP.deactivate(fac, timeNow)
+                        LOGGER.info('Deactivated CREBundleScenario at %s' % abbrev)
+                        break
+            else:
+                raise RuntimeError('Nonsense action %s' % action)
 
 def getPolicyClasses():
     return [CREBundleScenario]
@@ -73,6 +73,15 @@ class CREBundleTreatmentPolicy(BaseTreatmentPolicy):
             LOGGER.fatal(msg)
             raise RuntimeError(msg)
 
+    def activateWard(self, ward, timeNow):
+        """
+        Only some tiers implement the bundle, so most wards (the community in particular)
+        need no attention at all.  Elsewhere everyone present gets the current setting,
+        or on thawing if they are frozen.
+        """
+        if (ward.fac.implCategory, ward.tier) in TIERS_IMPLEMENTING_BUNDLE:
+            super(CREBundleTreatmentPolicy, self).activateWard(ward, timeNow)
+
     def handlePatientArrival(self, ward, patient, transferInfoDict, timeNow):
         """
         This is called on patients when they arrive at a ward.
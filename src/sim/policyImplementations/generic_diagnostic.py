@@ -16,7 +16,6 @@
 ###################################################################################
 
 import logging
-from random import random
 import types
 
 import pyrheautils
@@ -81,6 +80,7 @@ class GenericDiagnosticPolicy(BaseDiagnosticPolicy):
         self.effectiveness = _constants['pathogenDiagnosticEffectiveness']['value']
         self.falsePosRate = _constants['pathogenDiagnosticFalsePositiveRate']['value']
         self.core = GDPCore()
+        self.rng = self.getRandomStream(facility)
         self.increasedEffectivness = -1.0
         self.increasedFalsePosRate = -1.0
         self.useCentralRegistry = False
@@ -94,7 +94,7 @@ class GenericDiagnosticPolicy(BaseDiagnosticPolicy):
         if 'carriesPth' in transferInfoDict:
             # Transfer probability was checked on the sending end
             rcvFacProb = self.core.rcvDiagnosisBetweenFacility[ward.fac.category]
-            if random() <= rcvFacProb:
+            if self.rng.random() <= rcvFacProb:
                 with ward.fac.getPatientRecord(patient.id, timeNow=timeNow) as pRec:
                     pRec.carriesPth = True
 
@@ -104,7 +104,7 @@ class GenericDiagnosticPolicy(BaseDiagnosticPolicy):
         """
         BaseDiagnosticPolicy.handlePatientDeparture(self, ward, patient, timeNow)
         # Apparently there is a fair chance the patient record gets lost between visits
-        if random() > self.core.sameFacilityDiagnosisMemory[ward.fac.category]:
+        if self.rng.random() > self.core.sameFacilityDiagnosisMemory[ward.fac.category]:
             ward.fac.forgetPatientRecord(patient.id)
 
     def diagnose(self, ward, patientId, patientStatus, oldDiagnosis, timeNow=None):
@@ -122,13 +122,14 @@ class GenericDiagnosticPolicy(BaseDiagnosticPolicy):
                     if 'cpReason' not in pRec.noteD:
                         pRec.noteD['cpReason'] = 'passive'
                 elif patientStatus.pthStatus == PthStatus.COLONIZED:
-                    randVal = random()  # re-use this to get proper passive/xdro split
+                    randVal = self.rng.random()  # re-use this to get proper passive/xdro split
                     if randVal <= self.effectiveness:
                         diagnosedPthStatus = PthStatus.COLONIZED
                         pRec.noteD['cpReason'] = 'passive'
                     elif (self.useCentralRegistry and
                           (randVal <= self.increasedEffectiveness or
-                           (random() <= self.core.registrySearchCompliance[ward.fac.category] and
+                           (self.rng.random()
+                            <= self.core.registrySearchCompliance[ward.fac.category] and
                             Registry.getPatientStatus(str(ward.iA), patientId)))):
                         diagnosedPthStatus = PthStatus.COLONIZED
                         pRec.noteD['cpReason'] = 'xdro'
@@ -136,7 +137,7 @@ class GenericDiagnosticPolicy(BaseDiagnosticPolicy):
                         diagnosedPthStatus = PthStatus.CLEAR  # Missed the diagnosis
                         pRec.noteD['cpReason'] = None
                 else:
-                    randVal = random()  # re-use this to get proper passive/xdro split
+                    randVal = self.rng.random()  # re-use this to get proper passive/xdro split
                     if randVal <= self.falsePosRate:
                         diagnosedPthStatus = PthStatus.COLONIZED
                         pRec.noteD['cpReason'] = 'passive'
@@ -164,11 +165,11 @@ class GenericDiagnosticPolicy(BaseDiagnosticPolicy):
         pRec = facility.getPatientRecord(patient.id)
         if pRec.carriesPth:
             sendFacProb = self.core.sendDiagnosisBetweenFacility[facility.category]
-            if random() <= sendFacProb:
+            if self.rng.random() <= sendFacProb:
                 transferInfoDict['carriesPth'] = True
 
             if self.useCentralRegistry:
-                if random() <= self.core.registryAddCompliance[facility.category]:
+                if self.rng.random() <= self.core.registryAddCompliance[facility.category]:
                     #print('here we are %s' % facility.category)
                     Registry.registerPatientStatus(patient.id,
                                                    str(patient.ward.iA),
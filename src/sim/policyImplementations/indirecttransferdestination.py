@@ -153,8 +153,9 @@ class IndirectTransferDestinationPolicy(BaseTransferDestinationPolicy):
             try:
                 pairList, tot = self.core.getWeightedList(flowKey, newTier)
                 return [addr for destNm, addr                               # @UnusedVariable
-                        in transferbydrawwithreplacement.randomOrderByWt(pairList, tot,
-                                                                         cull=thisFacility.abbrev)]
+                        in transferbydrawwithreplacement.randomOrderByWt(
+                            pairList, tot, cull=thisFacility.abbrev,
+                            rng=self.getRandomStream(thisFacility))]
             except IndexError, e:
                 LOGGER.error('Hit IndexError %s for %s %s -> %s at %s', e, thisFacility.abbrev,
                              oldTier, newTier, timeNow)
@@ -69,9 +69,12 @@ class SwabTestCore(object):
 
 
 class SwabTest(labwork.LabWork):
-    def __init__(self, minDelayDays, maxDelayDays, debug=False):
+    def __init__(self, minDelayDays, maxDelayDays, rng=None, debug=False):
         self.core = SwabTestCore()
-        delay = choice(range(minDelayDays, maxDelayDays + 1))
+        if rng is None:
+            delay = choice(range(minDelayDays, maxDelayDays + 1))
+        else:
+            delay = rng.choice(range(minDelayDays, maxDelayDays + 1))
         super(SwabTest, self).__init__(sensitivity=_constants['swabDiagnosticSensitivity']['value'],
                                        specificity=_constants['swabDiagnosticSpecificity']['value'],
                                        delayDays=delay,
@@ -100,8 +103,9 @@ class MRSAControlDiagnosticPolicy(GenericDiagnosticPolicy):
         self.swabCore = SwabTestCore()
         self.swabTestD = {}
         self.swabTestD = {tier: SwabTest(self.swabCore.swabDelayDaysByTierMin[tier],
-                                         self.swabCore.swabDelayDaysByTierMax[tier])
-                          for tier in self.swabCore.swabDelayDaysByTierMin}
+                                         self.swabCore.swabDelayDaysByTierMax[tier],
+                                         rng=self.rng)
+                          for tier in sorted(self.swabCore.swabDelayDaysByTierMin)}
         self.active = False
 
     def diagnose(self, ward, patientId, patientStatus, oldDiagnosis, timeNow=None):
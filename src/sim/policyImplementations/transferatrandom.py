@@ -16,7 +16,6 @@
 ###################################################################################
 
 import logging
-import random
 
 from phacsl.utils.collections.phacollections import SingletonMetaClass
 import pyrheautils
@@ -39,8 +38,10 @@ class RandomTransferDestinationPolicy(BaseTransferDestinationPolicy):
     def getOrderedCandidateFacList(self, facility, patientAgent, oldTier, newTier,
                                    modifierDct, timeNow):
         queueClass = tierToQueueMap[newTier]
-        facAddrList = [tpl[1] for tpl in self.patch.serviceLookup(queueClass.__name__)]
-        random.shuffle(facAddrList)
+        # Sort by abbrev so the shuffle does not depend on how queues are spread over ranks
+        tplL = sorted(self.patch.serviceLookup(queueClass.__name__), key=lambda tpl: tpl[0][1])
+        facAddrList = [tpl[1] for tpl in tplL]
+        self.getRandomStream(facility).shuffle(facAddrList)
         return facAddrList
 
 
@@ -20,7 +20,6 @@ import logging
 import os.path
 from phacsl.utils.collections.phacollections import SingletonMetaClass
 import pyrheautils
-import random
 from collections import deque
 from policybase import TransferDestinationPolicy as BaseTransferDestinationPolicy
 from facilitybase import CareTier, tierToQueueMap
@@ -103,10 +102,11 @@ class CapacityTransferDestinationPolicy(BaseTransferDestinationPolicy):
         tot = self.core.totTbl[newTier]
 #         print 'newTier: %s' % CareTier.names[newTier]
         facList = []
+        rng = self.getRandomStream(oldFacility)
 #        facList_sav = [abbrev for capacity, abbrev in pairList]
         while pairList:
             capSum = 0.0
-            lim = random.random() * tot
+            lim = rng.random() * tot
             newPL = deque()
 #             print 'pairList: %s' % pairList
 #             print 'lim: %s' % lim
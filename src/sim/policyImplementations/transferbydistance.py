@@ -19,6 +19,7 @@ import logging
 
 import os.path
 import math
+import numpy as np
 import pyrheautils
 from phacsl.utils.collections.phacollections import SingletonMetaClass
 from policybase import TransferDestinationPolicy as BaseTransferDestinationPolicy
@@ -58,37 +59,103 @@ def longitudeLatitudeSep(lon1, lat1, lon2, lat2):
     return R*c
 
 
+def separationMatrix(srcLons, srcLats, dstLons, dstLats):
+    """
+    Vectorized form of longitudeLatitudeSep.  Inputs are 1-D arrays in floating point
+    degrees; returns an array of shape (nSrc, nDst) of separations in kilometers.
+    """
+    scale = math.pi / 180.
+    lat1r = srcLats[:, np.newaxis] * scale
+    lon1r = srcLons[:, np.newaxis] * scale
+    lat2r = dstLats[np.newaxis, :] * scale
+    lon2r = dstLons[np.newaxis, :] * scale
+    apb = np.sin(lat1r)*np.sin(lat2r) + np.cos(lat1r)*np.cos(lat2r) * np.cos(lon2r-lon1r)
+    np.clip(apb, -1.0, 1.0, out=apb)  # avoid rounding error
+    R = 6378.  # radius of earth in km; in miles it's 3963.189
+    return R*np.arccos(apb)
+
+
 class MinDistanceCore(object):
     """This is where we put things that are best shared across all instances"""
     __metaclass__ = SingletonMetaClass
 
-    def __init__(self):
-        pass
+    def __init__(self, patch):
+        self.patch = patch
+        self.srcIdxMap = None
+        self.tierRankTbl = None
+        self.cache = {}
+
+    def _buildRankings(self):
+        """
+        For each tier, rank that tier's facilities by distance from every facility known
+        to the patch.  The ranking is held as a matrix of destination indices, one row
+        per source, in increasing order of separation; ties are broken by the service
+        info as the old sort-based calculation did.
+        """
+        logger.info('Building facility distance rankings')
+        tierTplD = {}
+        srcCoordD = {}
+        for tier in CareTier.names.keys():
+            tplL = sorted(self.patch.serviceLookup(tierToQueueMap[tier].__name__))
+            tierTplD[tier] = tplL
+            for info, addr in tplL:  # @UnusedVariable
+                innerInfo, abbrev, coords = info  # @UnusedVariable
+                srcCoordD[abbrev] = coords
+        srcAbbrevL = sorted(srcCoordD.keys())
+        self.srcIdxMap = {abbrev: idx for idx, abbrev in enumerate(srcAbbrevL)}
+        srcLons = np.array([srcCoordD[abbrev][0] for abbrev in srcAbbrevL], dtype=np.float64)
+        srcLats = np.array([srcCoordD[abbrev][1] for abbrev in srcAbbrevL], dtype=np.float64)
+        self.tierRankTbl = {}
+        for tier, tplL in tierTplD.items():
+            addrL = [addr for info, addr in tplL]  # @UnusedVariable
+            if tplL:
+                dstLons = np.array([info[2][0] for info, addr in tplL], dtype=np.float64)
+                dstLats = np.array([info[2][1] for info, addr in tplL], dtype=np.float64)
+                sepM = separationMatrix(srcLons, srcLats, dstLons, dstLats)
+                rankM = np.argsort(sepM, axis=1, kind='mergesort').astype(np.int32)
+            else:
+                rankM = np.zeros((len(srcAbbrevL), 0), dtype=np.int32)
+            self.tierRankTbl[tier] = (addrL, rankM)
+        logger.info('Distance rankings complete')
+
+    def getOrderedAddrList(self, srcFacility, tier):
+        """
+        Returns the addresses of the given tier's queues, nearest to srcFacility first.
+        The caller must not modify the returned list.
+        """
+        key = (srcFacility.abbrev, tier)
+        if key not in self.cache:
+            if self.tierRankTbl is None:
+                self._buildRankings()
+            addrL, rankM = self.tierRankTbl[tier]
+            if srcFacility.abbrev in self.srcIdxMap:
+                rankV = rankM[self.srcIdxMap[srcFacility.abbrev]]
+            else:
+                # A source with no queues of its own; rank from its coordinates
+                srcLon, srcLat = srcFacility.coords
+                tplL = sorted(self.patch.serviceLookup(tierToQueueMap[tier].__name__))
+                sepV = separationMatrix(np.array([srcLon], dtype=np.float64),
+                                        np.array([srcLat], dtype=np.float64),
+                                        np.array([info[2][0] for info, addr in tplL],
+                                                 dtype=np.float64),
+                                        np.array([info[2][1] for info, addr in tplL],
+                                                 dtype=np.float64))[0]
+                rankV = np.argsort(sepV, kind='mergesort')
+            self.cache[key] = [addrL[idx] for idx in rankV]
+        return self.cache[key]
 
 
 class MinDistanceTransferDestinationPolicy(BaseTransferDestinationPolicy):
     def __init__(self, patch, categoryNameMapper):
         super(MinDistanceTransferDestinationPolicy, self).__init__(patch, categoryNameMapper)
-        self.core = MinDistanceCore()
-        self.cache = {}
+        self.core = MinDistanceCore(patch)
 
     def buildCacheEntry(self, oldFacility, newTier):
-        srcLon, srcLat = oldFacility.coords
-        queueClass = tierToQueueMap[newTier]
-        tplList = []
-        for info, addr in self.patch.serviceLookup(queueClass.__name__):
-            innerInfo, destAbbrev, destCoords = info  # @UnusedVariable
-            dstLon, dstLat = destCoords
-            sep = longitudeLatitudeSep(srcLon, srcLat, dstLon, dstLat)
-            tplList.append((sep, info, addr))
-        tplList.sort()
-        return [c for a, b, c in tplList]  # @UnusedVariable
+        return self.core.getOrderedAddrList(oldFacility, newTier)[:]
 
     def getOrderedCandidateFacList(self, oldFacility, patientAgent, oldTier, newTier,
                                    modifierDct, timeNow):
-        if newTier not in self.cache:
-            self.cache[newTier] = self.buildCacheEntry(oldFacility, newTier)
-        return self.cache[newTier][:]
+        return self.core.getOrderedAddrList(oldFacility, newTier)[:]
 
 
 def getPolicyClasses():
@@ -32,13 +32,16 @@ _constants = None
 logger = logging.getLogger(__name__)
 
 
-def randomOrderByWt(pairList, tot, cull=None):
+def randomOrderByWt(pairList, tot, cull=None, rng=None):
     """
     Given a list of the form [(weight, info), ...] in reverse sorted order
     and a value tot which is the sum of all the weights, return a list of
     info elements in weighted random order.  If cull is not None, exclude
-    info[0]b==cull from the randomized list.
+    info[0]b==cull from the randomized list.  If rng is not None, its random()
+    method is used in place of the global generator.
     """
+    if rng is None:
+        rng = random
     if cull is None:
         pairList = deque(pairList)
     else:
@@ -49,7 +52,7 @@ def randomOrderByWt(pairList, tot, cull=None):
     try:
         while pairList:
             wtSum = 0.0
-            lim = random.random() * tot
+            lim = rng.random() * tot
             newPL = deque()
 #             print 'pairList: %s' % pairList
 #             print 'lim: %s' % lim
@@ -194,7 +197,8 @@ class DrawWithReplacementTransferDestinationPolicy(BaseTransferDestinationPolicy
         pairList, tot = self.core.getTierWeightedList(oldFacility.abbrev, newTier)
 #             print 'newTier: %s' % CareTier.names[newTier]
         try:
-            return [b for a, b in randomOrderByWt(pairList, tot)]
+            return [b for a, b in randomOrderByWt(pairList, tot,
+                                                  rng=self.getRandomStream(oldFacility))]
         except IndexError, e:
             logger.error('Hit IndexError %s for %s %s -> %s at %s', e, oldFacility.abbrev,
                            oldTier, newTier, timeNow)
@@ -41,8 +41,8 @@ class XDROPlusCREBundleScenario(BaseScenarioPolicy):
         self.evtList.sort()
 
     def begin(self, callingAgent, timeNow):
-        assert hasattr(self.patch, 'allFacilities'), ('patch %s has no list of facilities!'
-                                                      % self.patch.name)
+        assert hasattr(self.patch, 'facilityByAbbrev'), ('patch %s has no facility index!'
+                                                         % self.patch.name)
         baseTime = timeNow
 
         for when, abbrev, action in self.evtList:
@@ -52,55 +52,49 @@ class XDROPlusCREBundleScenario(BaseScenarioPolicy):
                 timeNow = callingAgent.sleep((baseTime + when) - timeNow)
             print "{0}: {1} {2}".format(abbrev, when, action)
 
-            for fac in self.patch.allFacilities:
-                if fac.abbrev == abbrev:
-                    fac.flushCaches()
-                    for ward in fac.getWards():
-                        ward.iA.flushCaches()
-                    if action == 'START':
-                        if fac.diagnosticPolicy.isinstance(CREBundleDiagnosticPolicy):
-                            fac.diagnosticPolicy.setValue('active', True)
-                            fac.diagnosticPolicy.setValue('useCentralRegistry', True)
-                            fac.diagnosticPolicy.setValue('pathogenDiagnosticEffectivenessIncreasedAwareness',
-                                                          self.newEffectiveness)
-                            logger.info('Activated XDROScenario at %s' % abbrev)
-                        else:
-                            raise RuntimeError('%s does not have a CREBundleDiagnosticPolicy'
-                                               % abbrev)
-                        for tP in fac.treatmentPolicies:
-                            if tP.isinstance(CREBundleTreatmentPolicy):
-                                tP.setValue('active', True)
-                                for ward in fac.getWards():
-                                    for patient in ward.getPatientList():
-                                        tP.initializePatientTreatment(ward, patient)
-                                logger.info('Activated CREBundleScenario at %s' % abbrev)
-                                break
-                        else:
-                            raise RuntimeError('%s does not have a CREBundleTreatmentPolicy'
-                                               % abbrev)
-                    elif action == 'END':
-                        if fac.diagnosticPolicy.isinstance(CREBundleDiagnosticPolicy):
-                            fac.diagnosticPolicy.setValue('active', False)
-                            fac.diagnosticPolicy.setValue('useCentralRegistry', False)
-                            fac.diagnosticPolicy.setValue('pathogenDiagnosticEffectivenessIncreasedAwareness',
-                                                          None)
-                            logger.info('Deactivated XDROScenario at %s' % abbrev)
-                        else:
-                            raise RuntimeError('%s does not have a CREBundleDiagnosticPolicy'
-                                               % abbrev)
-                        for tP in fac.treatmentPolicies:
-                            if tP.isinstance(CREBundleTreatmentPolicy):
-                                tP.setValue('active', False)
-                                logger.info('Deactivated CREBundleScenario at %s' % abbrev)
-                                break
-                        else:
-                            raise RuntimeError('%s does not have a CREBundleTreatmentPolicy'
-                                               % abbrev)
-                    else:
-                        raise RuntimeError('Nonsense action %s' % action)
-                    break
-            else:
+            fac = self.patch.facilityByAbbrev.get(abbrev)
+            if fac is None:
                 raise RuntimeError('Failed to find the facility %s' % abbrev)
+            # Cached trees which depend on the treatment policies are keyed on their versions,
+            # so changing the active flags below is enough to invalidate them.
+            if action == 'START':
+                if fac.diagnosticPolicy.isinstance(CREBundleDiagnosticPolicy):
+                    fac.diagnosticPolicy.activate(fac, timeNow)
+                    fac.diagnosticPolicy.setValue('useCentralRegistry', True)
+                    fac.diagnosticPolicy.setValue('pathogenDiagnosticEffectivenessIncreasedAwareness',
+                                                  self.newEffectiveness)
+                    logger.info('Activated XDROScenario at %s' % abbrev)
+                else:
+                    raise RuntimeError('%s does not have a CREBundleDiagnosticPolicy'
+                                       % abbrev)
+                for tP in fac.treatmentPolicies:
+                    if tP.isinstance(CREBundleTreatmentPolicy):
+                        tP.activate(fac, timeNow)
+                        logger.info('Activated CREBundleScenario at %s' % abbrev)
+                        break
+                else:
+                    raise RuntimeError('%s does not have a CREBundleTreatmentPolicy'
+                                       % abbrev)
+            elif action == 'END':
+                if fac.diagnosticPolicy.isinstance(CREBundleDiagnosticPolicy):
+                    fac.diagnosticPolicy.deactivate(fac, timeNow)
+                    fac.diagnosticPolicy.setValue('useCentralRegistry', False)
+                    fac.diagnosticPolicy.setValue('pathogenDiagnosticEffectivenessIncreasedAwareness',
+                                                  None)
+                    logger.info('Deactivated XDROScenario at %s' % abbrev)
+                else:
+                    raise RuntimeError('%s does not have a CREBundleDiagnosticPolicy'
+                                       % abbrev)
+                for tP in fac.treatmentPolicies:
+                    if tP.isinstance(CREBundleTreatmentPolicy):
+                        tP.deactivate(fac, timeNow)
+                        logger.info('Deactivated CREBundleScenario at %s' % abbrev)
+                        break
+                else:
+                    raise RuntimeError('%s does not have a CREBundleTreatmentPolicy'
+                                       % abbrev)
+            else:
+                raise RuntimeError('Nonsense action %s' % action)
 
 def getPolicyClasses():
     return [XDROPlusCREBundleScenario]
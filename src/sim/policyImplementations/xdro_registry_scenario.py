@@ -38,12 +38,13 @@ class XDRORegistryScenario(BaseScenarioPolicy):
 
     def begin(self, callingAgent, timeNow):
         logger.warn(self.logThisString)
-        assert hasattr(self.patch, 'allFacilities'), ('patch %s has no list of facilities!'
-                                                      % self.patch.name)
+        assert hasattr(self.patch, 'facilityByAbbrev'), ('patch %s has no facility index!'
+                                                         % self.patch.name)
         # All we have to do is turn on the intervention in all locations implementing
         # the scenario.
-        for fac in self.patch.allFacilities:
-            if fac.abbrev in self.facSet:
+        for abbrev in sorted(self.facSet):
+            fac = self.patch.facilityByAbbrev.get(abbrev)
+            if fac is not None:
                 if fac.diagnosticPolicy.isinstance(GenericDiagnosticPolicy):
                     #print 'XDRO setting %s' % fac.abbrev
                     fac.diagnosticPolicy.setValue('useCentralRegistry', True)
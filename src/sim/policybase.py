@@ -16,8 +16,11 @@
 ###################################################################################
 
 import logging
+import unittest
 from typebase import CareTier, PatientDiagnosis, PatientOverallHealth, DiagClassA
 from pathogenbase import PthStatus, defaultPthStatus
+from freezerbase import FreezerError
+import pyrheautils
 
 from phacsl.utils.classutils.metaclasses import ClassIsInstanceMeta
 
@@ -28,10 +31,33 @@ class Policy(object):
 
     __metaclass__ = ClassIsInstanceMeta
 
+    """
+    Incremented each time the 'active' flag of this policy changes value, so that cached
+    results which depend on the policy can be keyed on it rather than flushed wholesale.
+    """
+    version = 0
+
     def __init__(self, patch, categoryNameMapper):
         self.patch = patch
         self.categoryNameMapper = categoryNameMapper
 
+    @property
+    def active(self):
+        return self.__dict__.get('_active', False)
+
+    @active.setter
+    def active(self, val):
+        if val != self.active:
+            self.version += 1
+        self._active = val
+
+    def getRandomStream(self, facility):
+        """
+        Returns the random stream belonging to this policy at the given facility.  Draws
+        made from it do not depend on how facilities are partitioned across ranks.
+        """
+        return pyrheautils.getRandomStream('policy', type(self).__name__, facility.abbrev)
+
 
 class DiagnosticPolicy(Policy):
     def __init__(self, facility, patch, categoryNameMapper):
@@ -43,8 +69,9 @@ class DiagnosticPolicy(Policy):
         This is called on patients when they arrive at a ward.
         """
         if timeNow is not None:  # turn off debugging before time starts
-            logger.debug('%s arrives %s %s', '%s_%s'%patient.id, ward._name, timeNow)
-            logger.debug('%s status is %s', '%s_%s'%patient.id, str(patient.getStatus()))
+            ptName = pyrheautils.describePatientId(patient.id)
+            logger.debug('%s arrives %s %s', ptName, ward._name, timeNow)
+            logger.debug('%s status is %s', ptName, str(patient.getStatus()))
 
     def handlePatientDeparture(self, ward, patient, timeNow):
         """
@@ -103,6 +130,17 @@ class DiagnosticPolicy(Policy):
         """
         return transferInfoDict
 
+    def activate(self, facility, timeNow):
+        """
+        Turn this policy on at the given facility, for example when a scenario starts.
+        Diagnoses are made as patients are seen, so no per-patient work is needed.
+        """
+        self.setValue('active', True)
+
+    def deactivate(self, facility, timeNow):
+        """Turn this policy off at the given facility"""
+        self.setValue('active', False)
+
     def setValue(self, key, val):
         """
         Setting values may be useful for changing phases in a scenario, for example. The
@@ -116,6 +154,10 @@ class DiagnosticPolicy(Policy):
 
 
 class TreatmentPolicy(Policy):
+    def __init__(self, patch, categoryNameMapper):
+        super(TreatmentPolicy, self).__init__(patch, categoryNameMapper)
+        self.thawPendingWards = set()
+
     def initializePatientTreatment(self, ward, patient):
         """
         This is called on patients at time zero, when they are first assigned to the
@@ -227,6 +269,49 @@ class TreatmentPolicy(Policy):
         else:
             return 0.0
 
+    def activate(self, facility, timeNow):
+        """
+        Turn this policy on at the given facility, for example when a scenario starts,
+        and bring the treatment of the patients already present up to date.  This is
+        done a ward at a time by activateWard.
+        """
+        self.setValue('active', True)
+        # activateWard decides afresh which wards have frozen patients to catch up
+        self.thawPendingWards.difference_update(facility.getWards())
+        for ward in facility.getWards():
+            self.activateWard(ward, timeNow)
+
+    def deactivate(self, facility, timeNow):
+        """
+        Turn this policy off at the given facility.  Patients keep their current treatment
+        until they depart, and patients still frozen are no longer updated when they thaw.
+        """
+        self.setValue('active', False)
+        self.thawPendingWards.difference_update(facility.getWards())
+
+    def activateWard(self, ward, timeNow):
+        """
+        Update the treatment of all the patients in the ward after this policy has been
+        activated.  Derived classes which can tell that the ward is unaffected, or can
+        update everyone at once, should override this.  Patients who are freeze-dried
+        cannot be reached; they are brought up to date by handlePatientThaw instead.
+        """
+        try:
+            patientL = ward.getPatientList()
+        except FreezerError:
+            self.thawPendingWards.add(ward)
+            patientL = ward.getLiveLockedAgents()
+        for patient in patientL:
+            self.initializePatientTreatment(ward, patient)
+
+    def handlePatientThaw(self, ward, patient, timeNow):
+        """
+        This is called on patients who have just been thawed out of a freezer.  Any
+        treatment changes made while they were frozen are applied now.
+        """
+        if ward in self.thawPendingWards:
+            self.initializePatientTreatment(ward, patient)
+
     def setValue(self, key, val):
         """
         Setting values may be useful for changing phases in a scenario, for example. The
@@ -251,3 +336,57 @@ class ScenarioPolicy(object):
 
     def begin(self, callingAgent, timeNow):
         logger.info('The scenario %s is beginning', self.name)
+
+
+class TestTreatmentPolicy(unittest.TestCase):
+    class _Ward(object):
+        """A ward whose patients are partly freeze-dried, as in the community"""
+        def __init__(self, liveL):
+            self.liveL = liveL
+
+        def getPatientList(self):
+            raise FreezerError('some patients are frozen')
+
+        def getLiveLockedAgents(self):
+            return self.liveL
+
+    class _Facility(object):
+        def __init__(self, wardL):
+            self.wardL = wardL
+
+        def getWards(self):
+            return self.wardL
+
+    class _Policy(TreatmentPolicy):
+        def __init__(self):
+            super(TestTreatmentPolicy._Policy, self).__init__(None, None)
+            self.treatedL = []
+
+        def initializePatientTreatment(self, ward, patient):
+            self.treatedL.append(patient)
+
+        def setValue(self, key, val):
+            self.active = val
+
+    def setUp(self):
+        self.ward = self._Ward(['live'])
+        self.fac = self._Facility([self.ward])
+        self.policy = self._Policy()
+
+    def test_thaw_after_activate(self):
+        self.policy.activate(self.fac, 1)
+        self.assertEqual(self.policy.treatedL, ['live'])
+        self.assertEqual(self.policy.thawPendingWards, set([self.ward]))
+        self.policy.handlePatientThaw(self.ward, 'thawed', 2)
+        self.assertEqual(self.policy.treatedL, ['live', 'thawed'])
+
+    def test_deactivate_clears_pending(self):
+        self.policy.activate(self.fac, 1)
+        self.policy.deactivate(self.fac, 2)
+        self.assertFalse(self.policy.thawPendingWards)
+        self.policy.handlePatientThaw(self.ward, 'thawed', 3)
+        self.assertEqual(self.policy.treatedL, ['live'])
+        self.policy.activate(self.fac, 4)
+        self.assertEqual(self.policy.thawPendingWards, set([self.ward]))
+        self.policy.handlePatientThaw(self.ward, 'thawed', 5)
+        self.assertEqual(self.policy.treatedL, ['live', 'live', 'thawed'])
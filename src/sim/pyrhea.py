@@ -22,21 +22,30 @@ import logging
 import logging.config
 from random import seed
 from collections import defaultdict
+import heapq
 import optparse
 import re
 import signal
 import types
-
+import time
+import json
+import tempfile
+import shutil
+import unittest
+try:
+    import resource
+except ImportError:
+    resource = None  # not available on Windows
+
+import numpy as np
 import yaml
-import pika
-import six.moves.cPickle as pickle
-import ujson
 
 import quilt.patches as patches
 import phacsl.utils.formats.yaml_tools as yaml_tools
 import phacsl.utils.notes.noteholder as noteholder
 import schemautils
 import pyrheautils
+import noteshards
 from typebase import PatientOverallHealth
 from registry import Registry
 from policybase import ScenarioPolicy
@@ -45,6 +54,7 @@ import checkpoint
 import bcz_monitor
 from closuretricks import ClosureFixer
 from daydata import DayDataGroup
+from remotelog import BatchingLogHandler, restartSendersAfterFork
 
 BASE_DIR = os.path.dirname(__file__)
 SCHEMA_DIR = os.path.join(BASE_DIR, '../schemata')
@@ -424,6 +434,8 @@ def loadFacilityDescriptions(dirList, facImplDict, facImplRules):
         else:
             raise RuntimeError('cannot find a facility implementation for %s, category %s',
                                rec['abbrev'], rec['category'])
+    for rec in facRecs:
+        pyrheautils.patientIdPrefix(rec['abbrev'])  # fails early if two abbrevs collide
     return facRecs
 
 
@@ -456,6 +468,59 @@ def distributeFacilities(comm, facDirs, facImplDict, facImplRules, partitionFile
     return myFacList
 
 
+def forkReplicates(nReplicates, baseSeed):
+    """
+    Fork nReplicates child processes which share the already-initialized simulation state
+    by copy-on-write.  Each child reseeds the random number generators and returns its
+    replicate index.  The parent process never returns; it waits for the children and
+    exits with a nonzero status if any of them failed.
+
+    Replicate i is seeded with baseSeed + i, or from system entropy if baseSeed is None.
+    """
+    childPidD = {}
+    for repIdx in xrange(nReplicates):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            restartSendersAfterFork()
+            if baseSeed is None:
+                seed()
+                np.random.seed()
+                pyrheautils.setRandomStreamSeed(None)
+            else:
+                seed(baseSeed + repIdx)
+                np.random.seed((baseSeed + repIdx) % (2 ** 32))
+                pyrheautils.setRandomStreamSeed(baseSeed + repIdx)
+            return repIdx
+        childPidD[pid] = repIdx
+        LOGGER.info('Forked replicate %d as pid %d', repIdx, pid)
+
+    nFailed = 0
+    while childPidD:
+        pid, status = os.wait()
+        if pid not in childPidD:
+            continue
+        repIdx = childPidD.pop(pid)
+        if status != 0:
+            LOGGER.error('Replicate %d (pid %d) exited with status %s', repIdx, pid, status)
+            nFailed += 1
+        else:
+            LOGGER.info('Replicate %d (pid %d) finished', repIdx, pid)
+    logging.shutdown()
+    if nFailed:
+        sys.exit('%d of %d replicates failed' % (nFailed, nReplicates))
+    sys.exit(0)
+
+
+def replicateFileName(fileName, repIdx):
+    """Insert a replicate tag ahead of the file extension, if any"""
+    if repIdx is None:
+        return fileName
+    baseNm, extNm = os.path.splitext(fileName)
+    return '%s_rep%d%s' % (baseNm, repIdx, extNm)
+
+
 def collectNotes(nhGroup, comm):
     allNotesGroup = noteholder.NoteHolderGroup()
     nhList = [allNotesGroup.copyNoteHolder(nh.getDict()) for nh in nhGroup.getnotes()]
@@ -471,6 +536,137 @@ def collectNotes(nhGroup, comm):
         return (None, None)
 
 
+def writeNotesShard(nhGroup, comm, notesName, runFailed):
+    """
+    Each rank writes its own notes to a shard file, and rank 0 collects only the shard
+    names to write a manifest under notesName.  See noteshards.readNotes.
+    """
+    shardName = noteshards.shardFileName(notesName, comm.rank)
+    d = {}
+    for nh in nhGroup.getnotes():
+        d[nh['name']] = nh.getDict()
+    noteshards.writeNotes(shardName, d)
+    shardInfo = (shardName, len(d), runFailed)
+    if comm.rank == 0:
+        shardInfoList = [shardInfo]
+        for targetRank in xrange(comm.size):
+            if targetRank != comm.rank:
+                shardInfoList.append(comm.recv(source=targetRank))
+        if any([failed for shardNm, nNotes, failed in shardInfoList]):  # @UnusedVariable
+            # edit output file name to show failure
+            baseNm, extNm = os.path.splitext(notesName)
+            notesName = baseNm + '_FAILED' + extNm
+        noteshards.writeManifest(notesName, [tpl[:2] for tpl in shardInfoList])
+    else:
+        comm.send(shardInfo, dest=0)
+
+
+class RunTimer(object):
+    """
+    Collects the figures written by --timings: the wall clock time of each phase of the
+    run, the peak RSS, and the number of agent-days simulated.  Each call to mark() ends
+    the phase which began at the previous call.  If a scenario start day is set, the
+    wall clock time of the first day after the start is also collected.
+    """
+    def __init__(self):
+        self.tLast = time.time()
+        self.phaseD = {}
+        self.agentDays = 0
+        self.lastDay = 0
+        self.scenarioStartDay = None
+        self.dayEndD = {}  # wall clock time at which each day's callbacks began
+
+    def mark(self, phase):
+        tNow = time.time()
+        self.phaseD[phase] = self.phaseD.get(phase, 0.0) + (tNow - self.tLast)
+        self.tLast = tNow
+
+    def createPerDayCB(self, patch):
+        def perDayCB(loop, timeNow):  # @UnusedVariable
+            self.agentDays += sum([fac.patientStats.currentOccupancy
+                                   for fac in patch.allFacilities
+                                   if hasattr(fac, 'patientStats')])
+            self.lastDay = max(self.lastDay, timeNow)
+            if timeNow not in self.dayEndD:
+                self.dayEndD[timeNow] = time.time()
+        return perDayCB
+
+    def getScenarioStartDaySeconds(self):
+        """Returns None if there was no scenario or the run ended before the day finished"""
+        if self.scenarioStartDay is None:
+            return None
+        day = self.scenarioStartDay + 1
+        if day in self.dayEndD and (day - 1) in self.dayEndD:
+            return self.dayEndD[day] - self.dayEndD[day - 1]
+        else:
+            return None
+
+    def getRankSummary(self):
+        if resource is None:
+            peakRSSMB = None
+        else:
+            # ru_maxrss is in kilobytes on Linux
+            peakRSSMB = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        phaseD = self.phaseD.copy()
+        # Community implementations are loaded from their own directories, so look for
+        # the shared module rather than importing it here
+        genericCommunity = sys.modules.get('genericCommunity')
+        if genericCommunity is None:
+            cacheStats = None
+        else:
+            cacheStats = genericCommunity.getCacheLoadStats()
+            phaseD['communityCacheLoad'] = cacheStats['seconds']
+        return {'phases': phaseD, 'agentDays': self.agentDays, 'days': self.lastDay,
+                'peakRSSMB': peakRSSMB, 'communityCache': cacheStats,
+                'scenarioStartDay': self.scenarioStartDay,
+                'scenarioStartDaySeconds': self.getScenarioStartDaySeconds()}
+
+
+def writeTimings(runTimer, comm, fileName, baseSeed, runFailed):
+    """
+    Rank 0 collects the RunTimer summaries of all ranks and writes them as json.  Phase
+    times and peak RSS at the top level are those of the slowest or largest rank;
+    communityCacheLoad is part of initialization.
+    """
+    summary = runTimer.getRankSummary()
+    if comm.rank == 0:
+        rankL = [summary]
+        for targetRank in xrange(comm.size):
+            if targetRank != comm.rank:
+                rankL.append(comm.recv(source=targetRank))
+        phaseD = {}
+        for rankSummary in rankL:
+            for phase, sec in rankSummary['phases'].items():
+                phaseD[phase] = max(phaseD.get(phase, 0.0), sec)
+        nDays = max([rankSummary['days'] for rankSummary in rankL])
+        agentDays = sum([rankSummary['agentDays'] for rankSummary in rankL])
+        loopSec = phaseD.get('dailyLoop', 0.0)
+        rssL = [rankSummary['peakRSSMB'] for rankSummary in rankL
+                if rankSummary['peakRSSMB'] is not None]
+        cacheL = [rankSummary['communityCache'] for rankSummary in rankL
+                  if rankSummary['communityCache'] is not None]
+        startDayL = [rankSummary['scenarioStartDaySeconds'] for rankSummary in rankL
+                     if rankSummary['scenarioStartDaySeconds'] is not None]
+        d = {'seed': baseSeed,
+             'ranks': comm.size,
+             'failed': runFailed,
+             'days': nDays,
+             'agentDays': agentDays,
+             'phases': phaseD,
+             'secondsPerDay': (loopSec / nDays) if nDays else None,
+             'agentDaysPerSecond': (agentDays / loopSec) if loopSec else None,
+             'peakRSSMB': max(rssL) if rssL else None,
+             'communityCacheMisses': (sum([c['misses'] for c in cacheL]) if cacheL
+                                      else None),
+             'scenarioStartDay': summary['scenarioStartDay'],
+             'scenarioStartDaySeconds': max(startDayL) if startDayL else None,
+             'perRank': rankL}
+        with open(fileName, 'w') as f:
+            json.dump(d, f, indent=2, sort_keys=True)
+    else:
+        comm.send(summary, dest=0)
+
+
 class TweakedOptParser(optparse.OptionParser):
     def setComm(self, comm):
         self.comm = comm
@@ -591,29 +787,13 @@ class RankLoggingFilter(logging.Filter):
         return True
 
 
-class PikaLogHandler(logging.Handler):
-
-    class Producer(object):
-        def __init__(self):
-            conn = pika.BlockingConnection(pika.ConnectionParameters(host='localhost'))
-            self.ch = conn.channel()
-            self.ch.queue_declare(queue='pyrhea_logger')
-
-        def message(self, message):
-            self.ch.basic_publish(exchange='', routing_key='pyrhea_logger',
-                                  body=pickle.dumps(message))
-
-    def __init__(self):
-        logging.Handler.__init__(self)
-        self.broadcaster = PikaLogHandler.Producer()
-        self.machine = os.uname()[1]
-
-    def emit(self, record):
-        message = {'source': 'logger', 'machine': self.machine,
-                   'message': self.format(record), 'level': record.levelname,
-                   'pathname': record.pathname, 'lineno': record.lineno,
-                   'exception': record.exc_info, 'rank': record.rank}
-        self.broadcaster.message(message)
+class PikaLogHandler(BatchingLogHandler):
+    """
+    Ships log records to a RabbitMQ listener in batches from a background thread.
+    Use remotelog.BatchingLogHandler directly to select a different transport.
+    """
+    def __init__(self, **kwargs):
+        BatchingLogHandler.__init__(self, transport='pika', **kwargs)
 
 
 class BurnInAgent(patches.Agent):
@@ -682,12 +862,60 @@ def createFacImplMap(facImplDict, facImplRules):
     return myMap
 
 
+def estimateFacilityLoad(facDescription, loadDict=None):
+    """
+    Estimate the work a facility adds to its patch.  A cost taken from a previous run
+    (loadDict[abbrev]) is preferred, then the mean population, then the bed count.
+    """
+    abbrev = facDescription['abbrev']
+    if loadDict and abbrev in loadDict:
+        return float(loadDict[abbrev])
+    elif 'meanPop' in facDescription:
+        return float(facDescription['meanPop']['value'])
+    elif 'nBeds' in facDescription:
+        return float(facDescription['nBeds']['value'])
+    else:
+        return 1.0
+
+
+def assignFacilitiesToPatches(facList, nPatches, loadDict=None):
+    """
+    Greedy longest-processing-time assignment: facilities are taken in order of
+    decreasing estimated load and each goes to the patch with the least load so far.
+    Returns a list of patch indices parallel to facList and the list of patch loads.
+    """
+    loadL = [estimateFacilityLoad(facDescr, loadDict) for facDescr in facList]
+    order = sorted(xrange(len(facList)), key=lambda i: (-loadL[i], facList[i]['abbrev']))
+    heap = [(0.0, patchIdx) for patchIdx in xrange(nPatches)]
+    patchLoads = [0.0] * nPatches
+    assignments = [None] * len(facList)
+    for i in order:
+        patchLoad, patchIdx = heapq.heappop(heap)
+        assignments[i] = patchIdx
+        patchLoads[patchIdx] = patchLoad + loadL[i]
+        heapq.heappush(heap, (patchLoads[patchIdx], patchIdx))
+    return assignments, patchLoads
+
+
+def readFacilityLoads(fname):
+    """
+    The file is yaml containing a dict 'load' mapping facility abbrev to relative cost,
+    for example measured in a previous run.
+    """
+    with open(fname, 'rU') as f:
+        parentDict = yaml.safe_load(f)
+    if not isinstance(parentDict, dict) or 'load' not in parentDict:
+        raise RuntimeError('Facility load file %s has no load dict' % fname)
+    return parentDict['load']
+
+
 def initializeFacilities(patchList, myFacList, facImplDict, facImplRules,
                          policyClassList, policyRulesDict,
-                         PthClass, noteHolderGroup, comm, totalRunDays):
+                         PthClass, noteHolderGroup, comm, totalRunDays, loadDict=None):
     """Distribute facilities across patches and initialize them"""
-    offset = 0
     tupleList = [(p, [], [], []) for p in patchList]
+    patchAssignments, patchLoads = assignFacilitiesToPatches(myFacList, len(tupleList),
+                                                             loadDict)
 
     # Every patch gets one Registry instance
     for patch, allIter, allAgents, allFacilities in tupleList:
@@ -697,9 +925,9 @@ def initializeFacilities(patchList, myFacList, facImplDict, facImplRules,
         allIter.append(registry.holdQueue)
         allAgents.append(registry.manager)
 
-    for facDescription in myFacList:
+    for facDescription, patchIdx in zip(myFacList, patchAssignments):
 
-        patch, allIter, allAgents, allFacilities = tupleList[offset]
+        patch, allIter, allAgents, allFacilities = tupleList[patchIdx]
         facImplCategory = findFacImplCategory(facImplDict, facImplRules,
                                               facDescription['category'])
         if facImplCategory:
@@ -733,14 +961,15 @@ def initializeFacilities(patchList, myFacList, facImplDict, facImplRules,
         else:
             raise RuntimeError('Facility %(abbrev)s category %(category)s has no implementation' %
                                facDescription)
-        offset = (offset + 1) % len(tupleList)
 
-    for patch, allIter, allAgents, allFacilities in tupleList:
+    for (patch, allIter, allAgents, allFacilities), patchLoad in zip(tupleList, patchLoads):
         patch.addInteractants(allIter)
         patch.addAgents(allAgents)
         patch.allFacilities = allFacilities
-        LOGGER.info('Rank %d patch %s: %d interactants, %d agents, %d facilities' %
-                    (comm.rank, patch.name, len(allIter), len(allAgents), len(allFacilities)))
+        patch.facilityByAbbrev = {fac.abbrev: fac for fac in allFacilities}
+        LOGGER.info('Rank %d patch %s: %d interactants, %d agents, %d facilities, load %.1f' %
+                    (comm.rank, patch.name, len(allIter), len(allAgents), len(allFacilities),
+                     patchLoad))
         patchNH = noteHolderGroup.createNoteHolder()
         patch.loop.addPerDayCallback(createPerDayCB(patch, patchNH, totalRunDays,
                                                     recGenDict=PER_DAY_NOTES_GEN_DICT))
@@ -750,6 +979,27 @@ def initializeFacilities(patchList, myFacList, facImplDict, facImplRules,
         patchNH.addNote(initialNote)
 
 
+def enableGlobalPopulationFeedback(patch, facImplDict, noteHolderGroup, comm, totalRunDays):
+    """
+    Every rank calls the hook of each facility implementation which supports global
+    population feedback, whether or not the rank holds any of its facilities.  Only
+    rank 0 records the (identical) filter state in the notes.
+    """
+    implList = []
+    for facImpl in facImplDict.values():
+        if hasattr(facImpl, 'enableGlobalPopulationFeedback') and facImpl not in implList:
+            implList.append(facImpl)
+    if not implList:
+        raise RuntimeError('No facility implementation supports global population feedback')
+    for facImpl in implList:
+        if comm.rank == 0:
+            noteHolder = noteHolderGroup.createNoteHolder()
+            noteHolder.addNote({'name': '%s_population_feedback' % facImpl.category})
+        else:
+            noteHolder = None
+        facImpl.enableGlobalPopulationFeedback(patch, comm, noteHolder, totalRunDays)
+
+
 def main():
 
     # Thanks to http://stackoverflow.com/questions/25308847/attaching-a-process-with-pdb for this
@@ -761,6 +1011,8 @@ def main():
     global LOGGER
     global CL_DATA
 
+    runTimer = RunTimer()
+
     if os.name != "nt":
         signal.signal(signal.SIGUSR1, handle_pdb)
 
@@ -769,7 +1021,7 @@ def main():
 
     if comm.rank == 0:
         parser = TweakedOptParser(usage="""
-        %prog [-v][-d][-t][-D][-p=npatch][-C][-L=loglevel][-P=partitionfile.yaml][--seed SEED] input.yaml
+        %prog [-v][-d][-t][-D][-p=npatch][-C][-L=loglevel][-P=partitionfile.yaml][--seed SEED][--replicates N] input.yaml
         """)
         parser.setComm(comm)
         parser.add_option("-v", "--verbose", action="store_true",
@@ -794,6 +1046,9 @@ def main():
         parser.add_option("-P", "--partition", action="store", type="string",
                           help=("yaml file defining the partition of locations to ranks"
                                 " (no default)"))
+        parser.add_option("--facilityLoads", action="store", type="string", default=None,
+                          help=("yaml file with a dict 'load' giving the relative cost of each"
+                                " facility, used to balance facilities across patches"))
         parser.add_option("--seed", action="store", type="int",
                           help="Use this value as the random seed")
         parser.add_option("-k", "--checkpoint", action="store", type="int", default=-1,
@@ -804,12 +1059,28 @@ def main():
                           help="save any modified constants files (from -c) to the specified directory")
         parser.add_option("-b", "--bczmonitor", action="store", type="string", default=None,
                           help="save pathogen status as a pandas data structure in the file specified")
+        parser.add_option("--bczBlockRows", action="store", type="int", default=None,
+                          help="buffer this many bczmonitor rows between appends")
+        parser.add_option("--bczThread", action="store_true", default=False,
+                          help="append bczmonitor blocks from a background thread")
         parser.add_option("--taumod", action="store_true", default=False,
                           help="run pyrhea in the taumod mode")
+        parser.add_option("--globalKalman", action="store_true", default=False,
+                          help=("combine community population sums across ranks once per"
+                                " day, so all ranks apply the same population feedback"))
         parser.add_option("-n", "--disableNotes", action="store_true",
                           help="disable noteholder functions to save memory (a minimal notes file will still be written)")
+        parser.add_option("--shardNotes", action="store_true", default=False,
+                          help=("each rank writes its own notes file at the end of the run;"
+                                " the notes file itself becomes a manifest of these"))
         parser.add_option("-m", "--dumpFacilitiesMap", action="store", type="string", default=None,
                           help="write a facililties map to the file specified to facilitate post processing")
+        parser.add_option("--replicates", action="store", type="int", default=1,
+                          help=("initialize once, then fork this many independently seeded"
+                                " runs (single rank only)"))
+        parser.add_option("--timings", action="store", type="string", default=None,
+                          help=("write the time taken by each phase of the run, peak memory"
+                                " and agent-day throughput to this json file"))
 
         opts, args = parser.parse_args()
         if opts.log is not None:
@@ -820,6 +1091,18 @@ def main():
             numLogLevel = None
         if opts.partition is None and comm.size > 1:
             parser.error('A partition file is required for parallel runs')
+        if opts.replicates < 1:
+            parser.error('The number of replicates must be at least 1')
+        if opts.replicates > 1 and (comm.size > 1 or os.name == 'nt'):
+            parser.error('Multiple replicates require a single rank on a system with fork()')
+        if opts.bczBlockRows is not None and opts.bczBlockRows < 1:
+            parser.error('The bczmonitor block size must be at least 1 row')
+        facilityLoads = None
+        if opts.facilityLoads is not None:
+            try:
+                facilityLoads = readFacilityLoads(opts.facilityLoads)
+            except (IOError, RuntimeError) as e:
+                parser.error('Cannot read facility loads: %s' % e)
         CL_DATA = {'verbose': opts.verbose,
                    'debug': opts.debug,
                    'trace': opts.trace,
@@ -829,14 +1112,21 @@ def main():
                    'logCfgDict': getLoggerConfig(),
                    'loggingExtra': numLogLevel,
                    'partitionFile': opts.partition,
+                   'facilityLoads': facilityLoads,
                    'randomSeed': opts.seed,
                    'checkpoint': opts.checkpoint,
                    'constantsFile': opts.constantsFile,
                    'saveNewConstants': opts.saveNewConstants,
                    'bczmonitor': opts.bczmonitor,
+                   'bczBlockRows': opts.bczBlockRows,
+                   'bczThread': opts.bczThread,
                    'taumod': opts.taumod,
+                   'globalKalman': opts.globalKalman,
                    'dumpFacilitiesMap': opts.dumpFacilitiesMap,
                    'disableNotes' : opts.disableNotes,
+                   'shardNotes': opts.shardNotes,
+                   'replicates': opts.replicates,
+                   'timings': opts.timings,
         }
         if len(args) == 1:
             CL_DATA['input'] = checkInputFileSchema(args[0],
@@ -880,11 +1170,19 @@ def main():
         inputDict = CL_DATA['input']
 
         if deterministic:
-            seed(1234 + comm.rank)  # Set the random number generator seed
+            baseSeed = 1234
         elif CL_DATA['randomSeed']:
-            seed(CL_DATA['randomSeed'] + comm.rank)
+            baseSeed = CL_DATA['randomSeed']
         elif 'randomSeed' in inputDict:
-            seed(inputDict['randomSeed'] + comm.rank)
+            baseSeed = inputDict['randomSeed']
+        else:
+            baseSeed = None
+        if baseSeed is not None:
+            seed(baseSeed + comm.rank)  # Set the random number generator seed
+        # Per-facility streams are derived from the seed alone, not the rank, so that
+        # results do not depend on how facilities are partitioned
+        pyrheautils.setRandomStreamSeed(baseSeed)
+        replicateIdx = None
 
         if 'trackedFacilities' in inputDict:
             global _TRACKED_FACILITIES
@@ -955,6 +1253,7 @@ def main():
                                      inputDict['burnInDays'] + inputDict['scenarioWaitDays'],
                                      scenarioPolicies)
             patchList[0].addAgents([ssA])
+            runTimer.scenarioStartDay = inputDict['burnInDays'] + inputDict['scenarioWaitDays']
 
         # Check that constants replacements happened as expected
         pyrheautils.checkReplacementsWereUsed()
@@ -962,18 +1261,50 @@ def main():
             logging.shutdown()
             sys.exit('shutting down after saving new constants')
 
+        runTimer.mark('startup')
         initializeFacilities(patchList, myFacList, facImplDict, facImplRules,
                              policyClassList, policyRulesDict,
-                             PthClass, noteHolderGroup, comm, totalRunDays)
+                             PthClass, noteHolderGroup, comm, totalRunDays,
+                             loadDict=CL_DATA['facilityLoads'])
+        if CL_DATA['globalKalman']:
+            enableGlobalPopulationFeedback(patchList[0], facImplDict, noteHolderGroup, comm,
+                                           totalRunDays)
+        cacheStats = pyrheautils.getConstantsCacheStats()
+        LOGGER.info('Rank %d constants cache: %d hits, %d misses, %.2f seconds saved',
+                    comm.rank, cacheStats['hits'], cacheStats['misses'],
+                    cacheStats['secondsSaved'])
 
         if CL_DATA['disableNotes']:
             noteHolderGroup.disableAll()
-            
+
+        # Check that all policy rules have been used, to avoid a common user typo problem
+        quitNow = False
+        for ruleKey, usedFlag in policyRulesDict.items():
+            if not usedFlag:
+                LOGGER.error('The policy rule associating %s with %s was never used- typo?',
+                             ruleKey[2], ruleKey[3])
+                quitNow = True
+        if quitNow:
+            raise RuntimeError('Probable typos found in the policy section of the input file')
+
+        if CL_DATA['replicates'] > 1:
+            # Everything up to this point is shared copy-on-write by the replicates
+            replicateIdx = forkReplicates(CL_DATA['replicates'], baseSeed)
+            LOGGER.info('Replicate %d of %d is starting', replicateIdx, CL_DATA['replicates'])
+            if CL_DATA['bczmonitor'] is not None:
+                CL_DATA['bczmonitor'] = replicateFileName(CL_DATA['bczmonitor'], replicateIdx)
+            if CL_DATA['timings'] is not None:
+                CL_DATA['timings'] = replicateFileName(CL_DATA['timings'], replicateIdx)
+            if comm.rank == 0:
+                outputNotesName = replicateFileName(outputNotesName, replicateIdx)
+
         monitorList = []
         tauAdjusterList = []
         if CL_DATA['bczmonitor'] is not None:
             for patch in patchList:
-                m = bcz_monitor.Monitor(CL_DATA['bczmonitor'], patch)
+                m = bcz_monitor.Monitor(CL_DATA['bczmonitor'], patch,
+                                        blockRows=CL_DATA['bczBlockRows'],
+                                        threaded=CL_DATA['bczThread'])
                 monitorList.append(m)
                 patch.loop.addPerDayCallback(m.createDailyCallbackFn())
                 if 'trackedValues' in inputDict:
@@ -986,19 +1317,14 @@ def main():
                     tauAdjusterList.append(ta)
                     m.setStopTimeFn(1, ta.createCallbackFn())
 
-        if CL_DATA['dumpFacilitiesMap'] is not None:
+        if CL_DATA['dumpFacilitiesMap'] is not None and not replicateIdx:
+            # the facilities map is the same for every replicate, so only one writes it
             dumpFacilitiesMap(CL_DATA['dumpFacilitiesMap'], patchList)
 
-        # Check that all policy rules have been used, to avoid a common user typo problem
-        quitNow = False
-        for ruleKey, usedFlag in policyRulesDict.items():
-            if not usedFlag:
-                LOGGER.error('The policy rule associating %s with %s was never used- typo?',
-                             ruleKey[2], ruleKey[3])
-                quitNow = True
-        if quitNow:
-            raise RuntimeError('Probable typos found in the policy section of the input file')
-
+        if CL_DATA['timings'] is not None:
+            for patch in patchList:
+                patch.loop.addPerDayCallback(runTimer.createPerDayCB(patch))
+        runTimer.mark('initialization')
 
     except Exception as e:
         if patchGroup:
@@ -1033,11 +1359,18 @@ def main():
         traceback.print_exc(file=sys.stderr)
         runFailed = True
     finally:
+        runTimer.mark('dailyLoop')
         try:
             LOGGER.info('%s writing notes and exiting' % patchGroup.name)
-    
-            allNotesGroup, allNotesList = collectNotes(noteHolderGroup, comm)  # @UnusedVariable
-            if comm.rank == 0:
+
+            if CL_DATA['shardNotes']:
+                writeNotesShard(noteHolderGroup, comm,
+                                (outputNotesName if comm.rank == 0
+                                 else CL_DATA['outputNotesName']),
+                                runFailed)
+            else:
+                allNotesGroup, allNotesList = collectNotes(noteHolderGroup, comm)  # @UnusedVariable
+            if comm.rank == 0 and not CL_DATA['shardNotes']:
                 d = {}
                 for nh in allNotesGroup.getnotes():
                     d[nh['name']] = nh.getDict()
@@ -1049,26 +1382,71 @@ def main():
                     # edit output file name to show failure
                     baseNm, extNm = os.path.splitext(outputNotesName)
                     outputNotesName = baseNm + '_FAILED' + extNm
-                if outputNotesName.lower().endswith('.json'):
-                    with open(outputNotesName, 'w') as f:
-                        f.write('{\n')
-                        for k,v in d.items():
-                            f.write('"{0}":{1},\n'.format(k,ujson.dumps(v)))
-                        f.write("}\n")
-                else:
-                    with open(outputNotesName, 'w') as f:
-                        pickle.dump(d, f)
+                noteshards.writeNotes(outputNotesName, d)
 
-                if CL_DATA['bczmonitor'] is not None:
-                    for m in monitorList:
-                        m.writeData()
+            # Monitors buffer rows, so every rank must flush its own
+            for m in monitorList:
+                m.writeData()
 
         except Exception as e:
             LOGGER.error('%s an exception occurred while writing notes: %s'
                          % (patchGroup.name, e))
+        runTimer.mark('notesWriting')
+
+        if CL_DATA['timings'] is not None:
+            try:
+                writeTimings(runTimer, comm, CL_DATA['timings'], baseSeed, runFailed)
+            except Exception as e:
+                LOGGER.error('%s an exception occurred while writing timings: %s'
+                             % (patchGroup.name, e))
 
     logging.shutdown()
 
+
+class TestFacilityLoads(unittest.TestCase):
+    def setUp(self):
+        self.facList = [{'abbrev': 'POP', 'meanPop': {'value': 30.0, 'prov': 'test'},
+                         'nBeds': {'value': 100, 'prov': 'test'}},
+                        {'abbrev': 'BEDS', 'nBeds': {'value': 20, 'prov': 'test'}},
+                        {'abbrev': 'NONE'}]
+        self.tmpDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+    def test_estimates(self):
+        self.assertEqual([estimateFacilityLoad(fD) for fD in self.facList],
+                         [30.0, 20.0, 1.0])
+
+    def test_load_file(self):
+        fname = os.path.join(self.tmpDir, 'loads.yaml')
+        with open(fname, 'w') as f:
+            yaml.safe_dump({'load': {'BEDS': 50, 'NONE': 5.5}}, f)
+        loadDict = readFacilityLoads(fname)
+        self.assertEqual([estimateFacilityLoad(fD, loadDict) for fD in self.facList],
+                         [30.0, 50.0, 5.5])
+        assignments, patchLoads = assignFacilitiesToPatches(self.facList, 2, loadDict)
+        self.assertEqual(assignments, [1, 0, 1])
+        self.assertEqual(patchLoads, [50.0, 35.5])
+
+    def test_bad_load_file(self):
+        fname = os.path.join(self.tmpDir, 'loads.yaml')
+        with open(fname, 'w') as f:
+            yaml.safe_dump({'notLoad': {}}, f)
+        self.assertRaises(RuntimeError, readFacilityLoads, fname)
+
+
+class TestRunTimer(unittest.TestCase):
+    def test_scenario_start_day(self):
+        runTimer = RunTimer()
+        runTimer.dayEndD = {3: 10.0, 4: 11.0, 5: 14.5, 6: 15.0}
+        self.assertIsNone(runTimer.getScenarioStartDaySeconds())
+        runTimer.scenarioStartDay = 4
+        self.assertAlmostEqual(runTimer.getScenarioStartDaySeconds(), 3.5)
+        self.assertAlmostEqual(runTimer.getRankSummary()['scenarioStartDaySeconds'], 3.5)
+        runTimer.scenarioStartDay = 6  # the run ended first
+        self.assertIsNone(runTimer.getScenarioStartDaySeconds())
+
 ############
 # Main hook
 ############
@@ -20,7 +20,13 @@ import sys
 import os
 import os.path
 import logging
+import random
+import hashlib
+import time
+import errno
+import cPickle as pickle
 from imp import load_source
+import numpy as np
 import yaml
 import phacsl.utils.formats.yaml_tools as yaml_tools
 from collections import defaultdict
@@ -54,6 +60,7 @@ def prepPathTranslations(inp, homeDir=None):
                            ('MODELDIR', '$(BASEDIR)/models/$(MODEL)'),
                            ('CONSTANTS', '$(MODELDIR)/constants'),
                            ('COMMUNITYCACHEDIR', '$(SIMDIR)/cache/$(MODEL)'),
+                           ('CONSTANTSCACHEDIR', '$(SIMDIR)/cache/constants'),
                            ('AGENTDIR', '$(SIMDIR)/agents/$(MODEL)'),
                            ]
 
@@ -95,6 +102,83 @@ facilitiesReplacementData = {}
 outputNotesName = ""
 saveNewConstants = None
 
+_randomStreamMasterSeed = None
+_randomStreamDict = {}
+_npRandomStreamDict = {}
+
+def _deriveStreamSeed(keyTpl):
+    """
+    Hash the master seed and the stream key down to a 64-bit seed.  The result depends
+    only on those values, so it does not change with rank count or facility partitioning.
+    """
+    global _randomStreamMasterSeed
+    if _randomStreamMasterSeed is None:
+        _randomStreamMasterSeed = random.getrandbits(64)
+    digest = hashlib.sha1(repr((_randomStreamMasterSeed,) + tuple(keyTpl))).hexdigest()
+    return int(digest[:16], 16)
+
+def setRandomStreamSeed(masterSeed):
+    """
+    Set the master seed from which all named random streams are derived.  If masterSeed
+    is None a seed is drawn from system entropy.  Streams which already exist are
+    reseeded in place, so holders of those streams need not fetch them again.
+    """
+    global _randomStreamMasterSeed
+    if masterSeed is None:
+        masterSeed = random.SystemRandom().getrandbits(64)
+    _randomStreamMasterSeed = masterSeed
+    for keyTpl, rng in _randomStreamDict.items():
+        rng.seed(_deriveStreamSeed(keyTpl))
+    for keyTpl, rng in _npRandomStreamDict.items():
+        rng.seed(_deriveStreamSeed(keyTpl + ('numpy',)) % (2 ** 32))
+
+def getRandomStream(*keys):
+    """
+    Return the random.Random instance associated with the given key tuple, for example
+    getRandomStream('facility', abbrev).  The same keys always give the same stream.
+    """
+    if keys not in _randomStreamDict:
+        _randomStreamDict[keys] = random.Random(_deriveStreamSeed(keys))
+    return _randomStreamDict[keys]
+
+def getNumpyRandomStream(*keys):
+    """
+    As getRandomStream, but returns a numpy RandomState suitable for use as the
+    random_state of scipy.stats draws.
+    """
+    if keys not in _npRandomStreamDict:
+        seed = _deriveStreamSeed(keys + ('numpy',)) % (2 ** 32)
+        _npRandomStreamDict[keys] = np.random.RandomState(seed)
+    return _npRandomStreamDict[keys]
+
+PATIENT_ID_COUNTER_BITS = 32
+_patientIdPrefixNames = {}
+
+def patientIdPrefix(abbrev):
+    """
+    Patient ids are 64-bit integers made from a 31-bit code for the facility at which
+    the patient was created and a 32-bit counter.  The code is a hash of the abbrev,
+    so like the random streams it does not depend on rank count or partitioning, and
+    the ids of freeze-dried patients in the community cache stay valid between runs.
+    """
+    prefix = int(hashlib.sha1(str(abbrev)).hexdigest()[:8], 16) & 0x7fffffff
+    if _patientIdPrefixNames.setdefault(prefix, abbrev) != abbrev:
+        raise RuntimeError('Facilities %s and %s hash to the same patient id prefix'
+                           % (_patientIdPrefixNames[prefix], abbrev))
+    return prefix
+
+def makePatientId(prefix, counter):
+    if counter >> PATIENT_ID_COUNTER_BITS:
+        raise RuntimeError('Patient id counter overflow for %s'
+                           % _patientIdPrefixNames.get(prefix, prefix))
+    return (prefix << PATIENT_ID_COUNTER_BITS) | counter
+
+def describePatientId(patientId):
+    """Readable name for a patient id, for example 'ABBR_123', for debugging output"""
+    prefix = patientId >> PATIENT_ID_COUNTER_BITS
+    counter = patientId & ((1 << PATIENT_ID_COUNTER_BITS) - 1)
+    return '%s_%d' % (_patientIdPrefixNames.get(prefix, '%08x' % prefix), counter)
+
 def readConstantsReplacementFile(fileName):
     global constantsReplacementData
     global facilitiesReplacementData
@@ -170,32 +254,142 @@ def replaceYamlData(replacementData, yData):
 
     return yData
 
+constantsCacheEnabled = True
+_constantsMemCache = {}
+_constantsCacheStats = {'hits': 0, 'misses': 0, 'secondsSaved': 0.0}
+
+def getConstantsCacheStats():
+    """
+    Returns a dict giving the number of constants cache hits and misses and the estimated
+    number of seconds of parsing and validation saved by the hits.
+    """
+    return _constantsCacheStats.copy()
+
+def _getReplacements(valuePath):
+    """
+    Returns (trFileName, replacements) for the given constants file, where replacements
+    is None if constantsReplacementData has no entry for it.
+    """
+    trFileName = os.path.abspath(pathTranslate(valuePath))
+    for fn, repl in constantsReplacementData.items():
+        if os.path.abspath(pathTranslate(fn)) == trFileName:
+            return trFileName, repl
+    return trFileName, None
+
+def _constantsCacheKey(valueText, valuePath, schemaPath, pathLookupDict):
+    """
+    The key is a hash of the value file contents, the schema file contents, and any
+    replacement data for the value file.  Files the schema pulls in by $ref are not
+    part of the key.  Returns None if the schema is not a local file.
+    """
+    schemaFile = schemautils.getSchemaPath(pathTranslate(schemaPath, pathLookupDict))
+    if schemaFile is None:
+        return None
+    hasher = hashlib.sha1()
+    hasher.update(valueText)
+    with open(schemaFile, 'rU') as f:
+        hasher.update(f.read())
+    hasher.update(repr(_getReplacements(valuePath)[1]))
+    return hasher.hexdigest()
+
+def _getConstantsCachePath(cacheKey):
+    cacheDir = pathTranslate('$(CONSTANTSCACHEDIR)')
+    if '$(' in cacheDir:
+        return None  # path translations have not been set up
+    return os.path.join(cacheDir, '%s.pkl' % cacheKey)
+
+def _readConstantsCache(cacheKey):
+    """
+    Returns the pickled (buildSeconds, cJSON) string for the key, or None on a miss.
+    """
+    if cacheKey in _constantsMemCache:
+        return _constantsMemCache[cacheKey]
+    cachePath = _getConstantsCachePath(cacheKey)
+    if cachePath is None or not os.path.exists(cachePath):
+        return None
+    try:
+        with open(cachePath, 'rb') as f:
+            entry = f.read()
+    except IOError, e:
+        logger.warning('Cannot read constants cache file %s: %s', cachePath, e)
+        return None
+    _constantsMemCache[cacheKey] = entry
+    return entry
+
+def _writeConstantsCache(cacheKey, buildSeconds, cJSON):
+    entry = pickle.dumps((buildSeconds, cJSON), 2)
+    _constantsMemCache[cacheKey] = entry
+    cachePath = _getConstantsCachePath(cacheKey)
+    if cachePath is None:
+        return
+    # Several ranks may write the same entry at once, so write privately and rename
+    tmpPath = '%s.%d.tmp' % (cachePath, os.getpid())
+    try:
+        try:
+            os.makedirs(os.path.dirname(cachePath))
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        with open(tmpPath, 'wb') as f:
+            f.write(entry)
+        os.rename(tmpPath, cachePath)
+    except (IOError, OSError), e:
+        logger.warning('Cannot write constants cache file %s: %s', cachePath, e)
+
 def importConstants(valuePath, schemaPath, pathLookupDict=None):
     """
     Import a set of constants in YAML format, checking against its schema.
+
+    Validated results are cached in memory and in $(CONSTANTSCACHEDIR), so a
+    later import of unchanged constants skips parsing and validation.
     """
     print(valuePath)
+    startTime = time.time()
     with open(pathTranslate(valuePath, pathLookupDict), 'rU') as f:
-        cJSON = yaml.safe_load(f)
-        cJSON = replaceData(valuePath, cJSON)
-        if os.name != 'nt':
-            validator = schemautils.getValidator(pathTranslate(schemaPath, pathLookupDict))
+        valueText = f.read()
+    cacheKey = None
+    if constantsCacheEnabled and saveNewConstants is None:
+        cacheKey = _constantsCacheKey(valueText, valuePath, schemaPath, pathLookupDict)
+    if cacheKey is not None:
+        entry = _readConstantsCache(cacheKey)
+        if entry is not None:
             try:
-                nErrors = 0
-                for e in validator.iter_errors(cJSON):
-                    logger.error('Schema violation: %s: %s',
-                                 ' '.join([str(word) for word in e.path]), e.message)
-                    nErrors += 1
-                if nErrors:
-                    raise RuntimeError('%s does not satisfy the schema %s' %
-                                       (valuePath, schemaPath))
-            except AttributeError:
-                logger.error('An error occurred validating %s against schema %s',
-                             pathTranslate(valuePath, pathLookupDict),
-                             pathTranslate(schemaPath, pathLookupDict))
-                raise RuntimeError(('An error occurred validating %s against schema %s'
-                                    % (pathTranslate(valuePath, pathLookupDict),
-                                       pathTranslate(schemaPath, pathLookupDict))))
+                buildSeconds, cJSON = pickle.loads(entry)
+            except (pickle.UnpicklingError, EOFError, ValueError), e:
+                logger.warning('Ignoring bad constants cache entry for %s: %s', valuePath, e)
+                _constantsMemCache.pop(cacheKey, None)
+            else:
+                trFileName, repl = _getReplacements(valuePath)
+                if repl is not None:
+                    usedSet.add(trFileName)
+                savedSeconds = buildSeconds - (time.time() - startTime)
+                _constantsCacheStats['hits'] += 1
+                _constantsCacheStats['secondsSaved'] += max(savedSeconds, 0.0)
+                return cJSON
+        _constantsCacheStats['misses'] += 1
+
+    cJSON = yaml.safe_load(valueText)
+    cJSON = replaceData(valuePath, cJSON)
+    if os.name != 'nt':
+        validator = schemautils.getValidator(pathTranslate(schemaPath, pathLookupDict))
+        try:
+            nErrors = 0
+            for e in validator.iter_errors(cJSON):
+                logger.error('Schema violation: %s: %s',
+                             ' '.join([str(word) for word in e.path]), e.message)
+                nErrors += 1
+            if nErrors:
+                raise RuntimeError('%s does not satisfy the schema %s' %
+                                   (valuePath, schemaPath))
+        except AttributeError:
+            logger.error('An error occurred validating %s against schema %s',
+                         pathTranslate(valuePath, pathLookupDict),
+                         pathTranslate(schemaPath, pathLookupDict))
+            raise RuntimeError(('An error occurred validating %s against schema %s'
+                                % (pathTranslate(valuePath, pathLookupDict),
+                                   pathTranslate(schemaPath, pathLookupDict))))
+    if cacheKey is not None:
+        _writeConstantsCache(cacheKey, time.time() - startTime, cJSON)
     return cJSON
 
 
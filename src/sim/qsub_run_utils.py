@@ -4,6 +4,7 @@ import os.path
 import yaml
 import pickle
 import time
+import shlex
 
 from socket import gethostname
 from getpass import getuser
@@ -11,6 +12,13 @@ from getpass import getuser
 
 
 def getDefaultPyrheaDir():
+    """
+    The top of the pyrhea tree.  The PYRHEA_DIR environment variable takes precedence;
+    otherwise this is the tree containing this file.
+    """
+    if 'PYRHEA_DIR' in os.environ:
+        return os.environ['PYRHEA_DIR']
+
     host = gethostname()
     user = getuser()
 
@@ -19,10 +27,17 @@ def getDefaultPyrheaDir():
     if user == 'jleonard':
         return "/home/jleonard/pyrhea/pyrhea/"
 
-    raise RuntimeError("Can't determine pyrhea directory")
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, os.pardir))
 
 
 def getDefaultRunsDir():
+    """
+    The directory holding the run directories.  The PYRHEA_RUNS_DIR environment variable
+    takes precedence.
+    """
+    if 'PYRHEA_RUNS_DIR' in os.environ:
+        return os.environ['PYRHEA_RUNS_DIR']
+
     host = gethostname()
     user = getuser()
 
@@ -78,7 +93,7 @@ def yamlReplaceFile(base, out, repl):
     for path, val in repl:
         pointer = yData
         idx = 0
-        while idx < len(path) - 2:
+        while idx < len(path) - 1:
             step = path[idx]
             if step == '#KeyVal':
                 keyKey = path[idx+1]
@@ -142,9 +157,20 @@ class RunEnvironment:
         self.setDirectories()
         self.buildRunEnvironment()
 
+    def getNotesFile(self):
+        return os.path.join(self.runDir, "notes_%03d.pkl"%self.instNum)
+
+    def getPyrheaArgs(self):
+        """
+        The arguments to pyrhea.py for this run, as a list.  The run starts in src/sim.
+        """
+        seed = self.expNum * 1000 + self.instNum
+        return (['pyrhea.py', '-o', self.getNotesFile()] + shlex.split(self.pyrheaOpts)
+                + ['--seed', str(seed), self.confFile])
+
     def runSim(self, reallyRun=True):
         print 'Starting runSim'
-        notesFile = os.path.join(self.runDir, "notes_%03d.pkl"%self.instNum)
+        notesFile = self.getNotesFile()
         if os.path.isfile(notesFile):
             try:
                 with open(notesFile) as f:
@@ -152,9 +178,8 @@ class RunEnvironment:
                 return
             except:
                 pass
-        seed = self.expNum * 1000 + self.instNum
 
-        runStr = "%s python pyrhea.py -o %s %s --seed %s %s"%(self.pyrheaPrefix, notesFile, self.pyrheaOpts, seed, self.confFile)
+        runStr = "%s python %s"%(self.pyrheaPrefix, ' '.join(self.getPyrheaArgs()))
         print runStr
         if reallyRun:
             os.system(runStr)
@@ -212,7 +237,7 @@ class RunEnvironment:
             yamlReplaceFile(self.baseConfFile, self.confFile, baseConfReplace)
 
             if self.finalEditsFn is not None:
-                self.finalEditsFn(expNum, runDir, constantsDir)
+                self.finalEditsFn(self.expNum, runDir, constantsDir)
             
             # tell any others waiting that we've built the directory
             with open(builtFile, "w") as f:
@@ -22,6 +22,7 @@ from collections import defaultdict
 from phacsl.utils.collections.phacollections import SingletonMetaClass
 import quilt.peopleplaces as peopleplaces
 from pathogenbase import PthStatus
+import pyrheautils
 
 logger = logging.getLogger(__name__)
 
@@ -152,6 +153,7 @@ class Registry(peopleplaces.ManagementBase):
                           if patch.isLocal(tpl[1])])
         payload = cls.buildMsgPayload(RegistryUpdateMsg, patientId, condition,
                                       patientDiagnosis)
-        patch.launch(RegistryUpdateMsg('patient_%s_%s_registryUpdateMsg' % patientId,
+        patch.launch(RegistryUpdateMsg('patient_%s_registryUpdateMsg'
+                                       % pyrheautils.describePatientId(patientId),
                                        patch, payload, facAddr),
                      patch.loop.sequencer.getTimeNow())
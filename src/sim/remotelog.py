@@ -0,0 +1,325 @@
+#! /usr/bin/env python
+
+###################################################################################
+# Copyright   2018, Pittsburgh Supercomputing Center (PSC).  All Rights Reserved. #
+# =============================================================================== #
+#                                                                                 #
+# Permission to use, copy, and modify this software and its documentation without #
+# fee for personal use within your organization is hereby granted, provided that  #
+# the above copyright notice is preserved in all copies and that the copyright    #
+# and this permission notice appear in supporting documentation.  All other       #
+# restrictions and obligations are defined in the GNU Affero General Public       #
+# License v3 (AGPL-3.0) located at http://www.gnu.org/licenses/agpl-3.0.html  A   #
+# copy of the license is also provided in the top level of the source directory,  #
+# in the file LICENSE.txt.                                                        #
+#                                                                                 #
+###################################################################################
+
+"""
+Logging handlers which ship records to a remote listener (see tools/rabbitmq_log_listener.py).
+
+Records are formatted in the calling thread, placed on a bounded queue, and sent in
+batches by a background thread, so a slow or missing listener never stalls the
+simulation loop.  If the queue is full the record is dropped and counted; the count
+is reported to the listener with the next batch that gets through.  Each batch is
+shipped as a single pickled list of message dicts.
+
+The sender thread does not survive os.fork(), so a forked child which goes on logging
+must call restartSendersAfterFork().
+"""
+
+import os
+import sys
+import socket
+import errno
+import logging
+import threading
+import weakref
+import tempfile
+import shutil
+import unittest
+from Queue import Queue, Full, Empty
+import six.moves.cPickle as pickle
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 0.5  # seconds
+DEFAULT_SOCKET_PATH = '/tmp/pyrhea_logger.sock'
+PIKA_QUEUE_NAME = 'pyrhea_logger'
+
+
+class PikaTransport(object):
+    """Publishes each batch to the pyrhea_logger queue of a RabbitMQ broker"""
+    def __init__(self, host='localhost'):
+        self.host = host
+        self.ch = None
+
+    def open(self):
+        import pika
+        conn = pika.BlockingConnection(pika.ConnectionParameters(host=self.host))
+        self.ch = conn.channel()
+        self.ch.queue_declare(queue=PIKA_QUEUE_NAME)
+
+    def send(self, msgList):
+        self.ch.basic_publish(exchange='', routing_key=PIKA_QUEUE_NAME,
+                              body=pickle.dumps(msgList, 2))
+        return True
+
+    def close(self):
+        if self.ch is not None:
+            self.ch.connection.close()
+            self.ch = None
+
+
+class UnixSocketTransport(object):
+    """
+    Sends each batch as one datagram to a Unix domain socket bound by the listener.
+    The socket is non-blocking; a batch which cannot be sent immediately is dropped.
+    """
+    def __init__(self, path=DEFAULT_SOCKET_PATH):
+        self.path = path
+        self.sock = None
+
+    def open(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(0)
+
+    def send(self, msgList):
+        try:
+            self.sock.sendto(pickle.dumps(msgList, 2), self.path)
+            return True
+        except socket.error, e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS, errno.EMSGSIZE,
+                           errno.ENOENT, errno.ECONNREFUSED):
+                return False
+            raise
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+TRANSPORTS = {'pika': PikaTransport,
+              'unixsocket': UnixSocketTransport}
+
+_liveHandlers = weakref.WeakSet()
+
+
+class BatchSenderThread(threading.Thread):
+    """
+    Drains the handler's queue, sending batches of up to batchSize messages.  A partial
+    batch is sent after flushInterval seconds without a new message.  A None message
+    causes the thread to send what it has and exit.
+    """
+    def __init__(self, handler):
+        super(BatchSenderThread, self).__init__(name='remote_log_sender')
+        self.daemon = True
+        self.handler = handler
+
+    def run(self):
+        hdlr = self.handler
+        try:
+            hdlr.transport.open()
+        except Exception, e:
+            sys.stderr.write('Remote log transport failed to open: %s\n' % e)
+            hdlr.transport = None
+        done = False
+        while not done:
+            batch = []
+            try:
+                msg = hdlr.queue.get(timeout=hdlr.flushInterval)
+                while True:
+                    if msg is None:
+                        done = True
+                        break
+                    batch.append(msg)
+                    if len(batch) >= hdlr.batchSize:
+                        break
+                    msg = hdlr.queue.get_nowait()
+            except Empty:
+                pass
+            if batch or (done and hdlr.nDropped + hdlr.nUnsent > hdlr.nReported):
+                hdlr.sendBatch(batch)
+        if hdlr.transport is not None:
+            hdlr.transport.close()
+
+
+class BatchingLogHandler(logging.Handler):
+    """
+    transport is the name of an entry in TRANSPORTS; any further keyword arguments are
+    passed to the transport's constructor.  These can all be given in the handler
+    section of log_cfg.yaml.
+    """
+    def __init__(self, transport='unixsocket', queueSize=DEFAULT_QUEUE_SIZE,
+                 batchSize=DEFAULT_BATCH_SIZE, flushInterval=DEFAULT_FLUSH_INTERVAL,
+                 **kwargs):
+        logging.Handler.__init__(self)
+        if transport not in TRANSPORTS:
+            raise RuntimeError('Unknown remote logging transport %s' % transport)
+        self.transportName = transport
+        self.transportKwargs = kwargs
+        self.machine = os.uname()[1]
+        self.queueSize = queueSize
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.startSender()
+        _liveHandlers.add(self)
+
+    def startSender(self):
+        """Start a sender thread with a fresh transport, queue and counts"""
+        self.transport = TRANSPORTS[self.transportName](**self.transportKwargs)
+        self.queue = Queue(maxsize=self.queueSize)
+        self.nDropped = 0  # records which did not fit in the queue
+        self.nUnsent = 0  # records lost because the transport could not take them
+        self.nReported = 0
+        self.sender = BatchSenderThread(self)
+        self.sender.start()
+
+    def restartAfterFork(self):
+        """
+        The child of a fork has no sender thread, and must not share the parent's queue
+        or transport connection.  Records still queued in the parent are sent by the
+        parent.
+        """
+        self.createLock()
+        self.startSender()
+
+    def emit(self, record):
+        try:
+            message = {'source': 'logger', 'machine': self.machine,
+                       'message': self.format(record), 'level': record.levelname,
+                       'pathname': record.pathname, 'lineno': record.lineno,
+                       'exception': record.exc_text, 'rank': getattr(record, 'rank', None)}
+        except Exception:
+            self.handleError(record)
+            return
+        try:
+            self.queue.put_nowait(message)
+        except Full:
+            self.nDropped += 1
+
+    def sendBatch(self, batch):
+        """Called from the sender thread"""
+        nLost = self.nDropped + self.nUnsent
+        nReal = len(batch)
+        if nLost > self.nReported:
+            batch.append({'source': 'logger', 'machine': self.machine,
+                          'message': ('%d log records were dropped by the sender'
+                                      % (nLost - self.nReported)),
+                          'level': 'WARNING', 'pathname': __file__, 'lineno': 0,
+                          'exception': None, 'rank': batch[0]['rank'] if batch else None})
+        if self.transport is None:
+            self.nUnsent += nReal
+        else:
+            try:
+                sent = self.transport.send(batch)
+            except Exception, e:
+                sys.stderr.write('Remote log transport failed: %s\n' % e)
+                sent = False
+            if sent:
+                self.nReported = nLost
+            else:
+                self.nUnsent += nReal
+
+    def close(self):
+        _liveHandlers.discard(self)
+        if self.sender.is_alive():
+            try:
+                self.queue.put(None, timeout=self.flushInterval)
+            except Full:
+                pass
+            self.sender.join(10.0 * self.flushInterval)
+        logging.Handler.close(self)
+
+
+def restartSendersAfterFork():
+    """Called in the child after os.fork() to give every open handler a new sender"""
+    for hdlr in list(_liveHandlers):
+        hdlr.restartAfterFork()
+
+
+class _GatedUnixSocketTransport(UnixSocketTransport):
+    """For testing- the transport does not open until the gate is set"""
+    gate = threading.Event()
+
+    def open(self):
+        self.gate.wait(10.0)
+        super(_GatedUnixSocketTransport, self).open()
+
+
+class TestBatchingLogHandler(unittest.TestCase):
+    def setUp(self):
+        self.tmpDir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpDir, 'log.sock')
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sock.settimeout(5.0)
+        self.logger = logging.getLogger('remotelog_test')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.hdlr = None
+
+    def tearDown(self):
+        if self.hdlr is not None:
+            self.logger.removeHandler(self.hdlr)
+            self.hdlr.close()
+        self.sock.close()
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
+
+    def addHandler(self, **kwargs):
+        self.hdlr = BatchingLogHandler(path=self.path, flushInterval=0.05, **kwargs)
+        self.logger.addHandler(self.hdlr)
+
+    def receive(self, nMsgs):
+        """Returns the list of batches received, up to a total of nMsgs messages"""
+        batchL = []
+        while sum([len(batch) for batch in batchL]) < nMsgs:
+            batchL.append(pickle.loads(self.sock.recv(65536)))
+        return batchL
+
+    def test_batches(self):
+        self.addHandler(batchSize=5)
+        for i in xrange(12):
+            self.logger.info('message %d', i)
+        self.hdlr.close()
+        batchL = self.receive(12)
+        self.assertTrue(all([len(batch) <= 5 for batch in batchL]))
+        self.assertEqual([msg['message'] for batch in batchL for msg in batch],
+                         ['message %d' % i for i in xrange(12)])
+        self.assertEqual(self.hdlr.nDropped, 0)
+
+    def test_overflow(self):
+        TRANSPORTS['gated'] = _GatedUnixSocketTransport
+        _GatedUnixSocketTransport.gate.clear()
+        try:
+            self.addHandler(transport='gated', queueSize=3, batchSize=100)
+            for i in xrange(10):
+                self.logger.info('message %d', i)
+            self.assertEqual(self.hdlr.nDropped, 7)
+            _GatedUnixSocketTransport.gate.set()
+            self.hdlr.close()
+            msgL = [msg['message'] for batch in self.receive(4) for msg in batch]
+        finally:
+            del TRANSPORTS['gated']
+        self.assertEqual(msgL, ['message 0', 'message 1', 'message 2',
+                                '7 log records were dropped by the sender'])
+
+    def test_fork(self):
+        self.addHandler()
+        self.logger.info('from the parent')
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                restartSendersAfterFork()
+                self.logger.info('from the child')
+                self.hdlr.close()
+                status = 0
+            finally:
+                os._exit(status)
+        pid, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+        self.hdlr.close()
+        msgL = [msg['message'] for batch in self.receive(2) for msg in batch]
+        self.assertEqual(sorted(msgL), ['from the child', 'from the parent'])
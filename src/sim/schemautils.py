@@ -63,6 +63,20 @@ def setSchemaBasePath(basePath):
     _schemaBasePath = os.path.abspath(basePath)
 
 
+def getSchemaPath(schemaURI):
+    """
+    Returns the local file path from which getValidator would load the given schema,
+    or None if the schema is not a local file.
+    """
+    p = urlparse.urlsplit(schemaURI)
+    if p.scheme != '':
+        return None
+    elif p.path.startswith('/') or _schemaBasePath is None:
+        return p.path
+    else:
+        return os.path.join(_schemaBasePath, p.path)
+
+
 def getValidator(schemaURI):
     p = urlparse.urlsplit(schemaURI)
     if p.scheme == '':
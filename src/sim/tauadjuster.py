@@ -51,6 +51,9 @@ def overrideTaus(patch, tauDict):
                     fac.flushCaches()
                     flushedFac = True
                 ward.iA.flushCaches()
+                if hasattr(ward.iA, 'core'):
+                    # Trees for the old tau are keyed by it and will never be used again
+                    ward.iA.core.flushCaches()
                 ward.iA.tau = tauDict[key]
 
 
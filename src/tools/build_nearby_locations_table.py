@@ -10,11 +10,16 @@ giving the distances to the nearest N locations.
 import math
 import optparse
 import yaml
+import numpy as np
 
 import phacsl.utils.formats.yaml_tools as yaml_tools
 
 DEFAULT_N_NEAREST = 10
 DEFAULT_OUT_FNAME = "separation_table.yaml"
+DEFAULT_BLOCK_SIZE = 1000
+# Candidates within this many km of the Nth nearest (by the vectorized calculation) are
+# re-checked with longitudeLatitudeSep, so the results match the scalar calculation exactly
+CANDIDATE_SLOP = 1.0e-6
 
 
 def longitudeLatitudeSep(lon1, lat1, lon2, lat2):
@@ -43,12 +48,67 @@ def longitudeLatitudeSep(lon1, lat1, lon2, lat2):
     return R*c
 
 
+def separationBlock(srcLons, srcLats, dstLons, dstLats):
+    """
+    Vectorized form of longitudeLatitudeSep.  Inputs are 1-D arrays in floating point
+    degrees; returns an array of shape (nSrc, nDst) of separations in kilometers.
+    """
+    scale = math.pi / 180.
+    lat1r = srcLats[:, np.newaxis] * scale
+    lon1r = srcLons[:, np.newaxis] * scale
+    lat2r = dstLats[np.newaxis, :] * scale
+    lon2r = dstLons[np.newaxis, :] * scale
+    apb = np.sin(lat1r)*np.sin(lat2r) + np.cos(lat1r)*np.cos(lat2r) * np.cos(lon2r-lon1r)
+    np.clip(apb, -1.0, 1.0, out=apb)  # avoid rounding error
+    R = 6378.  # radius of earth in km; in miles it's 3963.189
+    return R*np.arccos(apb)
+
+
+def findNearest(srcRecs, dstRecs, nToSave, blockSize=DEFAULT_BLOCK_SIZE):
+    """
+    Returns a dict mapping each source abbrev to a list of the (separation, dstAbbrev)
+    pairs of its nToSave nearest destinations, in increasing order.  Sources are
+    handled blockSize at a time to bound memory use.  The candidates are picked with
+    numpy, but the separations reported are those of longitudeLatitudeSep, so the
+    result is the same as sorting the full list of separations for each source.
+    """
+    dstNames = [dR['abbrev'] for dR in dstRecs]
+    dstLons = np.array([dR['longitude'] for dR in dstRecs], dtype=np.float64)
+    dstLats = np.array([dR['latitude'] for dR in dstRecs], dtype=np.float64)
+    nDst = len(dstRecs)
+    result = {}
+    for blockStart in xrange(0, len(srcRecs), blockSize):
+        blockRecs = srcRecs[blockStart: blockStart + blockSize]
+        srcLons = np.array([sR['longitude'] for sR in blockRecs], dtype=np.float64)
+        srcLats = np.array([sR['latitude'] for sR in blockRecs], dtype=np.float64)
+        sepBlock = separationBlock(srcLons, srcLats, dstLons, dstLats)
+        if 0 < nToSave < nDst:
+            cutoffs = np.partition(sepBlock, nToSave - 1, axis=1)[:, nToSave - 1]
+        else:
+            cutoffs = np.full(len(blockRecs), np.inf)
+        for sR, seps, cutoff in zip(blockRecs, sepBlock, cutoffs):
+            srcNm = sR['abbrev']
+            if srcNm in result:
+                raise RuntimeError("Duplicate records for source %s" % srcNm)
+            srcLon = sR['longitude']
+            srcLat = sR['latitude']
+            pairL = []
+            for idx in np.flatnonzero(seps <= cutoff + CANDIDATE_SLOP):
+                dR = dstRecs[idx]
+                pairL.append((longitudeLatitudeSep(srcLon, srcLat,
+                                                   dR['longitude'], dR['latitude']),
+                              dstNames[idx]))
+            pairL.sort()
+            result[srcNm] = pairL[:nToSave]
+    return result
+
+
 def main():
     """
     main
     """
     parser = optparse.OptionParser(usage="""
-    %prog [-n NNearest][--category CAT] srcYamlDir dstYamlDir
+    %prog [-n NNearest][--category CAT][--blocksize N] srcYamlDir dstYamlDir
     """)
     parser.add_option('-n', '--nnearest', action='store', type='int',
                       default=DEFAULT_N_NEAREST,
@@ -59,9 +119,13 @@ def main():
                       help="Output yaml file name")
     parser.add_option('--category', action='store', type='string',
                       help="Include only destinations belonging to this category (e.g. HOSPITAL)")
+    parser.add_option('--blocksize', action='store', type='int', default=DEFAULT_BLOCK_SIZE,
+                      help="How many sources to process at once; bounds memory use")
     opts, args = parser.parse_args()
     if len(args) != 2:
         parser.error('Two directory names are required')
+    if opts.blocksize < 1:
+        parser.error('The block size must be at least 1')
 
     nToSave = opts.nnearest
     saveInverse = opts.inv
@@ -73,25 +137,12 @@ def main():
     if opts.category:
         dstRecs = [rec for rec in dstRecs if rec['category'] == opts.category]
 
+    nearestD = findNearest(srcRecs, dstRecs, nToSave, blockSize=opts.blocksize)
     outTbl = {}
-    for sR in srcRecs:
-        srcNm = sR['abbrev']
-        if srcNm in outTbl:
-            raise RuntimeError("Duplicate records for source %s" % srcNm)
-        else:
-            pairL = []
-            srcLon = sR['longitude']
-            srcLat = sR['latitude']
-            for dR in dstRecs:
-                dstNm = dR['abbrev']
-                dstLon = dR['longitude']
-                dstLat = dR['latitude']
-                pairL.append((longitudeLatitudeSep(srcLon, srcLat, dstLon, dstLat), dstNm))
-            pairL.sort()
-            pairL = pairL[:nToSave]
-            if saveInverse:
-                pairL = [(1.0/sep, nm) for sep, nm in pairL]
-            outTbl[srcNm] = {nm: wt for wt, nm in pairL}
+    for srcNm, pairL in nearestD.items():
+        if saveInverse:
+            pairL = [(1.0/sep, nm) for sep, nm in pairL]
+        outTbl[srcNm] = {nm: wt for wt, nm in pairL}
 
     with open(outFName, 'w') as f:
         yaml.safe_dump(outTbl, f, default_flow_style=True, indent=4,
@@ -1,11 +1,15 @@
 import sys
 import re
-from collections import defaultdict
+import heapq
+import zlib
+from collections import defaultdict, deque
+from multiprocessing import Pool
+from optparse import OptionParser
 
 """
 example lines:
 
-[0]INFO:infectionTracking:PatientAgent_ICU_HOSPITAL_Patch_0_0_COPL_2000_H_ICU_0_5 newly colonized at 1 in fac COPL_2000_H, tier 
+[0]INFO:infectionTracking:PatientAgent_ICU_HOSPITAL_Patch_0_0_COPL_2000_H_ICU_0_5 newly colonized at 1 in fac COPL_2000_H, tier
 ICU, ward 0
 
 [0]INFO:infectionTracking:PatientAgent_HOSP_HOSPITAL_Patch_0_0_SAIN_2875_H_HOSP_2_42 arriving in community at time 1 with colonization status COLONIZED
@@ -15,165 +19,231 @@ s CLEAR
 
 [0]INFO:infectionTracking:PatientAgent_HOME_COMMUNITY_Patch_0_0_C649_823 leaving community at time 1 with colonization status CLEAR
 
+[0]INFO:infectionTracking:PatientAgent_HOSP_HOSPITAL_Patch_0_0_SAIN_2875_H_HOSP_2_42 died at 7 in fac SAIN_2875_H, tier HOSP, ward 2 with status CLEAR
+
+The logs are processed as a stream.  Each event is written to its CSV file as soon as it
+is parsed, and only a short summary of each living agent is kept; an agent's summary
+is folded into the histograms when the agent dies or the input ends.  Several per-rank
+log files can be given.  Their events are merged in time order, so agents moving
+between ranks are followed correctly.  With --nprocs N the agents are split into N
+shards by name and each shard is handled by its own process, which reads all the logs
+but parses only its own agents' lines.
 """
 
 reColonize = re.compile(r"INFO:infectionTracking:(\S+)\snewly colonized at\s(\d+)\sin fac\s(\S+),\stier\s(\S+),\sward\s(\d+)")
 reDecolonize = re.compile(r"INFO:infectionTracking:(\S+)\sdecolonized at\s(\d+)\sin fac\s(\S+),\stier\s(\S+),\sward\s(\d+)")
 reArrive = re.compile(r"INFO:infectionTracking:(\S+)\sarriving in community at time\s(\d+)\swith colonization status\s(\S+)")
 reDepart = re.compile(r"INFO:infectionTracking:(\S+)\sleaving community at time\s(\d+)\swith colonization status\s(\S+)")
+reDeath = re.compile(r"INFO:infectionTracking:(\S+)\sdied at\s(\d+)\sin fac\s(\S+),\stier\s(\S+),\sward\s(\S+)\swith status\s(\S+)")
 
-colonizations = []  # agent, time, fac, tier, ward
-decolonizations = []  # agent, time, fac, tier, ward
-arrivals = []       # agent, time, status
-departures = []     # agent, time, status
-
-agentHistory = defaultdict(list)
-
-def appendHistory(event, data):
-    agent = data[0]
-    agentHistory[agent].append(((event,) + data[1:]))
-
-
-def printHistory(history):
-    for h in history:
-        print h
-    
-def processHistory():
-    colonizationCountHist = defaultdict(int)
-    colonizationCountHistByYear = defaultdict(lambda:defaultdict(int))
-    daysPerYear = 100
-    maxYears = 30
-    
-    for agent,history in agentHistory.items():
-        lastDepArr = None
-        lastDepArrStatus = None
-        colonizationCount = 0
-        colonizationCountByYear = defaultdict(int)
-        for hItem in history:
-            event = hItem[0]
-            date = int(hItem[1])
-            if event=="comArrival" or event=="comDepart":
-                if lastDepArr == event:
-                    print "!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?"
-                    print "arrivals/departures wrong for agent %s"%agent
-                    printHistory(history)
-                    print "!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?"
-                    print "**********************************"
-                lastDepArr = event
-                
-            if event == "colonization":
-                if lastDepArr == "comArrival":
-                    print "!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?"
-                    print "colonization event while in community for agent %s"%agent
-                    printHistory(history)
-                    print "!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?"
-                    print "**********************************"
-                    
-                colonizationCount +=1
-                year = int(date / daysPerYear)
-                colonizationCountByYear[year] += 1
-                
-        if 0 and colonizationCount > 3:
-            print "**********************************"
-            print "agent with high colonization count: %s"%agent
-            printHistory(history)
-            print "**********************************"
-            
-        colonizationCountHist[colonizationCount] += 1
-        for i in xrange(maxYears):
-            colonizationCountHistByYear[i][colonizationCountByYear[i]] += 1
-
-    print "colonization count histogram:"
-    print colonizationCountHist
-    print "by year"
-    for y in xrange(maxYears):
-        print colonizationCountHistByYear[y]
-
-def appendBuggyHistory():
-    appendHistory('comArrival', ("buggyAgent1", 5, 'CLEAR'))
-    appendHistory('comArrival', ("buggyAgent1", 10, 'CLEAR'))
-    appendHistory('comDepart', ("buggyAgent2", 5, 'CLEAR'))
-    appendHistory('comDepart', ("buggyAgent2", 10, 'CLEAR'))
-    appendHistory('comArrival', ("buggyAgent3", 10, 'CLEAR'))
-    appendHistory('colonization', ("buggyAgent3", 15, 'fac', 'HOSP', 0))
-    
-def parse(line):
-    line = line.strip()
-    m = reColonize.search(line)
-    if (m):
-        data = m.group(1,2,3,4,5)
-        appendHistory('colonization', data)
-        colonizations.append(data)
-        return
-
-    m = reDecolonize.search(line)
-    if (m):
-        data = m.group(1,2,3,4,5)
-        appendHistory('decolonization', data)
-        decolonizations.append(data)
-        return
-
-    m = reArrive.search(line)
-    if (m):
-        data = m.group(1,2,3)
-        appendHistory('comArrival', data)
-        arrivals.append(data)
-        return
-
-    m = reDepart.search(line)
-    if (m):
-        data = m.group(1,2,3)
-        appendHistory('comDepart', data)
-        departures.append(data)
-        return
-
-    raise RuntimeError("unreachable!")
-
-    x,it,remainder = line.partition(':infectionTracking:')
-    agent,sp,remainder = remainder.partition(' ')
-    if remainder.startswith('newly colonized'):
-        x,y,remainder = remainder.partition('newly colonized at ')
-        time,x,loc = remainder.partition(' in fac ')
-        
-
-def writeCsvs():
-    with open("infTrack_colonizations.csv", "w") as f:
-        f.write("agent, time, fac, tier, ward\n")
-        for e in colonizations:
-            f.write("%s,%s,%s,%s,%s\n"%(e[0], e[1], e[2], e[3], e[4]))
-
-    with open("infTrack_decolonizations.csv", "w") as f:
-        f.write("agent, time, fac, tier, ward\n")
-        for e in decolonizations:
-            f.write("%s,%s,%s,%s,%s\n"%(e[0], e[1], e[2], e[3], e[4]))
-
-    with open("infTrack_arrivals.csv", "w") as f:
-        f.write("agent, time, status\n")
-        for e in arrivals:
-            f.write("%s,%s,%s\n"%(e[0], e[1], e[2]))
-
-    with open("infTrack_departures.csv", "w") as f:
-        f.write("agent, time, status\n")
-        for e in departures:
-            f.write("%s,%s,%s\n"%(e[0], e[1], e[2]))
-
-            
-def main():
-    inputLog = sys.argv[1]
+EVENT_REGEXES = [('colonization', reColonize),
+                 ('decolonization', reDecolonize),
+                 ('comArrival', reArrive),
+                 ('comDepart', reDepart),
+                 ('death', reDeath)]
 
-    with open(inputLog) as f:
-        for line in f:
-            if "INFO:infectionTracking" in line:
-                parse(line)
+CSV_INFO = {'colonization': ('colonizations', "agent, time, fac, tier, ward"),
+            'decolonization': ('decolonizations', "agent, time, fac, tier, ward"),
+            'comArrival': ('arrivals', "agent, time, status"),
+            'comDepart': ('departures', "agent, time, status"),
+            'death': ('deaths', "agent, time, fac, tier, ward, status")}
+
+LOG_TAG = ":infectionTracking:"
+DAYS_PER_YEAR = 100
+MAX_YEARS = 30
+HISTORY_DEPTH = 20  # recent events kept per agent for the consistency warnings
 
-    if 0:
-        appendBuggyHistory()
 
-    if 0:
-        writeCsvs()
+def agentShard(agent, nShards):
+    return zlib.crc32(agent) % nShards
 
-    if 1:
-        processHistory()
-        
 
-main()
+def parse(line):
+    """Returns (event, data) for an infectionTracking log line"""
+    for event, regex in EVENT_REGEXES:
+        m = regex.search(line)
+        if m:
+            return event, m.groups()
+    raise RuntimeError("unrecognized infectionTracking line: %s" % line.strip())
+
+
+def iterEvents(fname, shard=0, nShards=1):
+    """
+    Yields (time, event, data) for the infectionTracking lines of one log file which
+    belong to the given agent shard.
+    """
+    with open(fname) as f:
+        for line in f:
+            if LOG_TAG not in line:
+                continue
+            if nShards > 1:
+                agent = line.partition(LOG_TAG)[2].split(None, 1)[0]
+                if agentShard(agent, nShards) != shard:
+                    continue
+            event, data = parse(line)
+            yield int(data[1]), event, data
+
+
+def iterMergedEvents(fnameL, shard=0, nShards=1):
+    """Merges the event streams of several time-ordered log files"""
+    if len(fnameL) == 1:
+        return iterEvents(fnameL[0], shard, nShards)
+    return heapq.merge(*[iterEvents(fname, shard, nShards) for fname in fnameL])
+
+
+def warn(msg, agent, history):
+    # One write per warning, so the warnings of several shard processes don't interleave
+    lines = ["!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?",
+             "%s for agent %s" % (msg, agent)]
+    lines.extend([str(h) for h in history])
+    lines.extend(["!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?!?",
+                  "**********************************"])
+    sys.stdout.write("\n".join(lines) + "\n")
+    sys.stdout.flush()
+
+
+class AgentSummary(object):
+    __slots__ = ['lastDepArr', 'colonizationCount', 'colonizationCountByYear', 'history']
+
+    def __init__(self):
+        self.lastDepArr = None
+        self.colonizationCount = 0
+        self.colonizationCountByYear = defaultdict(int)
+        self.history = deque(maxlen=HISTORY_DEPTH)
+
+
+class HistoryCollector(object):
+    """
+    Accumulates the colonization count histograms.  Only agents which are still alive
+    are held in memory.
+    """
+    def __init__(self):
+        self.liveAgents = {}
+        self.colonizationCountHist = defaultdict(int)
+        self.colonizationCountHistByYear = defaultdict(lambda: defaultdict(int))
+
+    def addEvent(self, event, data):
+        agent = data[0]
+        date = int(data[1])
+        if agent not in self.liveAgents:
+            self.liveAgents[agent] = AgentSummary()
+        summary = self.liveAgents[agent]
+        summary.history.append((event,) + data[1:])
+
+        if event == "comArrival" or event == "comDepart":
+            if summary.lastDepArr == event:
+                warn("arrivals/departures wrong", agent, summary.history)
+            summary.lastDepArr = event
+
+        elif event == "colonization":
+            if summary.lastDepArr == "comArrival":
+                warn("colonization event while in community", agent, summary.history)
+            summary.colonizationCount += 1
+            summary.colonizationCountByYear[int(date / DAYS_PER_YEAR)] += 1
+
+        elif event == "death":
+            self.finalize(agent)
+
+    def finalize(self, agent):
+        summary = self.liveAgents.pop(agent)
+        self.colonizationCountHist[summary.colonizationCount] += 1
+        for i in xrange(MAX_YEARS):
+            self.colonizationCountHistByYear[i][summary.colonizationCountByYear[i]] += 1
+
+    def finish(self):
+        """Finalize the agents still alive at the end of the run"""
+        for agent in self.liveAgents.keys():
+            self.finalize(agent)
+
+    def getResults(self):
+        """Returns the histograms as plain dicts, which can be pickled and merged"""
+        return (dict(self.colonizationCountHist),
+                dict((y, dict(d)) for y, d in self.colonizationCountHistByYear.items()))
+
+    def mergeResults(self, results):
+        hist, histByYear = results
+        for k, v in hist.items():
+            self.colonizationCountHist[k] += v
+        for y, d in histByYear.items():
+            for k, v in d.items():
+                self.colonizationCountHistByYear[y][k] += v
+
+    def report(self):
+        print "colonization count histogram:"
+        print self.colonizationCountHist
+        print "by year"
+        for y in xrange(MAX_YEARS):
+            print self.colonizationCountHistByYear[y]
+
+
+class CsvSink(object):
+    """Writes each event to its CSV file as it arrives"""
+    def __init__(self, prefix, suffix=''):
+        self.files = {}
+        for event, (name, header) in CSV_INFO.items():
+            f = open("%s_%s%s.csv" % (prefix, name, suffix), "w")
+            f.write(header + "\n")
+            self.files[event] = f
+
+    def addEvent(self, event, data):
+        self.files[event].write(",".join(data) + "\n")
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+def processShard(args):
+    """Runs the whole pipeline for one agent shard; returns the shard's histograms"""
+    fnameL, shard, nShards, csvPrefix = args
+    collector = HistoryCollector()
+    if csvPrefix is None:
+        sink = None
+    else:
+        sink = CsvSink(csvPrefix, ('' if nShards == 1 else '_%d' % shard))
+    for time, event, data in iterMergedEvents(fnameL, shard, nShards):  # @UnusedVariable
+        collector.addEvent(event, data)
+        if sink is not None:
+            sink.addEvent(event, data)
+    if sink is not None:
+        sink.close()
+    collector.finish()
+    return collector.getResults()
+
+
+def main():
+    parser = OptionParser(usage="""
+    %prog [--csv] [--prefix prefix] [--nprocs n] log1 [log2 ...]
+
+    The logs may be the per-rank logs of a single run.
+    """)
+    parser.add_option('--csv', action='store_true', default=False,
+                      help='write the events to CSV files')
+    parser.add_option('--prefix', action='store', type='string', default='infTrack',
+                      help='prefix for the CSV file names (default %default)')
+    parser.add_option('-m', '--nprocs', type='int', default=1,
+                      help='number of processes; each handles one shard of the agents')
+    opts, args = parser.parse_args()
+    if not args:
+        parser.error('At least one log file is required')
+    if opts.nprocs < 1:
+        parser.error('--nprocs must be at least 1')
+
+    csvPrefix = opts.prefix if opts.csv else None
+    argL = [(args, shard, opts.nprocs, csvPrefix) for shard in xrange(opts.nprocs)]
+    if opts.nprocs == 1:
+        resultL = [processShard(argL[0])]
+    else:
+        pool = Pool(opts.nprocs)
+        resultL = pool.map(processShard, argL)
+        pool.close()
+        pool.join()
+
+    collector = HistoryCollector()
+    for results in resultL:
+        collector.mergeResults(results)
+    collector.report()
+
+
+if __name__ == "__main__":
+    main()
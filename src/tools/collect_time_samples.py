@@ -31,44 +31,99 @@ import schemautils
 import pathogenbase as pth
 from notes_plotter import readFacFiles, checkInputFileSchema
 from notes_plotter import SCHEMA_DIR, INPUT_SCHEMA
-from time_series_plotter import mergeNotesFiles, getTimeSeriesList
+from notes_plotter import mergeNotesFiles, getTimeSeriesList
 
 DEFAULT_OUT_FILE = 'time_samples.yaml'
 OUTPUT_SCHEMA = 'time_samples_schema.yaml'
 
-def extractManySamples(abbrev, timeL, specialDict):
-    sampListDict = defaultdict(list)
-    timeListDict = defaultdict(list)
-    for dayVec, curves in getTimeSeriesList(abbrev, specialDict, 'localpathogen'):
-        totVec = sum(curves.values())
-        clippedTimes = np.compress(np.isin(timeL, dayVec), timeL)
-        mask = np.isin(dayVec, clippedTimes)
-        for pthLvl, lVec in curves.items():
+class _SampleGroup(object):
+    """
+    The time series of all requested facilities which share one day vector (that is, one
+    patch of one notes file).  Their columns are stacked into a single day x column array
+    so the sample days can be extracted for all of them with one fancy-indexing operation.
+    """
+    def __init__(self, dayVec, timeL):
+        self.clippedTimes = np.compress(np.isin(timeL, dayVec), timeL)
+        self.rows = np.flatnonzero(np.isin(dayVec, self.clippedTimes))
+        self.cols = []
+        self.samples = None
+
+    def addColumns(self, colL):
+        """Returns the index of the first of the added columns"""
+        offset = len(self.cols)
+        self.cols.extend(colL)
+        return offset
+
+    def extract(self):
+        if self.cols:
+            self.samples = np.column_stack(self.cols)[self.rows]
+        self.cols = None
+
+
+def _groupSeries(abbrevL, timeL, specialDict, specialDictKey, groupD):
+    """
+    Returns a list parallel to abbrevL of lists of (group, offset, keyList), one per time
+    series of the abbrev in the order provided by getTimeSeriesList.  keyList is None if
+    the series is not classified by level.
+    """
+    rslt = []
+    for abbrev in abbrevL:
+        entryL = []
+        for dayVec, curves in getTimeSeriesList(abbrev, specialDict, specialDictKey):
+            if id(dayVec) not in groupD:
+                groupD[id(dayVec)] = (dayVec, _SampleGroup(dayVec, timeL))
+            grp = groupD[id(dayVec)][1]
+            if isinstance(curves, dict):
+                keyL = curves.keys()
+                offset = grp.addColumns([curves[key] for key in keyL])
+            else:
+                keyL = None
+                offset = grp.addColumns([curves])
+            entryL.append((grp, offset, keyL))
+        rslt.append(entryL)
+    return rslt
+
+
+def extractAllSamples(abbrevL, timeL, specialDict):
+    """
+    Returns a dict {abbrev: (sampListDict, timeListDict)} where the entries are as would be
+    returned by extractManySamples for each abbrev.  The notes are decoded once, and the
+    sample days for all facilities sharing a patch are extracted together.
+    """
+    groupD = {}  # keeps the day vectors alive, so their ids remain unique
+    pthEntries = _groupSeries(abbrevL, timeL, specialDict, 'localpathogen', groupD)
+    popEntries = _groupSeries(abbrevL, timeL, specialDict, 'localoccupancy', groupD)
+    ncEntries = _groupSeries(abbrevL, timeL, specialDict, 'localtiernewcolonized', groupD)
+    for dayVec, grp in groupD.values():  # @UnusedVariable
+        grp.extract()
+
+    rsltD = {}
+    for abbrev, pthL, popL, ncL in zip(abbrevL, pthEntries, popEntries, ncEntries):
+        sampListDict = defaultdict(list)
+        timeListDict = defaultdict(list)
+        for grp, offset, keyL in pthL:
+            lvlSamps = np.asfarray(grp.samples[:, offset: offset + len(keyL)])
+            totVec = np.asfarray(lvlSamps.sum(axis=1))
             with np.errstate(divide='ignore', invalid='ignore'):
-                scaleV = np.true_divide(np.asfarray(lVec), np.asfarray(totVec))
-                scaleV[scaleV == np.inf] = 0.0
-                scaleV = np.nan_to_num(scaleV)
-            sampV = np.compress(mask, scaleV)
-            sampListDict[pth.PthStatus.names[pthLvl]].append(sampV)
-            timeListDict[pth.PthStatus.names[pthLvl]].append(clippedTimes)
-    for dayVec, popVec in getTimeSeriesList(abbrev, specialDict, 'localoccupancy'):
-        clippedTimes = np.compress(np.isin(timeL, dayVec), timeL)
-        mask = np.isin(dayVec, clippedTimes)
-        popV = np.compress(mask, popVec)
-        sampListDict['occupancy'].append(popV)
-        timeListDict['occupancy'].append(clippedTimes)
-    for dayVec, curves in getTimeSeriesList(abbrev, specialDict, 'localtiernewcolonized'):
-        clippedTimes = np.compress(np.isin(timeL, dayVec), timeL)
-        mask = np.isin(dayVec, clippedTimes)
-        sumValue = None
-        for tpl,curve in curves.items():
-            popV = np.compress(mask, curve)
-            if sumValue is None:
-                sumValue = np.zeros(len(popV))
-            sumValue += popV
-        sampListDict['NEW COLONIZED'].append(sumValue)
-        timeListDict['NEW COLONIZED'].append(clippedTimes)
-    return sampListDict, timeListDict
+                scaleM = np.true_divide(lvlSamps, totVec[:, np.newaxis])
+                scaleM[scaleM == np.inf] = 0.0
+                scaleM = np.nan_to_num(scaleM)
+            for col, pthLvl in enumerate(keyL):
+                sampListDict[pth.PthStatus.names[pthLvl]].append(scaleM[:, col])
+                timeListDict[pth.PthStatus.names[pthLvl]].append(grp.clippedTimes)
+        for grp, offset, keyL in popL:
+            sampListDict['occupancy'].append(grp.samples[:, offset])
+            timeListDict['occupancy'].append(grp.clippedTimes)
+        for grp, offset, keyL in ncL:
+            sumValue = np.asfarray(grp.samples[:, offset: offset + len(keyL)]).sum(axis=1)
+            sampListDict['NEW COLONIZED'].append(sumValue)
+            timeListDict['NEW COLONIZED'].append(grp.clippedTimes)
+        rsltD[abbrev] = (sampListDict, timeListDict)
+    return rsltD
+
+
+def extractManySamples(abbrev, timeL, specialDict):
+    return extractAllSamples([abbrev], timeL, specialDict)[abbrev]
 
 def extractSamples(abbrev, time, specialDict):
     pthTplList = getTimeSeriesList(abbrev, specialDict, 'localpathogen')
@@ -174,9 +229,11 @@ def main():
 
     sampleL = []
     if 'trackedFacilities' in inputDict:
+        abbrevL = [abbrev for abbrev in inputDict['trackedFacilities'] if abbrev in facDict]
+        allSampD = extractAllSamples(abbrevL, sampTimes, specialDict)
         for abbrev in inputDict['trackedFacilities']:
             if abbrev in facDict:
-                sampD, timeD = extractManySamples(abbrev, sampTimes, specialDict)
+                sampD, timeD = allSampD[abbrev]
                 print sampD
                 corrListD = defaultdict(list)
                 for key in sampD:
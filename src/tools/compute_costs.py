@@ -20,7 +20,6 @@ import sys
 import math
 import yaml
 import glob
-import random
 from optparse import OptionParser
 from multiprocessing import Process,Manager,Pool,cpu_count
 from collections import defaultdict
@@ -101,9 +100,15 @@ class Distribution(object):
         self.type = type_
         self.args = args_
 
-    def draw(self):
+    def draw(self, size=None):
+        """
+        Returns a single draw, or a numpy array of draws if size is given
+        """
         if self.type == 'value':
-            return self.args['value']
+            if size is None:
+                return self.args['value']
+            else:
+                return np.full(size, self.args['value'], dtype=float)
         elif self.type == 'gamma':
             mean = self.args['mean']
             stdev = self.args['stdev']
@@ -111,7 +116,7 @@ class Distribution(object):
             alpha = (mean/stdev)**2
             beta = (stdev**2)/mean
             
-            return np.random.gamma(alpha,beta)
+            return np.random.gamma(alpha,beta,size)
         
         elif self.type == 'beta':
             mean = self.args['mean']
@@ -120,10 +125,10 @@ class Distribution(object):
             alpha = ((1.0 - mean)/(stdev**2)-(1.0/mean))*(mean**2)
             beta = alpha*((1.0/mean)-1.0)
             
-            return np.random.beta(alpha,beta)
+            return np.random.beta(alpha,beta,size)
         
         elif self.type == 'uniform':
-            return np.random.uniform(self.args['low'],self.args['high'])
+            return np.random.uniform(self.args['low'],self.args['high'],size)
         
         else:
             raise RuntimeError("unknown distribution: {0}".format(self.type))
@@ -156,15 +161,51 @@ def calculateNPVValues(startAge_,annualWage_,targetYear_, params_, discountRate_
     npvQCost = Cost(npvQ,targetYear_)
     
     return npvProdLoss, npvQCost, Cost(qWeight,targetYear_)
+
+# Start ages are drawn as round(uniform(60, 80)), so the end ages get half weight
+START_AGES = np.arange(60, 81)
+START_AGE_PROBS = np.array([0.5] + [1.0] * (len(START_AGES) - 2) + [0.5]) / 20.0
+
+def buildNPVTables(targetYear_, params_):
+    """
+    Evaluate calculateNPVValues once for each start age.  Returns arrays indexed like
+    START_AGES giving the productivity loss per unit of discounted annual wage, the
+    NPV of QALYs, and the base QALY weight.
+    """
+    npvL, npQL, baseQALYL = [], [], []
+    for startAge in START_AGES:
+        npv, npQ, baseQALY = calculateNPVValues(int(startAge), Cost(1.0, targetYear_),
+                                                targetYear_, params_)
+        npvL.append(npv.value)
+        npQL.append(npQ.value)
+        baseQALYL.append(baseQALY.value)
+    return np.array(npvL), np.array(npQL), np.array(baseQALYL)
+
+def drawStartAgeCounts(nV):
+    """
+    For each element of nV, draw how many of that many patients have each start age.
+    This is a multinomial draw done as a chain of binomials so that it vectorizes.
+    Returns an array of shape (len(START_AGES),) + np.shape(nV).
+    """
+    remaining = np.asarray(nV, dtype=int)
+    pLeft = 1.0
+    countL = []
+    for p in START_AGE_PROBS[:-1]:
+        ct = np.random.binomial(remaining, min(p / pLeft, 1.0))
+        countL.append(ct)
+        remaining = remaining - ct
+        pLeft -= p
+    countL.append(remaining)
+    return np.array(countL)
  
-def computeCostOfXDROReg(numPatients_,targetYear_, params_):
+def computeCostOfXDROReg(numPatients_,targetYear_, params_, size_=None):
     
     tRegistryLogin = params_['interventionParameters']['personnelTimeXDROLoginMinutes']
     tRegistryPerPatient = params_['interventionParameters']['personnelTimeXDROSearchMinutesPerPatient']
     
     cInfectControlWageDict = params_['interventionParameters']['personnelXDROWage']
     cInfectControlWage = Cost(Distribution(cInfectControlWageDict['cost']['distribution']['type'],
-                                           cInfectControlWageDict['cost']['distribution']['args']).draw(),
+                                           cInfectControlWageDict['cost']['distribution']['args']).draw(size_),
                               cInfectControlWageDict['cost']['year'])
     
     value = ((tRegistryLogin*Constants.daysPerYear) + (numPatients_*tRegistryPerPatient))\
@@ -172,20 +213,21 @@ def computeCostOfXDROReg(numPatients_,targetYear_, params_):
 
     return Cost(value,targetYear_)
 
-def getNContactsPerDayByType(locationType_, params_):
+def getNContactsPerDayByType(locationType_, params_, size_=None):
     contactRates = params_['contacts']
     if locationType_ in ['LTACH','HOSPITAL']:
         locationType_ = 'GeneralWards'
     ### Update these with RHEA monikers, may need a translate
     return Distribution(contactRates['perDayIn{0}'.format(locationType_)]['distribution']['type'],
-                        contactRates['perDayIn{0}'.format(locationType_)]['distribution']['args']).draw()
+                        contactRates['perDayIn{0}'.format(locationType_)]['distribution']['args']).draw(size_)
                         
-def computeCostsOfContactPrecautions(contactPrecautionDays_, locationType_, rNurseWage_, cGloves_, cGowns_, targetYear_, params_):
+def computeCostsOfContactPrecautions(contactPrecautionDays_, locationType_, rNurseWage_, cGloves_, cGowns_, targetYear_, params_,
+                                     size_=None):
     
-    contactRate = getNContactsPerDayByType(locationType_,params_)
+    contactRate = getNContactsPerDayByType(locationType_,params_,size_)
     tContactPrecautionDict = params_['interventionParameters']['timeDonDoffMinutes']
     tCPMinutes = Distribution(tContactPrecautionDict['distribution']['type'],
-                              tContactPrecautionDict['distribution']['args']).draw()
+                              tContactPrecautionDict['distribution']['args']).draw(size_)
     cpDayCosts = {x:Cost(0.0,targetYear_) for x in contactPrecautionDays_.keys()} 
     for t,cpd in contactPrecautionDays_.items():
         cpDayCosts[t] =Cost((cpd \
@@ -198,15 +240,15 @@ def computeCostsOfContactPrecautions(contactPrecautionDays_, locationType_, rNur
     return cpDayCosts
     #return Cost(value,targetYear_)
 
-def computeCostsOfBundles(numBundles_,numSwabs_, targetYear_, params_):
+def computeCostsOfBundles(numBundles_,numSwabs_, targetYear_, params_, size_=None):
     chgWipeDict = params_['interventionParameters']['chgWipesPerBath']['cost']
     cChgWipesPerBath = Cost(Distribution(chgWipeDict['distribution']['type'],
-                                        chgWipeDict['distribution']['args']).draw(),
+                                        chgWipeDict['distribution']['args']).draw(size_),
                            chgWipeDict['year'])
     
     screenDict = params_['interventionParameters']['screeningTotal']['cost']
     cScreening = Cost(Distribution(screenDict['distribution']['type'],
-                                   screenDict['distribution']['args']).draw(),
+                                   screenDict['distribution']['args']).draw(size_),
                            screenDict['year'])
     #print cChgWipesPerBath.discountedValue(targetYear_)
     #print cScreening.discountedValue(targetYear_)
@@ -217,7 +259,12 @@ def computeCostsOfBundles(numBundles_,numSwabs_, targetYear_, params_):
         
                                         
 def determineOutcomes(nIncidence_,nCarriersCRE_, probInfect_, attribMort_, cGloves_, cGowns_,
-                      rNurseWage_, personAge_, annualWage_, hourlyWage_, targetYear_, params_):
+                      rNurseWage_, personAge_, annualWage_, hourlyWage_, targetYear_, params_,
+                      npvTables_, size_=None):
+    """
+    npvTables_ is the output of buildNPVTables.  If size_ is given, every parameter is
+    drawn as a vector of that many realizations and the returned values are arrays.
+    """
     outcomesDict = params_['outcomes']
     outcomeCosts = {x:{} for x in outcomesDict.keys()}
     
@@ -244,14 +291,14 @@ def determineOutcomes(nIncidence_,nCarriersCRE_, probInfect_, attribMort_, cGlov
     testsNums = {}
     for t,tD in testsDict.items():
         testsCosts[t] = Cost(Distribution(tD['cost']['distribution']['type'],
-                            tD['cost']['distribution']['args']).draw(),
+                            tD['cost']['distribution']['args']).draw(size_),
                      tD['cost']['year'])
         
         testsNums[t] = {}
         nTests = tD['numberOfTests']
         for nt,ntD in nTests.items():
             testsNums[t][nt] = Distribution(ntD['distribution']['type'],
-                                            ntD['distribution']['args']).draw()
+                                            ntD['distribution']['args']).draw(size_)
             
             
     ### Gets the cost of drugs 
@@ -259,7 +306,7 @@ def determineOutcomes(nIncidence_,nCarriersCRE_, probInfect_, attribMort_, cGlov
     drugCosts = {}
     for d,dD in drugsDict.items():
         drugCosts[d] = Cost(Distribution(dD['cost']['distribution']['type'],
-                                         dD['cost']['distribution']['args']).draw(),
+                                         dD['cost']['distribution']['args']).draw(size_),
                             dD['cost']['year'])
     
     for k,v in outcomesDict.items():
@@ -267,7 +314,7 @@ def determineOutcomes(nIncidence_,nCarriersCRE_, probInfect_, attribMort_, cGlov
         #    continue
         if k not in ['pneumoniaAll']:
             nCases = Distribution(v['probability']['distribution']['type'],
-                                  v['probability']['distribution']['args']).draw() \
+                                  v['probability']['distribution']['args']).draw(size_) \
                    * (nIncidence_+nCarriersCRE_) * probInfect_
             outcomeCosts[k]['nCases'] = nCases
             #print "{0}: {1}".format(k,nCases)
@@ -279,7 +326,7 @@ def determineOutcomes(nIncidence_,nCarriersCRE_, probInfect_, attribMort_, cGlov
                 if mk == 'combination':
                     continue
                 therapyProbs[mk] = Distribution(therapyDict[mk]['prob']['distribution']['type'],
-                                                therapyDict[mk]['prob']['distribution']['args']).draw()
+                                                therapyDict[mk]['prob']['distribution']['args']).draw(size_)
                 
                 therapyDrugReg[mk] = {}
                 for d,dD in therapyDict[mk]['drugs'].items():
@@ -296,7 +343,7 @@ def determineOutcomes(nIncidence_,nCarriersCRE_, probInfect_, attribMort_, cGlov
                 #print type(therapyProbs[mk])
                 #print type(nCases)
                 nDead += Distribution(mD['distribution']['type'],
-                                      mD['distribution']['args']).draw() \
+                                      mD['distribution']['args']).draw(size_) \
                        * nCases * attribMort_ * therapyProbs[mk]
             
                 
@@ -309,45 +356,27 @@ def determineOutcomes(nIncidence_,nCarriersCRE_, probInfect_, attribMort_, cGlov
                 
             outcomeCosts[k]['nDead'] = nDead    
             
-            ## NPV and QALYs for live
-            
-            npvCases = Cost(0.0,targetYear_)
-            npQCases = Cost(0.0,targetYear_)
-            baseQALYCases = Cost(0.0,targetYear_)
-            npvDead = Cost(0.0,targetYear_)
-            npQDead = Cost(0.0,targetYear_)
-            baseQALYDead = Cost(0.0,targetYear_)
-            
-            nCasesInt = math.floor(nCases)
+            ## NPV and QALYs.  Only the dead contribute productivity and QALY losses, and all
+            ## cases contribute base QALYs.  The whole cases come first, with the first
+            ## nDeadInt of them dead; a single extra start age covers the fractional remainder.
+            npvTbl, npQTbl, baseQALYTbl = npvTables_
+            nCasesInt = np.floor(nCases)
             nCasesRem = nCases - nCasesInt
-            nDeadInt = math.floor(nDead)
-            nDeadRem = nDead - nDeadInt
-            
-            for i in range(0,int(nCasesInt)):
-                startAge = int(round(Distribution('uniform',{'low':60.0,'high':80.0}).draw()))
-                npv,npQ,baseQALY = calculateNPVValues(startAge,  annualWage_, targetYear_, params_)
-                if i < nDeadInt:
-                    #print npv
-                    #print npvDead
-                    npvDead += npv
-                    npQDead += npQ
-                    baseQALYDead += baseQALY
-                npvCases += npv
-                npQCases += npQ
-                baseQALYCases += baseQALY
-                
-            #REMANDER
-            startAge = int(round(Distribution('uniform',{'low':60.0,'high':80.0}).draw()))
-            npv,npQ,baseQALY = calculateNPVValues(startAge,  annualWage_, targetYear_,  params_)
-            npvCases +=Cost( nCasesRem*npv.value,npv.year)
-            npQCases += Cost(nCasesRem*npQ.value,npQ.year)
-            baseQALYCases += Cost(nCasesRem*baseQALY.value,baseQALY.year)
-            npvDead += Cost(nDeadRem*npv.value,npv.year)
-            npQDead += Cost(nDeadRem*npQ.value,npQ.year)
-            baseQALYDead +=Cost( nDeadRem*baseQALY.value,baseQALY.year)
+            nDeadInt = np.minimum(np.floor(nDead), nCasesInt)
+            nDeadRem = nDead - np.floor(nDead)
+            deadAgeCts = drawStartAgeCounts(nDeadInt)
+            liveAgeCts = drawStartAgeCounts(nCasesInt - nDeadInt)
+            remAgeIdx = np.random.choice(len(START_AGES), size=np.shape(nCases), p=START_AGE_PROBS)
+            annualWageVal = annualWage_.discountedValue(targetYear_).value
+            npvDead = Cost(annualWageVal * (np.dot(npvTbl, deadAgeCts)
+                                            + nDeadRem * npvTbl[remAgeIdx]),
+                           targetYear_)
+            npQDead = Cost(np.dot(npQTbl, deadAgeCts) + nDeadRem * npQTbl[remAgeIdx],
+                           targetYear_)
+            baseQALYCases = Cost(np.dot(baseQALYTbl, deadAgeCts + liveAgeCts)
+                                 + nCasesRem * baseQALYTbl[remAgeIdx],
+                                 targetYear_)
             
-            
-                
             #print drugCostsForTherapy
             #print "{0} Dead: {1}".format(k,nDead)
             ### Now ... hospital costs
@@ -355,36 +384,36 @@ def determineOutcomes(nIncidence_,nCarriersCRE_, probInfect_, attribMort_, cGlov
             ### Gather Distributions Needed
             cICUBedDayDict = params_['costs']['icuBedDay']
             cICUBedDay = Cost(Distribution(cICUBedDayDict['distribution']['type'],
-                                           cICUBedDayDict['distribution']['args']).draw(),
+                                           cICUBedDayDict['distribution']['args']).draw(size_),
                               cICUBedDayDict['year'])
             
             cGenWardBedDayDict = params_['costs']['generalWardBedDay']
             cGenWardBedDay = Cost(Distribution(cGenWardBedDayDict['distribution']['type'],
-                                               cGenWardBedDayDict['distribution']['args']).draw(),
+                                               cGenWardBedDayDict['distribution']['args']).draw(size_),
                                   cGenWardBedDayDict['year'])
             
             nContactsICUDict = params_['contacts']['perDayInICU']
             nContactsICU = Distribution(nContactsICUDict['distribution']['type'],
-                                        nContactsICUDict['distribution']['args']).draw()
+                                        nContactsICUDict['distribution']['args']).draw(size_)
             
             nContactsGenWardDict = params_['contacts']['perDayInGeneralWards']
             nContactsGenWard = Distribution(nContactsGenWardDict['distribution']['type'],
-                                            nContactsGenWardDict['distribution']['args']).draw()
+                                            nContactsGenWardDict['distribution']['args']).draw(size_)
                                             
             attrLOS = Distribution(v['attributableLOS']['distribution']['type'],
-                                   v['attributableLOS']['distribution']['args']).draw()
+                                   v['attributableLOS']['distribution']['args']).draw(size_)
             
             probICU = Distribution(params_['probabilities']['patientInICU']['distribution']['type'],
-                                   params_['probabilities']['patientInICU']['distribution']['args']).draw()
+                                   params_['probabilities']['patientInICU']['distribution']['args']).draw(size_)
             
             hospOutcomesDict = v['hospitalizationOutcomes']['cost']
                                              
             hospOutcomes = Cost(Distribution(hospOutcomesDict['distribution']['type'],
-                                             hospOutcomesDict['distribution']['args']).draw(),
+                                             hospOutcomesDict['distribution']['args']).draw(size_),
                                 hospOutcomesDict['year'])
                 
             treatDurDays = Distribution(v['treatmentDuration']['distribution']['type'],
-                                        v['treatmentDuration']['distribution']['args']).draw()
+                                        v['treatmentDuration']['distribution']['args']).draw(size_)
                                         
 #             cICUBedDay = Cost(4750.316316,2015)
 #             cGenWardBedDay = Cost(2632.7543,2013)
@@ -421,7 +450,7 @@ def determineOutcomes(nIncidence_,nCarriersCRE_, probInfect_, attribMort_, cGlov
             #print "{0} Hosp = {1}".format(k,hospCost)
             
             utilityWeight = Distribution(v['utilityWeight']['distribution']['type'],
-                                         v['utilityWeight']['distribution']['args']).draw()
+                                         v['utilityWeight']['distribution']['args']).draw(size_)
             
             # Joel's attempted mod
             disUtilityWeight = (1.0 - utilityWeight) * (baseQALYCases.discountedValue(targetYear_).value
@@ -880,23 +909,32 @@ def getNewCols_poolHelper(args):
         return None
     
 def determine_costs(newColsArray, cpDaysArray, creBundlesArray, creSwabsArray, xdroArray, abbrevs,
-                    params, opts, facDict, fracAttribMort, notes):
-    costsOfReal = {x:{} for x in abbrevs}
-    randomInt = random.randint(0,len(notes)-1)
-    newColAll = newColsArray[randomInt]
-    cpDaysByType = cpDaysArray[randomInt]
-    creBundlesAll = creBundlesArray[randomInt]
-    creSwabsAll = creSwabsArray[randomInt]
-    
-    xdroAll = xdroArray[randomInt] 
-    personAge = int(round(Distribution('uniform',{'low':60.0,'high':80.0}).draw()))
+                    params, opts, facDict, fracAttribMort, nReals):
+    """
+    Run nReals realizations of the costing model at once.  Each realization samples one
+    notes file, and every model parameter is drawn as a vector of length nReals, so the
+    per-facility costs are array expressions over realizations.  Returns a dict of the
+    form costsOfReal[abbrev][costCategory] -> array of nReals values.
+    """
+    nNotes = len(newColsArray)
+    noteIdxV = np.random.randint(0, nNotes, size=nReals)
+
+    def sampleNotes(valArray, abbrev, key=None):
+        if key is None:
+            return np.array([valArray[i][abbrev] for i in xrange(nNotes)], dtype=float)[noteIdxV]
+        else:
+            return np.array([valArray[i][abbrev][key] for i in xrange(nNotes)],
+                            dtype=float)[noteIdxV]
+
+    npvTables = buildNPVTables(opts.targetyear, params)
+    personAge = np.round(Distribution('uniform',{'low':60.0,'high':80.0}).draw(nReals)).astype(int)
     annualWage = Cost(Distribution(params['costs']['annualWage']['distribution']['type'],
-                                   params['costs']['annualWage']['distribution']['args']).draw(),
+                                   params['costs']['annualWage']['distribution']['args']).draw(nReals),
                       params['costs']['annualWage']['year'])
 
 
     hourlyWage = Cost(Distribution(params['costs']['hourlyWage']['distribution']['type'],
-                                   params['costs']['hourlyWage']['distribution']['args']).draw(),
+                                   params['costs']['hourlyWage']['distribution']['args']).draw(nReals),
                       params['costs']['hourlyWage']['year'])
     
     
@@ -904,114 +942,68 @@ def determine_costs(newColsArray, cpDaysArray, creBundlesArray, creSwabsArray, x
     ## for now, compute some common costs:
     cGlovesDict = params['interventionParameters']['glovesPair']['cost']
     cGloves = Cost(Distribution(cGlovesDict['distribution']['type'],
-                                cGlovesDict['distribution']['args']).draw(),
+                                cGlovesDict['distribution']['args']).draw(nReals),
                    cGlovesDict['year'])
             
     cGownsDict = params['interventionParameters']['gowns']['cost']
     cGowns = Cost(Distribution(cGownsDict['distribution']['type'],
-                               cGownsDict['distribution']['args']).draw(),
+                               cGownsDict['distribution']['args']).draw(nReals),
                   cGownsDict['year'])
     
     rNurseWageDict = params['costs']['regNurseHourlyWage']
     rNurseWage = Cost(Distribution(rNurseWageDict['distribution']['type'],
-                                   rNurseWageDict['distribution']['args']).draw(),
+                                   rNurseWageDict['distribution']['args']).draw(nReals),
                       rNurseWageDict['year'])
     
-    #xdroCosts = {}
-    contPrecCostsByAbbrev = {}#defaultdict(lambda: Cost(0.0,opts.targetYear))
-    bundleCostsByAbbrev = {}#defaultdict(lambda: Cost(0.0, opts.targetYear))
-    outcomesDictByAbbrev = {}#defaultdict(lambda: Cost(0.0, opts.targetYear))
-    xdroCostsByAbbrev = {}#defaultdict(lambda: Cost(0.0, opts.targetYear))
-    print "going into abbrevs"
+    costsOfReal = {}
     for abbrev in abbrevs:  
-        print "Computing for {0}".format(abbrev)
-       
-        #contPrecCosts = Cost(0.0,opts.targetyear)
-        #for fType,cpDays in cpDaysByType.items():
-        print facDict[abbrev]['category']
-        cpCosts = computeCostsOfContactPrecautions(cpDaysByType[abbrev], facDict[abbrev]['category'],
-                                                   rNurseWage, cGloves, cGowns, opts.targetyear, params)
-        print "cpCosts = {0}".format(cpCosts)
-        contPrecCostsByAbbrev[abbrev] = Cost(cpCosts['pCP'].value + cpCosts['oCP'].value,opts.targetyear)
-        #    cpst = computeCostsOfContactPrecautions(cpDays, fType, rNurseWage, cGloves, cGowns, opts.targetyear, params) 
-        #print "shouldn't be doing this"
-        #contPrecCostsByAbbrev[abbrev] =Cost(0.0,2017)
-        #print "no CP yet"
-        print creSwabsAll[abbrev]
-        bundleCostsByAbbrev[abbrev] = Cost(computeCostsOfBundles(creBundlesAll[abbrev], creSwabsAll[abbrev], opts.targetyear, params).value + \
-                                                          cpCosts['aCP'].value,opts.targetyear) # replace with RHEA
-        print "Bundle done"
+        cpDays = {k: sampleNotes(cpDaysArray, abbrev, k) for k in ['pCP', 'aCP', 'xCP', 'oCP']}
+        cpCosts = computeCostsOfContactPrecautions(cpDays, facDict[abbrev]['category'],
+                                                   rNurseWage, cGloves, cGowns, opts.targetyear, params,
+                                                   size_=nReals)
+        contPrecCosts = cpCosts['pCP'].value + cpCosts['oCP'].value
+        bundleCosts = (computeCostsOfBundles(sampleNotes(creBundlesArray, abbrev),
+                                             sampleNotes(creSwabsArray, abbrev),
+                                             opts.targetyear, params, size_=nReals).value
+                       + cpCosts['aCP'].value)
         if opts.xdroyamlfile: 
-            xdroCostsByAbbrev[abbrev] = Cost(computeCostOfXDROReg(xdroAll[abbrev],opts.targetyear, params).value + cpCosts['xCP'].value,opts.targetyear) # replace with RHEA
+            xdroCosts = (computeCostOfXDROReg(sampleNotes(xdroArray, abbrev), opts.targetyear,
+                                              params, size_=nReals).value
+                         + cpCosts['xCP'].value)
         else:
-            xdroCostsByAbbrev[abbrev] = Cost(0.0,opts.targetyear)#computeCostOfXDROReg()
-        print "not sure yet"
-        #sys.stdout.flush()
-        #print "NCOLALL = {0}".format(newColAll)
-        #sys.stdout.flush()
-        outcomesDictByAbbrev[abbrev] = determineOutcomes(newColAll[abbrev],0,infectionGivenCol,fracAttribMort,cGloves,cGowns,
-                                                         rNurseWage, personAge, annualWage, hourlyWage, opts.targetyear, params) # Replace with RHEA
-        print "This is the granddady"
-        #sys.stdout.flush()
-        #costsOfRealization[i]['outcomesDict'] = outcomesDict
-    
-    #print "bUNLES = {0}".format(bundleCostsByAbbrev)
-    totalSocByAbbrev = {}#defaultdict(lambda: 0.0)
-    totalQALYByAbbrev = {}#defaultdict(lambda: 0.0)
-    totalHospByAbbrev = {}#defaultdict(lambda: 0.0)
-    total3rdByAbbrev = {}#defaultdict(lambda: 0.0)
-    totalCasesByAbbrev = {}#defaultdict(lambda: 0.0)
-    totalDeadByAbbrev = {}#defaultdict(lambda: 0.0)
-    
-    for abbrev in abbrevs:
-        print "collecting for abbrev = {0}".format(abbrev)
-        totalCasesByAbbrev[abbrev] = 0.0
-        totalDeadByAbbrev[abbrev] = 0.0
-        totalQALYByAbbrev[abbrev] = 0.0
-        totalHospByAbbrev[abbrev] = 0.0
-        total3rdByAbbrev[abbrev] = 0.0
-        totalSocByAbbrev[abbrev] = 0.0
-        for oC,oCD in outcomesDictByAbbrev[abbrev].items():
+            xdroCosts = np.zeros(nReals)
+        outcomesDict = determineOutcomes(sampleNotes(newColsArray, abbrev), 0, infectionGivenCol,
+                                         fracAttribMort, cGloves, cGowns, rNurseWage, personAge,
+                                         annualWage, hourlyWage, opts.targetyear, params,
+                                         npvTables, size_=nReals)
+
+        totalCases = np.zeros(nReals)
+        totalDead = np.zeros(nReals)
+        totalQALY = np.zeros(nReals)
+        totalHosp = np.zeros(nReals)
+        total3rd = np.zeros(nReals)
+        totalSoc = np.zeros(nReals)
+        for oC,oCD in outcomesDict.items():
             if oC not in ['pneumoniaAll']:
-                #print oC
-                totalCasesByAbbrev[abbrev] += oCD['nCases']
-                totalDeadByAbbrev[abbrev] += oCD['nDead']
-                totalQALYByAbbrev[abbrev] += oCD['QALYs Lost'].value
-                totalHospByAbbrev[abbrev] += oCD['Hospitalization Cost'].value
-                total3rdByAbbrev[abbrev] += oCD['thirdParty Costs'].value
-                totalSocByAbbrev[abbrev] += oCD['thirdParty Costs'].value + oCD['Productivity Lost'].value + oCD['Losses Due to Mortality'].value
-    
-    
-        costsOfReal[abbrev]['NewColonizations'] = newColAll
-        #print "yes"
-        costsOfReal[abbrev]['CRE Bundle Intervention Costs'] = bundleCostsByAbbrev[abbrev]
-        #print "yes yes"
-        costsOfReal[abbrev]['XDRO Intervention Costs'] = xdroCostsByAbbrev[abbrev]
-        #print "yes yes yes"
-        costsOfReal[abbrev]['Non Intervention CP Costs'] = contPrecCostsByAbbrev[abbrev]
-        #print "No"
-       # Cost(cpCosts['pCP'].value + cpCosts['oCP'].value,opts.targetyear)
-        costsOfReal[abbrev]['Intervention Costs'] = Cost(xdroCostsByAbbrev[abbrev].value + contPrecCostsByAbbrev[abbrev].value + bundleCostsByAbbrev[abbrev].value,opts.targetyear)
-        costsOfReal[abbrev]['QALYs Lost'] = Cost(totalQALYByAbbrev[abbrev],opts.targetyear)
-        costsOfReal[abbrev]['Hospitalization Costs'] = Cost(totalHospByAbbrev[abbrev],opts.targetyear)
-        costsOfReal[abbrev]['thirdParty Costs'] = Cost(total3rdByAbbrev[abbrev],opts.targetyear)
-        costsOfReal[abbrev]['Societal Costs'] = Cost(totalSocByAbbrev[abbrev],opts.targetyear)
-        costsOfReal[abbrev]['Cases'] = totalCasesByAbbrev[abbrev]
-        costsOfReal[abbrev]['Deaths'] = totalDeadByAbbrev[abbrev]
-        #costsOfReal[abbrev]['cpDays'] =  0.0 #sum([x for k,x in cpDaysByType[abbrev].items()])
-        costsOfReal[abbrev]['CRE Bundles'] = creBundlesAll[abbrev]
+                totalCases += oCD['nCases']
+                totalDead += oCD['nDead']
+                totalQALY += oCD['QALYs Lost'].value
+                totalHosp += oCD['Hospitalization Cost'].value
+                total3rd += oCD['thirdParty Costs'].value
+                totalSoc += oCD['thirdParty Costs'].value + oCD['Productivity Lost'].value + oCD['Losses Due to Mortality'].value
+
+        costsOfReal[abbrev] = {'CRE Bundle Intervention Costs': bundleCosts,
+                               'XDRO Intervention Costs': xdroCosts,
+                               'Non Intervention CP Costs': contPrecCosts,
+                               'Intervention Costs': xdroCosts + contPrecCosts + bundleCosts,
+                               'QALYs Lost': totalQALY,
+                               'Hospitalization Costs': totalHosp,
+                               'thirdParty Costs': total3rd,
+                               'Societal Costs': totalSoc,
+                               'Cases': totalCases,
+                               'Deaths': totalDead}
     return costsOfReal
-    #costsOfRealizationTmp[i] = costsOfReal
 
-def determine_costs_helper(args):
-    try:
-        return determine_costs(*args)
-    except Exception as e:
-        print 'ERROR: determine_costs failed'
-        import traceback
-        traceback.print_exc(file=sys.stderr)
-        return None
-    
 def main():
     
     parser = OptionParser(usage="""
@@ -1166,23 +1158,14 @@ def main():
 
 
     for fracAttribMort in fractionAttribMorts:
-        costsOfRealization = [{} for x in range(0,nReals)]
-        costArgList = [(newColsArray, cpDaysArray, creBundlesArray, creSwabsArray, xdroArray, abbrevs,
-                        params, opts, facDict, fracAttribMort,notes) for x in range(0,nReals)]
-        pp = Pool(nprocs)
-        print costArgList[0][-1]
-        costOfRealByAbbrev = pp.map(determine_costs_helper,costArgList)
-        pp.close()
-
-    for fracAttribMort in fractionAttribMorts:
+        costOfRealByAbbrev = determine_costs(newColsArray, cpDaysArray, creBundlesArray,
+                                             creSwabsArray, xdroArray, abbrevs, params, opts,
+                                             facDict, fracAttribMort, nReals)
         for cat in costCats:
             print "stuff for cat {0}".format(cat)
             t = np.zeros(nReals)
             for abbrev in abbrevs:
-                if isinstance(costOfRealByAbbrev[0][abbrev][cat],Cost):
-                    a = np.array([costOfRealByAbbrev[i][abbrev][cat].value for i in range(0,nReals)])
-                else:
-                    a = np.array([costOfRealByAbbrev[i][abbrev][cat] for i in range(0,nReals)])
+                a = costOfRealByAbbrev[abbrev][cat]
                 t += a
                 costs[cat][fracAttribMort][abbrev]['mean'] = float(np.mean(a))
                 costs[cat][fracAttribMort][abbrev]['median'] = float(np.median(a))
@@ -20,11 +20,11 @@ import os.path
 import signal
 import optparse
 import yaml
-import cPickle as pickle
 import matplotlib.cm as pltcm
 
 import schemautils
 import pyrheautils
+import noteshards
 from map_transfer_matrix import parseFacilityData
 import phacsl.utils.formats.csv_tools as csv_tools
 import phacsl.utils.formats.yaml_tools as yaml_tools
@@ -181,9 +181,7 @@ def checkInputFileSchema(fname, schemaFname):
 
 
 def importNotes(fname):
-    with open(fname, 'r') as f:
-        stuff = pickle.load(f)
-    return stuff
+    return noteshards.readNotes(fname)
 
 
 def main():
@@ -0,0 +1,42 @@
+#! /usr/bin/env python
+
+"""
+This tool merges the per-rank notes shards written by 'pyrhea.py --shardNotes' into a
+single plain notes file, for tools which read notes files directly.  Tools which use
+noteshards.readNotes (including notes_plotter.importNotes) can read the manifest as is.
+"""
+
+import sys
+import os.path
+import optparse
+
+cwd = os.path.dirname(__file__)
+sys.path.append(os.path.join(cwd, "../sim"))
+
+import noteshards
+
+
+def main():
+    """
+    main
+    """
+    parser = optparse.OptionParser(usage="""
+    %prog manifestFile outFile
+    """)
+    opts, args = parser.parse_args()  # @UnusedVariable
+    if len(args) != 2:
+        parser.error('A manifest file name and an output file name are required')
+    manifestName, outName = args
+    parser.destroy()
+
+    nShards = 0
+    notesDict = {}
+    for shardDict in noteshards.iterNotesShards(manifestName):
+        notesDict.update(shardDict)
+        nShards += 1
+    noteshards.writeNotes(outName, notesDict)
+    print '%d notes from %d shards written to %s' % (len(notesDict), nShards, outName)
+
+
+if __name__ == "__main__":
+    main()
@@ -27,8 +27,6 @@ sys.path.append(os.path.join(cwd, "../sim"))
 import re
 import yaml
 import math
-import pickle
-import ujson
 import types
 import glob
 from imp import load_source
@@ -45,6 +43,7 @@ import phacsl.utils.formats.yaml_tools as yaml_tools
 import phacsl.utils.formats.csv_tools as csv_tools
 import phacsl.utils.notes.noteholder as noteholder
 import pyrheautils
+import noteshards
 from facilitybase import CareTier as CareTierEnum
 from facilitybase import PatientOverallHealth as OverallHealthEnum
 import schemautils
@@ -374,15 +373,8 @@ def loadFacilityTypeConstants(category, implementationDir):
 
 
 def importNotes(fname):
-    try:
-        print "loading pkl"
-        with open(fname, 'r') as f:
-            stuff = pickle.load(f)
-    except (KeyError, pickle.UnpicklingError):
-        print "loading json"
-        with open(fname, 'r') as f:
-            stuff = ujson.load(f)
-    return stuff
+    """fname may be a plain notes file or the manifest of a sharded one"""
+    return noteshards.readNotes(fname)
 
 
 def collectBarSamples(histoVal):
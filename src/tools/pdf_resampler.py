@@ -69,6 +69,11 @@ N_HOSP = None  # Number that count as hospitals for indirect-transfer purposes
 N_PREV_HOSP = None  # Possible most recent hospitals - N_HOSP + 1 for 'never hospitalized'
 DIRECT_TRANSFER_TABLE = None  # This is indexed like DTT[thisLoc][whereTransferCameFrom]
 
+"""
+Number of samples buffered by a SampleCollection between compactions
+"""
+DEFAULT_SAMPLE_BUFFER = 4 * 1024 * 1024
+
 def configureLogging(cfgDict):
     global LOGGER
     logging.config.dictConfig(cfgDict)
@@ -129,49 +134,151 @@ def testWeightedListPicker():
         print('%s: %s vs %s' % (i, sampD[i]/tot, float(counter[i])/1000000.))
 
 
-def getRandomDirectTransferSrc(facN, facR):
-    if '_directTransferWLP' not in facR:
-        wlp = WeightedListPicker(DIRECT_TRANSFER_TABLE[facN])
-        facR['_directTransferWLP'] = wlp
-    return facR['_directTransferWLP'].draw()
-
-class SampleCollection(object):
+class FacilityTables(object):
     """
-    This is implemented as a class to allow more efficient representations.
+    Per-facility quantities needed by the mutators, gathered into arrays so that the
+    proposals for a whole batch of chains can be computed at once.
     """
-    def __init__(self):
-        self.samples = np.zeros((N_FAC, DAYS_PER_YEAR, DAYS_PER_YEAR, N_SRC),
-                                dtype=np.int32)
-
-    @classmethod
-    def state(cls, facN, dayN, hospDayN, srcN, phN):
+    def __init__(self, facIdx, facDict):
+        self.losPdfM = np.empty((N_FAC, DAYS_PER_YEAR))  # LOS pdf at the middle of each day
+        self.meanPopV = np.empty(N_FAC)
+        self.transferFracV = np.empty(N_FAC)  # fraction of patients who are direct transfers
+        midDayV = np.arange(DAYS_PER_YEAR, dtype=np.float64) + 0.5
+        for facN in xrange(N_FAC):
+            facR = facDict[facIdx[facN]]
+            self.losPdfM[facN, :] = getPooledLOSCRV(facR).pdf(midDayV)
+            if 'meanPop' not in facR:
+                raise RuntimeError('%s has no meanPop' % facR['abbrev'])
+            meanPop = facR['meanPop']['value']
+            if 'totalTransfersIn' not in facR:
+                raise RuntimeError('%s has no totalTransfersIn' % facR['abbrev'])
+            ttI = facR['totalTransfersIn']['value']
+            transferPop = ttI*(getMeanPooledLOSCRV(facR)/CENSUS_DAYS)
+            self.meanPopV[facN] = meanPop
+            self.transferFracV[facN] = min(1.0, transferPop/meanPop)
+
+        # Direct transfer weights, indexed like DIRECT_TRANSFER_TABLE
+        self.dttM = np.zeros((N_FAC, N_SRC))
+        for dstN, rec in DIRECT_TRANSFER_TABLE.items():
+            for srcN, val in rec.items():
+                self.dttM[dstN, srcN] = val
+        rowTotV = np.sum(self.dttM, 1)
+        self.hasDttV = (rowTotV > 0.0)
+        # Row facN of the cumulative weights is mapped onto [facN, facN+1], so a single
+        # searchsorted on the flattened array serves every facility
+        cumM = np.cumsum(self.dttM, 1) / np.where(self.hasDttV, rowTotV, 1.0)[:, np.newaxis]
+        self.dttCumV = (cumM + np.arange(N_FAC)[:, np.newaxis]).ravel()
+        # The possible sources of each facility, in compressed-row form
+        rowV, colV = np.nonzero(self.dttM)
+        self.srcColV = colV
+        self.srcCountV = np.bincount(rowV, minlength=N_FAC)
+        self.srcPtrV = np.cumsum(self.srcCountV) - self.srcCountV
+
+    def drawWeightedSrc(self, facV):
         """
-        Arguments are facility number, days at that facility, days since last hospitalization,
-        previous facility number, most recent hospital number
+        Draw a direct transfer source for each facility in facV, weighted by the number of
+        transfers.  The result is -1 for facilities which receive no direct transfers.
         """
-        return (facN, dayN, hospDayN, srcN, phN)
+        idxV = (np.searchsorted(self.dttCumV, facV + np.random.random(len(facV)))
+                - facV * N_SRC)
+        idxV = np.clip(idxV, 0, N_SRC - 1)
+        return np.where(self.hasDttV[facV], idxV, -1)
 
-    @classmethod
-    def split(cls, state):
+    def drawUniformSrc(self, facV):
         """
-        The opposite of state()
+        Draw a direct transfer source for each facility in facV, with equal odds for each
+        facility which sends it transfers.  The result is -1 where there are none.
         """
-        # This works as long as state is just a tuple
-        return state
+        nV = self.srcCountV[facV]
+        offV = (np.random.random(len(facV)) * nV).astype(np.int64)
+        rsltV = np.full(len(facV), -1, dtype=np.int64)
+        flagV = (nV > 0)
+        rsltV[flagV] = self.srcColV[self.srcPtrV[facV[flagV]] + offV[flagV]]
+        return rsltV
+
+
+class ChainStates(object):
+    """
+    The states of a batch of independent chains, one array per state component:
+    facility number, days at that facility, days since last hospitalization,
+    previous facility number, most recent hospital number
+    """
+    def __init__(self, nChains, facN, dayN, hospDayN, srcN, phN):
+        self.facV = np.full(nChains, facN, dtype=np.int64)
+        self.dayV = np.full(nChains, dayN, dtype=np.int64)
+        self.hospDayV = np.full(nChains, hospDayN, dtype=np.int64)
+        self.srcV = np.full(nChains, srcN, dtype=np.int64)
+        self.phV = np.full(nChains, phN, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.facV)
+
+
+class SampleCollection(object):
+    """
+    Sample counts indexed by (facN, dayN, hospDayN, srcN).  Nearly all possible states are
+    never visited, so the counts are stored sparsely: new samples are appended to a
+    buffer of flat indices, and when the buffer fills it is compacted into sorted arrays
+    of the distinct indices seen so far and their counts.
+    """
+    def __init__(self, bufSize=DEFAULT_SAMPLE_BUFFER):
+        self.shape = (N_FAC, DAYS_PER_YEAR, DAYS_PER_YEAR, N_SRC)
+        self.bufV = np.empty(bufSize, dtype=np.int64)
+        self.nBuf = 0
+        self.keyV = np.zeros(0, dtype=np.int64)
+        self.countV = np.zeros(0, dtype=np.int64)
+
+    def sample(self, chains):
+        """Add one sample for the current state of each chain"""
+        flatV = np.ravel_multi_index((chains.facV, chains.dayV, chains.hospDayV, chains.srcV),
+                                     self.shape)
+        if self.nBuf + len(flatV) > len(self.bufV):
+            self.compact()
+        if len(flatV) > len(self.bufV):
+            self._merge(flatV)
+        else:
+            self.bufV[self.nBuf: self.nBuf + len(flatV)] = flatV
+            self.nBuf += len(flatV)
 
-    def sample(self, state):
-        facN, dayN, hospDayN, srcN, phN = state
-        self.samples[facN, dayN, hospDayN, srcN] += 1
+    def _merge(self, flatV):
+        keyV, invV = np.unique(np.concatenate((self.keyV, flatV)), return_inverse=True)
+        wtV = np.concatenate((self.countV, np.ones(len(flatV), dtype=np.int64)))
+        self.countV = np.bincount(invV, weights=wtV).astype(np.int64)
+        self.keyV = keyV
+
+    def compact(self):
+        if self.nBuf:
+            self._merge(self.bufV[:self.nBuf])
+            self.nBuf = 0
+
+    def marginal(self, axis, hospDayN, srcN):
+        """
+        Returns the sample counts along the given axis (0 for facility, 1 for days at the
+        facility) for the given days since hospitalization and source, summed over the
+        other axis.
+        """
+        self.compact()
+        facV, dayV, hospDayV, srcV = np.unravel_index(self.keyV, self.shape)
+        flagV = (hospDayV == hospDayN) & (srcV == srcN)
+        idxV = [facV, dayV][axis][flagV]
+        return np.bincount(idxV, weights=self.countV[flagV],
+                           minlength=self.shape[axis]).astype(np.int64)
 
 
 class Mutator(object):
+    """
+    Mutators work on a batch of chains at once.  sel is the array of indices of the chains
+    proposing this mutation.  select() returns an array of acceptance ratios, one per
+    selected chain, and a descriptor which is a tuple of arrays aligned with sel.  apply()
+    is then called with the accepted chains and the matching entries of the descriptor.
+    """
     @classmethod
-    def select(cls, state, facIdx, facDict):
-        #print(cls.__name__)
-        return 1.0, None
+    def select(cls, chains, sel, tables):
+        return np.ones(len(sel)), ()
+
     @classmethod
-    def apply(s, state, descriptor):
-        return state
+    def apply(cls, chains, sel, descriptor):
+        pass
 
 
 class BinSwap(Mutator):
@@ -179,21 +286,18 @@ class BinSwap(Mutator):
     Change LOS date, staying within a facility
     """
     @classmethod
-    def select(cls, state, facIdx, facDict):
-        facN, dayN, hospDay, srcN, phN = SampleCollection.split(state)
-        baseAR, baseDesc = super(BinSwap, cls).select(state, facIdx, facDict)
-        facR = facDict[facIdx[facN]]
-        newDayN = np.random.randint(0, DAYS_PER_YEAR)  # new time since arrival
-        losCRV = getPooledLOSCRV(facR)
-        aR = baseAR * min(losCRV.pdf(float(newDayN) + 0.5)/losCRV.pdf(float(dayN) + 0.5),
-                          1.0)
-        return aR, (newDayN, baseDesc)
+    def select(cls, chains, sel, tables):
+        facV = chains.facV[sel]
+        newDayV = np.random.randint(0, DAYS_PER_YEAR, size=len(sel))  # new time since arrival
+        with np.errstate(divide='ignore', invalid='ignore'):
+            aRV = np.minimum(tables.losPdfM[facV, newDayV]
+                             / tables.losPdfM[facV, chains.dayV[sel]], 1.0)
+        return aRV, (newDayV,)
+
     @classmethod
-    def apply(cls, state, descriptor):
-        newDayN, baseDesc = descriptor
-        state = super(BinSwap, cls).apply(state, baseDesc)
-        facN, dayN, hospDay, srcN, phN = SampleCollection.split(state)
-        return SampleCollection.state(facN, newDayN, hospDay, srcN, phN)
+    def apply(cls, chains, sel, descriptor):
+        newDayV, = descriptor
+        chains.dayV[sel] = newDayV
 
 
 class FacSwap(Mutator):
@@ -202,32 +306,19 @@ class FacSwap(Mutator):
     correlation between before-and-after dates- that would require a conditional probability
     """
     @classmethod
-    def select(cls, state, facIdx, facDict):
-        facN, dayN, hospDay, srcN, phN = SampleCollection.split(state)
-        baseAR, baseDesc = super(FacSwap, cls).select(state, facIdx, facDict)
-        facR = facDict[facIdx[facN]]
-        if 'meanPop' in facR:
-            oMP = facR['meanPop']['value']
-        else:
-            raise RuntimeError('%s has no meanPop' % facR['abbrev'])
-        newFacN = np.random.randint(0, N_FAC)  # new facility
-        if newFacN == facN:
-            # reject self-transfers because the mutator would conflict with the LOS pdf
-            return 0.0, baseDesc
-        newFacR = facDict[facIdx[newFacN]]
-        if 'meanPop' in newFacR:
-            nMP = newFacR['meanPop']['value']
-        else:
-            raise RuntimeError('%s has no meanPop' % newFacR['abbrev'])
-        aR = baseAR * min((nMP/oMP), 1.0)
-        return aR, (newFacN, baseDesc)
+    def select(cls, chains, sel, tables):
+        facV = chains.facV[sel]
+        newFacV = np.random.randint(0, N_FAC, size=len(sel))  # new facility
+        aRV = np.minimum(tables.meanPopV[newFacV] / tables.meanPopV[facV], 1.0)
+        # reject self-transfers because the mutator would conflict with the LOS pdf
+        aRV[newFacV == facV] = 0.0
+        return aRV, (newFacV,)
+
     @classmethod
-    def apply(cls, state, descriptor):
-        newFacN, baseDesc = descriptor
-        newDayN = np.random.randint(0, DAYS_PER_YEAR)
-        state = super(FacSwap, cls).apply(state, baseDesc)
-        facN, dayN, hospDay, srcN, phN = SampleCollection.split(state)
-        return SampleCollection.state(newFacN, newDayN, hospDay, srcN, phN)
+    def apply(cls, chains, sel, descriptor):
+        newFacV, = descriptor
+        chains.facV[sel] = newFacV
+        chains.dayV[sel] = np.random.randint(0, DAYS_PER_YEAR, size=len(sel))
 
 
 class IsTransferSwap(Mutator):
@@ -236,31 +327,19 @@ class IsTransferSwap(Mutator):
     ratio is based on the fraction of patients that are direct transfers.
     """
     @classmethod
-    def select(cls, state, facIdx, facDict):
-        facN, dayN, hospDay, srcN, phN = SampleCollection.split(state)
-        baseAR, baseDesc = super(IsTransferSwap, cls).select(state, facIdx, facDict)
-        facR = facDict[facIdx[facN]]
-        if 'meanPop' not in facR:
-            raise RuntimeError('%s has no meanPop' % facR['abbrev'])
-        meanPop = facR['meanPop']['value']
-        if 'totalTransfersIn' not in facR:
-            raise RuntimeError('%s has no totalTransfersIn' % facR['abbrev'])
-        ttI = facR['totalTransfersIn']['value']
-        meanPooledLOS = getMeanPooledLOSCRV(facR)
-        transferPop = ttI*(meanPooledLOS/CENSUS_DAYS)
-        transferFrac = min(1.0, transferPop/meanPop)
-        if srcN == N_FAC:
-            return baseAR * transferFrac, (transferFrac, getRandomDirectTransferSrc(facN, facR),
-                                           baseDesc)
-        else:
-            return baseAR * (1.0 - transferFrac), (transferFrac, N_FAC, baseDesc)
+    def select(cls, chains, sel, tables):
+        facV = chains.facV[sel]
+        transferFracV = tables.transferFracV[facV]
+        fromHomeV = (chains.srcV[sel] == N_FAC)
+        newSrcV = np.where(fromHomeV, tables.drawWeightedSrc(facV), N_FAC)
+        aRV = np.where(fromHomeV, transferFracV, 1.0 - transferFracV)
+        aRV[newSrcV < 0] = 0.0  # this facility receives no direct transfers
+        return aRV, (newSrcV,)
 
     @classmethod
-    def apply(cls, state, descriptor):
-        transferFrac, newSrcN, baseDesc = descriptor
-        state = super(IsTransferSwap, cls).apply(state, baseDesc)
-        facN, dayN, hospDay, srcN, phN = SampleCollection.split(state)
-        return SampleCollection.state(facN, dayN, hospDay, newSrcN, phN)
+    def apply(cls, chains, sel, descriptor):
+        newSrcV, = descriptor
+        chains.srcV[sel] = newSrcV
 
 
 class DirectTransferSrcSwap(Mutator):
@@ -269,30 +348,23 @@ class DirectTransferSrcSwap(Mutator):
     swap that srcN for a different srcN.
     """
     @classmethod
-    def select(cls, state, facIdx, facDict):
-        facN, dayN, hospDay, srcN, phN = SampleCollection.split(state)
-        baseAR, baseDesc = super(DirectTransferSrcSwap, cls).select(state, facIdx, facDict)
-        if srcN == N_FAC:
-            # No direct transfer src swaps if the src was the community
-            return 0.0, (srcN, baseDesc)
-        myDDT = DIRECT_TRANSFER_TABLE[facN]
-        newSrcN = np.random.choice(myDDT.keys())
-        if newSrcN == srcN:
-            return 0.0, (srcN, baseDesc)  # why bother
-        nWt = float(myDDT[newSrcN])
-        if srcN in myDDT:
-            #oWt = (float(myDDT[srcN]) if srcN in myDDT else 0.0)
-            oWt = float(myDDT[srcN])
-            return baseAR * min(1.0, nWt/oWt), (newSrcN, baseDesc)
-        else:
-            return baseAR, (newSrcN, baseDesc)
+    def select(cls, chains, sel, tables):
+        facV = chains.facV[sel]
+        srcV = chains.srcV[sel]
+        newSrcV = tables.drawUniformSrc(facV)
+        nWtV = tables.dttM[facV, newSrcV]
+        oWtV = tables.dttM[facV, srcV]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            aRV = np.where(oWtV > 0.0, np.minimum(nWtV / oWtV, 1.0), 1.0)
+        # No direct transfer src swaps if the src was the community, and why bother
+        # if the src would not change
+        aRV[(srcV == N_FAC) | (newSrcV == srcV) | (newSrcV < 0)] = 0.0
+        return aRV, (newSrcV,)
 
     @classmethod
-    def apply(cls, state, descriptor):
-        newSrcN, baseDesc = descriptor
-        state = super(DirectTransferSrcSwap, cls).apply(state, baseDesc)
-        facN, dayN, hospDay, srcN, phN = SampleCollection.split(state)
-        return SampleCollection.state(facN, dayN, hospDay, newSrcN, phN)
+    def apply(cls, chains, sel, descriptor):
+        newSrcV, = descriptor
+        chains.srcV[sel] = newSrcV
 
 
 class IsIndirectTransferSwap(Mutator):
@@ -308,32 +380,10 @@ class IsIndirectTransferSwap(Mutator):
       odds of transfer from new phN to home, odds of transfer home to facN
     Constraints on state:
      -srcN must be home
-    """
-    @classmethod
-    def select(cls, state, facIdx, facDict):
-        facN, dayN, hospDay, srcN, phN = SampleCollection.split(state)
-        baseAR, baseDesc = super(DirectTransferSrcSwap, cls).select(state, facIdx, facDict)
-        if srcN == N_FAC:
-            # No direct transfer src swaps if the src was the community
-            return 0.0, (srcN, baseDesc)
-        myDDT = DIRECT_TRANSFER_TABLE[facN]
-        newSrcN = np.random.choice(myDDT.keys())
-        if newSrcN == srcN:
-            return 0.0, (srcN, baseDesc)  # why bother
-        nWt = float(myDDT[newSrcN])
-        if srcN in myDDT:
-            #oWt = (float(myDDT[srcN]) if srcN in myDDT else 0.0)
-            oWt = float(myDDT[srcN])
-            return baseAR * min(1.0, nWt/oWt), (newSrcN, baseDesc)
-        else:
-            return baseAR, (newSrcN, baseDesc)
 
-    @classmethod
-    def apply(cls, state, descriptor):
-        newSrcN, baseDesc = descriptor
-        state = super(DirectTransferSrcSwap, cls).apply(state, baseDesc)
-        facN, dayN, hospDay, srcN, phN = SampleCollection.split(state)
-        return SampleCollection.state(facN, dayN, hospDay, newSrcN, phN)
+    Not yet implemented, so this mutator is not in MUTATIONS.
+    """
+    pass
 
 
 class NHIndirect(Mutator):
@@ -353,14 +403,20 @@ def main():
     global DIRECT_TRANSFER_TABLE
 
     parser = OptionParser(usage="""
-    %prog [--verbose] run_descr.yaml
+    %prog [--verbose] [--chains n] [--steps n] run_descr.yaml
     """)
     parser.add_option('-v', '--verbose', action='store_true',
                       help="request verbose output")
+    parser.add_option('--chains', type='int', default=1,
+                      help="number of independent chains, all updated together (default %default)")
+    parser.add_option('--steps', type='int', default=100000,
+                      help="number of mutation steps for each chain (default %default)")
 
     opts, args = parser.parse_args()
     if len(args) != 1:
         parser.error('A YAML run description is required')
+    if opts.chains < 1 or opts.steps < 1:
+        parser.error('--chains and --steps must be at least 1')
 
 #     if not opts.notes:
 #         parser.error('At least one --notes option is required')
@@ -419,26 +475,41 @@ def main():
     N_SRC = N_FAC + 1  # the additional value is for 'came from home'
     N_HOSP = len(hospIdx)
     N_PREV_HOSP = N_HOSP + 1 # the additional value is 'no previous hospitalization'
+    tables = FacilityTables(facIdx, facDict)
     samples = SampleCollection()
     facN = 1
     losDay = 0
     hospDay = 1
     srcN = N_FAC  # which means this sample came from 'home'
     prevHospN = N_HOSP  # which means no prev hospitalization
-    state = samples.state(facN, losDay, hospDay, srcN, prevHospN)
-    for loop in xrange(100000):  # @UnusedVariable
+    chains = ChainStates(opts.chains, facN, losDay, hospDay, srcN, prevHospN)
+    proposedD = defaultdict(int)
+    acceptedD = defaultdict(int)
+    for loop in xrange(opts.steps):  # @UnusedVariable
 #    while True:
-        samples.sample(state)
-        mutator = np.random.choice(MUTATIONS)
-        acceptRatio, descriptor = mutator.select(state, facIdx, facDict)
-        if np.random.random() < acceptRatio:
-            print('aR %s -> update %s %s' % (acceptRatio, mutator.__name__, descriptor))
-            state = mutator.apply(state, descriptor)
-        else:
-            print('aR %s -> reject %s %s' % (acceptRatio, mutator.__name__, descriptor))
-    facN, losDay, hospDay, srcN, prevHospN = SampleCollection.split(state)
-    print(np.sum(samples.samples, 0)[:, hospDay, srcN])
-    print(np.sum(samples.samples, 1)[:, hospDay, srcN])
+        samples.sample(chains)
+        mutV = np.random.randint(0, len(MUTATIONS), size=len(chains))
+        for mutN, mutator in enumerate(MUTATIONS):
+            sel = np.flatnonzero(mutV == mutN)
+            if not len(sel):
+                continue
+            aRV, descriptor = mutator.select(chains, sel, tables)
+            acceptV = (np.random.random(len(sel)) < aRV)
+            mutator.apply(chains, sel[acceptV], tuple([d[acceptV] for d in descriptor]))
+            proposedD[mutator.__name__] += len(sel)
+            acceptedD[mutator.__name__] += np.count_nonzero(acceptV)
+        if opts.verbose:
+            LOGGER.debug('step %d: %s', loop,
+                         ', '.join(['%s %d of %d' % (mut.__name__, acceptedD[mut.__name__],
+                                                     proposedD[mut.__name__])
+                                    for mut in MUTATIONS]))
+    for mutator in MUTATIONS:
+        print('%s: accepted %d of %d' % (mutator.__name__, acceptedD[mutator.__name__],
+                                         proposedD[mutator.__name__]))
+    hospDay = chains.hospDayV[0]
+    srcN = chains.srcV[0]
+    print(samples.marginal(1, hospDay, srcN))
+    print(samples.marginal(0, hospDay, srcN))
 
 #############
 # Input types:
@@ -1,15 +1,16 @@
 #!/usr/bin/env python
-import pika
+import os
+import socket
 import pickle
 import logging
 from optparse import OptionParser
 
 logger = logging.getLogger(__name__)
 
+MAX_DATAGRAM = 4 * 1024 * 1024
 
-def callback(ch, method, properties, pickledBody):
-    global fmtSet
-    bodyDict = pickle.loads(pickledBody)
+
+def logMessage(bodyDict):
     numLevel = getattr(logging, bodyDict['level'])
     extras = {newNm: bodyDict[oldNm] for oldNm, newNm in [('level', 'srclevel'),
                                                           ('pathname', 'srcpathname'),
@@ -18,10 +19,38 @@ def callback(ch, method, properties, pickledBody):
     logger.log(numLevel, bodyDict['message'], extra=extras)
 
 
+def logBody(pickledBody):
+    """The body is a single message dict or a batch of them"""
+    body = pickle.loads(pickledBody)
+    if isinstance(body, list):
+        for bodyDict in body:
+            logMessage(bodyDict)
+    else:
+        logMessage(body)
+
+
+def callback(ch, method, properties, pickledBody):
+    logBody(pickledBody)
+
+
+def listenOnSocket(path):
+    """Receive batches sent by remotelog.UnixSocketTransport"""
+    if os.path.exists(path):
+        os.remove(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(path)
+    try:
+        while True:
+            logBody(sock.recv(MAX_DATAGRAM))
+    finally:
+        sock.close()
+        os.remove(path)
+
+
 def main():
     global fmt
     parser = OptionParser(usage="""
-    %prog [-v][-d]
+    %prog [-v][-d][-l][-s socketPath]
     """)
     parser.add_option("-v", "--verbose", action="store_true",
                       help="show INFO messages and above")
@@ -29,6 +58,9 @@ def main():
                       help="show DEBUG messages and above")
     parser.add_option("-l", "--line", action="store_true",
                       help="show originating line number")
+    parser.add_option("-s", "--socket", action="store", default=None,
+                      help=("listen on this Unix domain socket rather than the RabbitMQ"
+                            " queue, e.g. /tmp/pyrhea_logger.sock"))
 
     opts, args = parser.parse_args()
     if args:
@@ -46,10 +78,6 @@ def main():
         fmt = "[%(rank)s] %(levelname)s: %(message)s"
     parser.destroy()
 
-    connection = pika.BlockingConnection(pika.ConnectionParameters(host='localhost'))
-    channel = connection.channel()
-    channel.queue_declare(queue='pyrhea_logger')
-
     logger.setLevel(logLevel)
     lChan = logging.StreamHandler()
     logger.addHandler(lChan)
@@ -57,8 +85,15 @@ def main():
     lChan.setFormatter(formatter)
 
     print 'Waiting for messages. To exit press CTRL+C'
-    channel.basic_consume(callback, queue='pyrhea_logger', no_ack=True)
-    channel.start_consuming()
+    if opts.socket:
+        listenOnSocket(opts.socket)
+    else:
+        import pika
+        connection = pika.BlockingConnection(pika.ConnectionParameters(host='localhost'))
+        channel = connection.channel()
+        channel.queue_declare(queue='pyrhea_logger')
+        channel.basic_consume(callback, queue='pyrhea_logger', no_ack=True)
+        channel.start_consuming()
 
     logging.shutdown()
 
@@ -9,9 +9,9 @@ import pandas as pd
 #import map_transfer_matrix as mtm
 import schemautils
 import pyrheautils
+import noteshards
 import phacsl.utils.formats.yaml_tools as yaml_tools
 import yaml
-import six.moves.cPickle as pickle
 import glob
 
 SCHEMA_DIR = os.path.join(os.path.dirname(__file__), os.path.pardir, 'schemata')
@@ -103,8 +103,7 @@ def getNotesFileList(notesPathList, globFlag=False):
 def readNotesFiles(notesFileList):
     notesDataList = []
     for n in notesFileList:
-        with open(n) as f:
-            notesDataList.append(pickle.load(f))
+        notesDataList.append(noteshards.readNotes(n))
 
     return notesDataList
 